@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Compare two bench/run.py result files.
+
+比較每個 case 的 median 延遲（函式 warm / distinct、HTTP 每個 concurrency）和 HTTP throughput；
+變慢超過 --threshold %（預設 10）就標 ❌，有任何 regression 時 exit code = 1。
+
+    python -m bench.compare bench/results/before.json bench/results/after.json
+    python -m bench.compare before.json after.json --threshold 20
+"""
+import sys
+import json
+import argparse
+
+
+def _rows(report):
+    """(case, metric, value, higher_is_better)"""
+    for name, r in report.get("functions", {}).items():
+        yield name, "cold ms", r.get("cold_ms"), False
+        for kind in ("warm", "distinct"):
+            yield name, f"{kind} p50 ms", r.get(kind, {}).get("median"), False
+    for name, r in report.get("http", {}).items():
+        for c, lv in r.get("levels", {}).items():
+            yield f"http {name}", f"c={c} p50 ms", lv.get("latency", {}).get("median"), False
+            yield f"http {name}", f"c={c} req/s", lv.get("throughput_rps"), True
+
+
+def compare(before, after, threshold=10.0):
+    """回傳 [(case, metric, old, new, change %, regressed)]，只列兩邊都有的"""
+    old = {(c, m): (v, hib) for c, m, v, hib in _rows(before)}
+    out = []
+    for case, metric, new, higher_is_better in _rows(after):
+        if (case, metric) not in old or old[(case, metric)][0] in (None, 0) or new is None:
+            continue
+        prev = old[(case, metric)][0]
+        change = (new - prev) / prev * 100.0
+        worse = -change if higher_is_better else change
+        out.append((case, metric, prev, new, change, worse > threshold))
+    return out
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Diff two benchmark result files")
+    p.add_argument("before")
+    p.add_argument("after")
+    p.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = p.parse_args()
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta'].get('commit') or '?'} ({before['meta'].get('started_at')})")
+    print(f"after:  {after['meta'].get('commit') or '?'} ({after['meta'].get('started_at')})")
+    rows = compare(before, after, args.threshold)
+    for case, metric, prev, new, change, regressed in rows:
+        mark = "❌" if regressed else ("✅" if abs(change) <= args.threshold else "⬆️")
+        print(f"{mark} {case:<28} {metric:<16} {prev:>11.2f} → {new:>11.2f}  {change:+7.1f}%")
+    bad = sum(r[-1] for r in rows)
+    print(f"{'❌' if bad else '✅'} {bad} regression(s) over {args.threshold:g}% in {len(rows)} metrics")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
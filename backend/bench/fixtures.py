@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic MERRA-2 / IMERG fixtures for the benchmarks.
+
+檔名、group、維度順序、變數、單位都和真的 granule 一樣，值是有季節變化的假資料（固定 seed）：
+    data/precipitation/<Y>/<M>/3B-MO.MS.MRG.3IMERG.<Y><M>01-S000000-E235959.<M>.V07B.HDF5
+        Grid/precipitation, precipitationQualityIndex, gaugeRelativeWeighting, randomError  (time, lon, lat)
+    data/temperature/<Y>/<M>/MERRA2_400.tavgM_2d_slv_Nx.<Y><M>.nc4     T2M, T2MDEW, QV2M, SLP, PS, U2M, V2M, U10M, V10M
+    data/air_quality/<Y>/<M>/MERRA2_400.tavgM_2d_aer_Nx.<Y><M>.nc4     BCSMASS, OCSMASS, SO4SMASS, DUSMASS25, SSSMASS25
+    data/rain_daily/3B-DAY.MS.MRG.3IMERG.<Y><M><D>-S000000-E235959.V07B.nc4   precipitation (time, lon, lat)
+    data/temp_daily/MERRA2_400.tavg1_2d_slv_Nx.<Y><M><D>.nc4
+    data/aer_daily/MERRA2_400.tavg1_2d_aer_Nx.<Y><M><D>.nc4
+
+網格是真的解析度（IMERG 0.1°、MERRA-2 0.5°×0.625°），預設只切出 MODEL_REGIONS 那一塊
+（和 utils/ingest.py 裁切後的檔案一樣），筆電上幾十秒就能產生；--global 產生全球檔（很大）。
+
+    python -m bench.fixtures /tmp/weatherlens-bench
+    python -m bench.fixtures /tmp/weatherlens-bench --years 2020-2025 --daily-year 2024 --global
+"""
+import os
+import argparse
+import calendar
+from datetime import date, timedelta
+
+import numpy as np
+import netCDF4 as nc
+
+from utils.config import MODEL_REGIONS
+from utils.grids import KNOWN_GRIDS
+from utils.ingest import parse_regions, region_hull
+
+SLV_VARS = ["T2M", "T2MDEW", "QV2M", "SLP", "PS", "U2M", "V2M", "U10M", "V10M"]
+AER_VARS = ["BCSMASS", "OCSMASS", "SO4SMASS", "DUSMASS25", "SSSMASS25"]
+IMERG_VARS = ["precipitation", "precipitationQualityIndex", "gaugeRelativeWeighting", "randomError"]
+LAST_MONTH = (2025, 5)   # 和 download_mon 一樣，月資料到 2025/05
+
+
+def _block(grid, bbox):
+    if bbox is None:
+        return grid.lats, grid.lons
+    li = np.where((grid.lats >= bbox[0]) & (grid.lats <= bbox[2]))[0]
+    xi = np.where((grid.lons >= bbox[1]) & (grid.lons <= bbox[3]))[0]
+    return grid.lats[li], grid.lons[xi]
+
+
+def _season(month):
+    """北半球季節：7 月 = 1、1 月 = -1"""
+    return -np.cos(2 * np.pi * (month - 1) / 12)
+
+
+def _coords(g, lats, lons, lat_dtype="f8"):
+    g.createDimension("time", 1)
+    g.createDimension("lat", len(lats))
+    g.createDimension("lon", len(lons))
+    v = g.createVariable("time", "i4", ("time",))
+    v.units = "minutes since 2000-01-01 00:00:00"
+    v[:] = 0
+    v = g.createVariable("lat", lat_dtype, ("lat",))
+    v.units = "degrees_north"
+    v[:] = lats
+    v = g.createVariable("lon", lat_dtype, ("lon",))
+    v.units = "degrees_east"
+    v[:] = lons
+
+
+def write_imerg(path, lats, lons, month, rng, daily=False):
+    """IMERG：月檔在 Grid group、日檔在 root；變數是 (time, lon, lat)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with nc.Dataset(path, "w", format="NETCDF4") as ds:
+        g = ds if daily else ds.createGroup("Grid")
+        _coords(g, lats, lons, "f4")
+        shape = (1, len(lons), len(lats))
+        wet = max(0.02, 0.25 + 0.2 * _season(month))   # mm/hr
+        for name in (["precipitation"] if daily else IMERG_VARS):
+            v = g.createVariable(name, "f4", ("time", "lon", "lat"), fill_value=np.float32(-9999.9),
+                                 zlib=True, complevel=1)
+            if name == "precipitation":
+                v.units = "mm/day" if daily else "mm/hr"
+                data = rng.gamma(0.8, wet / 0.8, shape) * (24.0 if daily else 1.0)
+            elif name == "randomError":
+                v.units = "mm/hr"
+                data = rng.gamma(0.8, wet / 4, shape)
+            else:
+                v.units = "percent" if name == "gaugeRelativeWeighting" else "1"
+                data = rng.random(shape) * (100.0 if name == "gaugeRelativeWeighting" else 1.0)
+            v[:] = data.astype(np.float32)
+
+
+def write_merra(path, lats, lons, names, month, rng):
+    """MERRA-2 (time, lat, lon)，fill 1e15"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    s = _season(month)
+    lat2d = lats[:, None] + np.zeros((1, len(lons)))
+    base = {
+        "T2M": (288.0 + 8 * s - 0.4 * (np.abs(lat2d) - 23), 1.0, "K"),
+        "T2MDEW": (283.0 + 7 * s - 0.4 * (np.abs(lat2d) - 23), 1.0, "K"),
+        "QV2M": (0.012 + 0.005 * s, 0.0008, "kg kg-1"),
+        "SLP": (101300.0 - 500 * s, 150.0, "Pa"),
+        "PS": (100800.0 - 500 * s, 150.0, "Pa"),
+        "U2M": (1.5, 1.0, "m s-1"), "V2M": (0.5, 1.0, "m s-1"),
+        "U10M": (2.5, 1.5, "m s-1"), "V10M": (1.0, 1.5, "m s-1"),
+        "BCSMASS": (1.2e-9, 2e-10, "kg m-3"), "OCSMASS": (4.0e-9, 6e-10, "kg m-3"),
+        "SO4SMASS": (3.0e-9, 5e-10, "kg m-3"), "DUSMASS25": (2.0e-9 * (1 - 0.5 * s), 4e-10, "kg m-3"),
+        "SSSMASS25": (1.5e-9, 3e-10, "kg m-3"),
+    }
+    with nc.Dataset(path, "w", format="NETCDF4") as ds:
+        _coords(ds, lats, lons)
+        for name in names:
+            mean, sd, units = base[name]
+            v = ds.createVariable(name, "f4", ("time", "lat", "lon"), fill_value=np.float32(1e15),
+                                  zlib=True, complevel=1)
+            v.units = units
+            v[0] = np.maximum(0 if units == "kg m-3" else -np.inf,
+                              mean + sd * rng.standard_normal((len(lats), len(lons)))).astype(np.float32)
+
+
+def make_fixtures(root, year_from=2020, year_to=2025, daily_year=2024, bbox=None, seed=0):
+    """root/data/... 全套假資料；回傳 {"monthly": n, "daily": n}"""
+    rng = np.random.default_rng(seed)
+    ilat, ilon = _block(KNOWN_GRIDS["imerg"], bbox)
+    mlat, mlon = _block(KNOWN_GRIDS["merra2"], bbox)
+    data = os.path.join(root, "data")
+    n_monthly = n_daily = 0
+
+    for y in range(year_from, year_to + 1):
+        for m in range(1, 13):
+            if (y, m) > LAST_MONTH:
+                break
+            ym = f"{y:04d}/{m:02d}"
+            write_imerg(f"{data}/precipitation/{ym}/3B-MO.MS.MRG.3IMERG.{y:04d}{m:02d}01-S000000-E235959."
+                        f"{m:02d}.V07B.HDF5", ilat, ilon, m, rng)
+            write_merra(f"{data}/temperature/{ym}/MERRA2_400.tavgM_2d_slv_Nx.{y:04d}{m:02d}.nc4",
+                        mlat, mlon, SLV_VARS, m, rng)
+            write_merra(f"{data}/air_quality/{ym}/MERRA2_400.tavgM_2d_aer_Nx.{y:04d}{m:02d}.nc4",
+                        mlat, mlon, AER_VARS, m, rng)
+            n_monthly += 3
+
+    day = date(daily_year, 1, 1)
+    for _ in range(366 if calendar.isleap(daily_year) else 365):
+        ymd = day.strftime("%Y%m%d")
+        write_imerg(f"{data}/rain_daily/3B-DAY.MS.MRG.3IMERG.{ymd}-S000000-E235959.V07B.nc4",
+                    ilat, ilon, day.month, rng, daily=True)
+        write_merra(f"{data}/temp_daily/MERRA2_400.tavg1_2d_slv_Nx.{ymd}.nc4",
+                    mlat, mlon, ["T2M", "PS", "QV2M", "U10M", "V10M"], day.month, rng)
+        write_merra(f"{data}/aer_daily/MERRA2_400.tavg1_2d_aer_Nx.{ymd}.nc4",
+                    mlat, mlon, AER_VARS, day.month, rng)
+        n_daily += 3
+        day += timedelta(days=1)
+    return {"monthly": n_monthly, "daily": n_daily,
+            "imerg_grid": [len(ilat), len(ilon)], "merra2_grid": [len(mlat), len(mlon)]}
+
+
+def default_bbox():
+    return region_hull(parse_regions(MODEL_REGIONS))
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Generate synthetic MERRA-2 / IMERG granules for benchmarks")
+    p.add_argument("root", help="output directory (data/ is created inside)")
+    p.add_argument("--years", default="2020-2025")
+    p.add_argument("--daily-year", type=int, default=2024)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--global", dest="whole", action="store_true", help="full global grids (several GB)")
+    args = p.parse_args()
+    lo, _, hi = args.years.partition("-")
+    info = make_fixtures(args.root, int(lo), int(hi or lo), args.daily_year,
+                         None if args.whole else default_bbox(), args.seed)
+    print(f"✅ {info} → {args.root}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible latency / throughput benchmarks (offline).
+
+1. 在 --data 產生（或沿用）bench/fixtures.py 的假資料，整個 run 都在那個資料夾底下執行
+2. 函式：run_climate_forecast / pred / pred_precipitation / pred_air_quality / plot_all / generate_monthly_csv
+       cold     第一次呼叫（含模型 fit、開檔）
+       warm     同一個點重複 --repeat 次（走 cache）
+       distinct --repeat 個不同的點（不同格點，cache 不會命中）
+3. HTTP：同一個 process 裡起 uvicorn（含 lifespan、worker lanes），每個 endpoint 在各個
+   --concurrency 下送 repeat × concurrency 個 request；記延遲分布、throughput、status code
+4. 結果寫成 JSON（bench/results/<時間>.json），用 bench/compare.py 比兩次的差異
+
+點的位置、日期、fixture 都由 --seed 決定，同一台機器重跑結果可以直接比。
+
+    python -m bench.run
+    python -m bench.run --data /tmp/weatherlens-bench --repeat 10 --concurrency 1,8,32
+    python -m bench.run --only weather --skip-functions
+    python -m bench.compare bench/results/a.json bench/results/b.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import socket
+import platform
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)   # 之後會 chdir 到 fixture 資料夾
+
+from bench.fixtures import default_bbox, make_fixtures
+
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+FORECAST_DATE = "2024-10-02"
+MONTH_START = "2025-10-04T08:00:00Z"
+
+
+# ==============================
+# Helpers
+# ==============================
+def sample_points(n, bbox, seed):
+    """bbox 內固定 seed 的 n 個點（離邊界至少 0.5°）"""
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(bbox[0] + 0.5, bbox[2] - 0.5, n)
+    lon = rng.uniform(bbox[1] + 0.5, bbox[3] - 0.5, n)
+    return [(round(float(a), 3), round(float(b), 3)) for a, b in zip(lat, lon)]
+
+
+def summarize(samples_ms):
+    a = np.asarray(samples_ms, dtype=np.float64)
+    if a.size == 0:
+        return {"n": 0}
+    return {"n": int(a.size), "min": round(float(a.min()), 3), "median": round(float(np.median(a)), 3),
+            "p95": round(float(np.percentile(a, 95)), 3), "max": round(float(a.max()), 3),
+            "mean": round(float(a.mean()), 3)}
+
+
+def timed(fn, *args):
+    """(ms, result)；被測函式的 print 不輸出"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        return (time.perf_counter() - t0) * 1000.0, out
+
+
+def environment(args, fixture_info):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "repeat": args.repeat,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "fixtures": fixture_info,
+    }
+
+
+# ==============================
+# Function benchmarks
+# ==============================
+def function_cases():
+    from day.daily import run_climate_forecast
+    from month.temperature import pred
+    from month.precipitation import pred_precipitation
+    from month.air import pred_air_quality
+    from utils.plot import plot_all
+    from utils.generate_csv import generate_monthly_csv
+    end = "2024-10-05"
+    return [
+        ("run_climate_forecast", run_climate_forecast, lambda p: (p[0], p[1], FORECAST_DATE, end)),
+        ("pred", pred, lambda p: p),
+        ("pred_precipitation", pred_precipitation, lambda p: p),
+        ("pred_air_quality", pred_air_quality, lambda p: p),
+        ("plot_all", plot_all, lambda p: ("10", p[0], p[1])),
+        ("generate_monthly_csv", generate_monthly_csv, lambda p: p),
+    ]
+
+
+def bench_functions(points, repeat, only=None):
+    results = {}
+    for name, fn, make_args in function_cases():
+        if only and only not in name:
+            continue
+        cold, _ = timed(fn, *make_args(points[0]))
+        warm = [timed(fn, *make_args(points[0]))[0] for _ in range(repeat)]
+        distinct = [timed(fn, *make_args(p))[0] for p in points[1:repeat + 1]]
+        results[name] = {"cold_ms": round(cold, 3), "warm": summarize(warm), "distinct": summarize(distinct)}
+        print(f"  ⏱️ {name:<22} cold {cold:9.1f} ms  warm p50 {results[name]['warm']['median']:9.1f} ms  "
+              f"distinct p50 {results[name]['distinct'].get('median', float('nan')):9.1f} ms")
+    return results
+
+
+# ==============================
+# HTTP benchmarks
+# ==============================
+def http_cases(points):
+    bbox = default_bbox()
+    grid = {"lat_min": bbox[0] + 1, "lon_min": bbox[1] + 1, "lat_max": bbox[0] + 3, "lon_max": bbox[1] + 3}
+
+    def q(**kw):
+        return "?" + "&".join(f"{k}={v}" for k, v in kw.items())
+
+    return [
+        ("health", lambda i, p: ("GET", "/api/health", None)),
+        ("catalog", lambda i, p: ("GET", "/api/catalog", None)),
+        ("weather", lambda i, p: ("GET", "/api/weather" + q(latitude=p[0], longitude=p[1],
+                                                            datetime=FORECAST_DATE), None)),
+        ("weather_batch", lambda i, p: ("POST", "/api/weather/batch", {"items": [
+            {"latitude": a, "longitude": b, "datetime": FORECAST_DATE} for a, b in points[:8]]})),
+        ("weather_grid", lambda i, p: ("GET", "/api/weather/grid" + q(datetime=FORECAST_DATE, step=0.5,
+                                                                      **grid), None)),
+        ("weather_month", lambda i, p: ("GET", "/api/weather/month" + q(latitude=p[0], longitude=p[1],
+                                                                        starttime=MONTH_START,
+                                                                        endtime=MONTH_START), None)),
+        ("plot", lambda i, p: ("POST", "/api/plot", {"month": "10", "lat": p[0], "lon": p[1]})),
+        ("history_csv", lambda i, p: ("GET", "/api/history.csv" + q(latitude=p[0], longitude=p[1]), None)),
+        ("history_parquet", lambda i, p: ("GET", "/api/history.parquet" + q(latitude=p[0], longitude=p[1]),
+                                          None)),
+        ("history_bulk", lambda i, p: ("POST", "/api/history/bulk", {
+            "sites": [{"latitude": a, "longitude": b} for a, b in points[:20]], "format": "csv"})),
+    ]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve():
+    """同一個 process 裡起 uvicorn（main:app，含 lifespan）"""
+    import uvicorn
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config("main:app", host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread.start()
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("uvicorn failed to start")
+            time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+
+
+def _request(base, method, path, body):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method,
+                                 headers={"Content-Type": "application/json"} if data else {})
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=600) as r:
+            r.read()
+            status = r.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return (time.perf_counter() - t0) * 1000.0, status
+
+
+def bench_http(points, repeat, levels, only=None):
+    results = {}
+    with serve() as base:
+        for name, make in http_cases(points):
+            if only and only not in name:
+                continue
+            cold, cold_status = _request(base, *make(0, points[0]))
+            per_level = {}
+            for c in levels:
+                n = max(c, repeat * c)
+                jobs = [make(i, points[i % len(points)]) for i in range(n)]
+                t0 = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=c) as pool:
+                    done = list(pool.map(lambda job: _request(base, *job), jobs))
+                wall = time.perf_counter() - t0
+                status = {}
+                for _, s in done:
+                    status[str(s)] = status.get(str(s), 0) + 1
+                per_level[str(c)] = {
+                    "latency": summarize([ms for ms, s in done if s == 200]),
+                    "throughput_rps": round(n / wall, 3),
+                    "status": status,
+                }
+                print(f"  🌐 {name:<16} c={c:<3} p50 {per_level[str(c)]['latency'].get('median', float('nan')):9.1f} ms"
+                      f"  {per_level[str(c)]['throughput_rps']:8.2f} req/s  {status}")
+            results[name] = {"cold_ms": round(cold, 3), "cold_status": cold_status, "levels": per_level}
+    return results
+
+
+# ==============================
+# CLI
+# ==============================
+def main_cli():
+    p = argparse.ArgumentParser(description="Offline benchmarks on synthetic MERRA-2 / IMERG fixtures")
+    p.add_argument("--data", help="fixture root (generated when it has no data/ yet); default: temp dir")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--concurrency", default="1,4,16", help="comma separated levels for the HTTP runs")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--only", help="only cases whose name contains this")
+    p.add_argument("--skip-functions", action="store_true")
+    p.add_argument("--skip-http", action="store_true")
+    p.add_argument("--keep-cache", action="store_true", help="keep result/cache from the previous run")
+    p.add_argument("--out", help="result JSON (default bench/results/<timestamp>.json)")
+    args = p.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    root = os.path.abspath(args.data or tempfile.mkdtemp(prefix="weatherlens-bench-"))
+    out = os.path.abspath(args.out or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json"))
+    fixture_info = {"root": root}
+    if not os.path.isdir(os.path.join(root, "data")):
+        print(f"🧪 generating fixtures → {root}")
+        fixture_info.update(make_fixtures(root, seed=args.seed, bbox=default_bbox()))
+    os.chdir(root)   # 程式都用 ./data、./result 相對路徑
+    if not args.keep_cache:
+        shutil.rmtree(os.path.join("result", "cache"), ignore_errors=True)   # 圖檔快取，不清的話 plot 永遠是 hit
+
+    points = sample_points(max(args.repeat + 1, 20), default_bbox(), args.seed)
+    report = {"meta": environment(args, fixture_info), "functions": {}, "http": {}}
+    if not args.skip_functions:
+        print("▶️  functions")
+        report["functions"] = bench_functions(points, args.repeat, args.only)
+    if not args.skip_http:
+        print("▶️  http")
+        report["http"] = bench_http(points, args.repeat, args.concurrency, args.only)
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ results → {out}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Startup-time budget check.
+
+1. import main：每次開一個新的 python process，取 --runs 次的中位數；同時列出 import 完之後
+   已經載入的重模組（sklearn / matplotlib / xarray …），有任何一個就算失敗
+2. uvicorn 冷啟動：開 `uvicorn main:app`，量到 /api/health 第一次回 200 的時間
+
+超過 --import-budget / --health-budget（秒）或載入了重模組時 exit 1，可以放在 CI / 部署前跑。
+
+    python -m bench.startup
+    python -m bench.startup --data /tmp/weatherlens-bench --runs 5 --health-budget 2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.run import _free_port
+
+HEAVY = ("sklearn", "matplotlib", "xarray", "pandas", "netCDF4", "h5py", "h5netcdf", "scipy", "joblib", "earthaccess",
+         "cartopy")
+
+_PROBE = f"""
+import sys, time, json
+t0 = time.perf_counter()
+import main
+print(json.dumps({{"seconds": time.perf_counter() - t0,
+                  "heavy": [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+
+def _env():
+    return dict(os.environ, PYTHONPATH=BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+
+def measure_import(cwd, runs):
+    samples, heavy = [], set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _PROBE], cwd=cwd, env=_env(),
+                             capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(r["seconds"])
+        heavy.update(r["heavy"])
+    return {"median_s": statistics.median(samples), "samples_s": samples, "heavy_modules": sorted(heavy)}
+
+
+def measure_health(cwd, timeout=60.0):
+    """uvicorn 起來到 /api/health 回 200 的秒數"""
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--app-dir", BACKEND_DIR, "--log-level", "warning"],
+                            cwd=cwd, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}/api/health"
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - t0
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                pass
+            time.sleep(0.02)
+        raise TimeoutError(f"/api/health did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Check import time and cold-start time of the API against a budget")
+    p.add_argument("--data", help="directory to start the server in (its ./data is used); default: empty temp dir")
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--import-budget", type=float, default=1.5, help="seconds for `import main` (median)")
+    p.add_argument("--health-budget", type=float, default=3.0, help="seconds until /api/health answers")
+    p.add_argument("--out", help="also write the result JSON here")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="weatherlens-startup-") as tmp:
+        cwd = os.path.abspath(args.data) if args.data else tmp
+        imp = measure_import(cwd, args.runs)
+        health = statistics.median(measure_health(cwd) for _ in range(args.runs))
+
+    failures = []
+    if imp["heavy_modules"]:
+        failures.append(f"import main loaded {', '.join(imp['heavy_modules'])}")
+    if imp["median_s"] > args.import_budget:
+        failures.append(f"import main took {imp['median_s']:.2f}s > {args.import_budget}s")
+    if health > args.health_budget:
+        failures.append(f"/api/health took {health:.2f}s > {args.health_budget}s")
+
+    report = {"import": imp, "health_s": health,
+              "budget": {"import_s": args.import_budget, "health_s": args.health_budget}, "failures": failures}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"import main   {imp['median_s']:.3f}s  (budget {args.import_budget}s)")
+    print(f"/api/health   {health:.3f}s  (budget {args.health_budget}s)")
+    for msg in failures:
+        print(f"❌ {msg}")
+    if not failures:
+        print("✅ within budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
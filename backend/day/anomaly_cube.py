@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed daily anomaly cube.
+
+run_climate_forecast 每個 request 都把 rain_daily / temp_daily / aer_daily 的日檔全部開一遍
+（load_daily_2024），再對每一天、每個變數用 DataFrame 篩同月資料算 anomaly。
+這裡離線算好 day-of-year × 變數 × 網格 的 anomaly，request 時每個變數只剩一次 index 讀取。
+
+Layout（每種日檔一個資料夾，網格就是該日檔的網格，只切出 bbox 那一塊）：
+    ./data/store/anomaly/<kind>/meta.json    years、bbox、變數、來源檔數
+    ./data/store/anomaly/<kind>/lat.npy      (nlat,)
+    ./data/store/anomaly/<kind>/lon.npy      (nlon,)
+    ./data/store/anomaly/<kind>/<var>.npy    float32 (nlat, nlon, 366)，第三維是閏年日曆的 (月, 日)
+    ./data/store/anomaly/<kind>/years/<Y>/<var>.npy   同上，單一年份（增量 build 用；每年多一份 cube 的大小）
+kind = rain（IMERG）/ slv（MERRA-2 temp, pressure, humidity, wind）/ aer（MERRA-2 pm25）
+
+定義和 batch.daily_anomalies 相同（當天 → ±1 → ±2 天的值減去該年同月平均，找不到為 0），
+多個年份時取有資料年份的平均；該月完全沒有日資料的格子是 NaN（使用端當 0）。
+
+Build（在 backend/ 底下執行；預設 bbox 是 INGEST_REGIONS 的外接矩形）：
+    python -m day.anomaly_cube build
+    python -m day.anomaly_cube build --years 2020-2024 --global
+日資料有新增時重跑一次即可：只重算日檔有變的年份，寫到 .tmp 再整個換掉，服務中也可以跑。
+    python -m day.anomaly_cube build --full       # 每一年都重算
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from datetime import date
+
+import netCDF4 as nc
+import numpy as np
+
+from day.daily import BASE_DIR, CATALOG_DAILY
+from day.batch import daily_anomalies, read_daily_kind, stack_daily
+from utils import catalog
+from utils.config import INGEST_REGIONS
+from utils.grids import grid_from_coords, grid_of
+from utils.ingest import parse_regions, region_hull
+from utils.snapshots import data_root
+
+CUBE_ROOT = os.path.join(BASE_DIR, "store", "anomaly")
+KIND_VARS = {
+    "rain": ["rain"],
+    "slv": ["temp", "pressure", "humidity", "wind"],
+    "aer": ["pm25"],
+}
+BAND_POINTS = 50_000   # 一次處理幾個格點（控制 build 時的記憶體：點數 × 天數 × 變數）
+
+# 閏年日曆的 (月, 日) → 第三維 index；2/29 沒資料的年份靠 ±2 天 fallback 補上
+SLOTS = [(d.month, d.day) for d in (date.fromordinal(date(2000, 1, 1).toordinal() + i) for i in range(366))]
+SLOT_OF = {md: i for i, md in enumerate(SLOTS)}
+
+
+# ==============================
+# Build
+# ==============================
+def _grid_block(files, bbox):
+    """第一個日檔的網格，切出 bbox（None = 全球）→ (lat, lon)"""
+    ds = nc.Dataset(files[0][1])
+    try:
+        g = ds.groups["Grid"] if "Grid" in ds.groups else ds
+        grid = grid_of(g)
+    finally:
+        ds.close()
+    lat, lon = grid.lats, grid.lons
+    if bbox is not None:
+        li = np.where((lat >= bbox[0]) & (lat <= bbox[2]))[0]
+        xi = np.where((lon >= bbox[1]) & (lon <= bbox[3]))[0]
+        if li.size == 0:
+            li = np.array([int(np.abs(lat - (bbox[0] + bbox[2]) / 2).argmin())])
+        if xi.size == 0:
+            xi = np.array([int(np.abs(lon - (bbox[1] + bbox[3]) / 2).argmin())])
+        lat, lon = lat[li[0]:li[-1] + 1], lon[xi[0]:xi[-1] + 1]
+    return lat, lon
+
+
+def year_stamps(files):
+    """{year: digest}：某一年的日檔有增減、或被換掉時 digest 就變"""
+    by_year = {}
+    for dt, path in files:
+        st = os.stat(path)
+        by_year.setdefault(dt.year, hashlib.sha1()).update(
+            f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return {str(y): h.hexdigest()[:12] for y, h in sorted(by_year.items())}
+
+
+def cube_meta(kind, root=CUBE_ROOT):
+    try:
+        with open(os.path.join(root, kind, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _old_stamps(out_dir, lat, lon, bbox):
+    """舊 cube 的 {year: digest}；網格或 bbox 不一樣（沒辦法沿用）時是 {}"""
+    try:
+        with open(os.path.join(out_dir, "meta.json"), encoding="utf-8") as f:
+            old = json.load(f)
+        same_grid = (np.array_equal(np.load(os.path.join(out_dir, "lat.npy")), lat)
+                     and np.array_equal(np.load(os.path.join(out_dir, "lon.npy")), lon))
+    except (OSError, ValueError):
+        return {}
+    if not same_grid or old.get("bbox") != (list(bbox) if bbox is not None else None):
+        return {}
+    return old.get("stamps") or {}
+
+
+def _link(src, dst):
+    """hardlink（同一個檔案系統、不佔空間），不行就複製"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _build_year(kind, year_files, lat, lon, year_dir):
+    """一年的 anomaly → year_dir/<var>.npy (nlat, nlon, 366)，該年沒資料的 (月, 日) 是 NaN"""
+    names = KIND_VARS[kind]
+    os.makedirs(year_dir)
+    arrays = {name: np.lib.format.open_memmap(os.path.join(year_dir, f"{name}.npy"), mode="w+",
+                                              dtype=np.float32, shape=(len(lat), len(lon), len(SLOTS)))
+              for name in names}
+    band_rows = max(1, BAND_POINTS // len(lon))
+    for r0 in range(0, len(lat), band_rows):
+        rows = slice(r0, min(r0 + band_rows, len(lat)))
+        glat, glon = np.meshgrid(lat[rows], lon, indexing="ij")
+        plat, plon = glat.ravel(), glon.ravel()
+        partial = {name: np.full((len(plat), len(SLOTS)), np.nan, dtype=np.float32) for name in names}
+        dates, daily = stack_daily(read_daily_kind(kind, plat, plon, year_files), len(plat), names)
+        months = {d.month for d in dates}
+        for s, (month, day) in enumerate(SLOTS):
+            if month not in months:
+                continue
+            anom = daily_anomalies(dates, daily, month, day)
+            for name in names:
+                partial[name][:, s] = anom[name]
+        for name in names:
+            arrays[name][rows] = partial[name].reshape(rows.stop - rows.start, len(lon), len(SLOTS))
+    for arr in arrays.values():
+        arr.flush()
+
+
+def build_kind(kind, year_from=0, year_to=9999, bbox=None, out_root=CUBE_ROOT, full=False):
+    """
+    每一年的 anomaly 先各自存在 years/<Y>/，cube 是這些年份的 nanmean。
+    再 build 時日檔沒變的年份直接沿用舊的（hardlink），只重算有新日檔的年份；全部沒變就不動，回傳 None。
+    """
+    files = catalog.daily_files(CATALOG_DAILY[kind], year_from, year_to, data_root=BASE_DIR)
+    if not files:
+        print(f"⚠️ {kind}: no daily files in the catalog for {year_from}–{year_to}")
+        return None
+    years = sorted({dt.year for dt, _ in files})
+    stamps = year_stamps(files)
+    lat, lon = _grid_block(files, bbox)
+    names = KIND_VARS[kind]
+
+    out_dir = os.path.join(out_root, kind)
+    old = {} if full else _old_stamps(out_dir, lat, lon, bbox)
+    if old == stamps:
+        print(f"✅ anomaly/{kind}: up to date (years {years[0]}–{years[-1]})")
+        return None
+    reuse = {y for y, digest in old.items() if stamps.get(y) == digest}
+
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "lat.npy"), lat)
+    np.save(os.path.join(tmp_dir, "lon.npy"), lon)
+
+    print(f"📦 anomaly/{kind}: {len(files)} daily files, years {years[0]}–{years[-1]} "
+          f"({len(years) - len(reuse)} computed, {len(reuse)} reused), {len(lat)}x{len(lon)} grid")
+    for year in years:
+        year_dir = os.path.join(tmp_dir, "years", str(year))
+        if str(year) in reuse:
+            os.makedirs(year_dir)
+            for name in names:
+                _link(os.path.join(out_dir, "years", str(year), f"{name}.npy"), os.path.join(year_dir, f"{name}.npy"))
+        else:
+            _build_year(kind, [f for f in files if f[0].year == year], lat, lon, year_dir)
+
+    # 多個年份取有資料年份的平均
+    arrays = {name: np.lib.format.open_memmap(os.path.join(tmp_dir, f"{name}.npy"), mode="w+",
+                                              dtype=np.float32, shape=(len(lat), len(lon), len(SLOTS)))
+              for name in names}
+    band_rows = max(1, BAND_POINTS // len(lon))
+    for name, arr in arrays.items():
+        partials = [np.load(os.path.join(tmp_dir, "years", str(y), f"{name}.npy"), mmap_mode="r") for y in years]
+        for r0 in range(0, len(lat), band_rows):
+            rows = slice(r0, min(r0 + band_rows, len(lat)))
+            total = np.zeros((rows.stop - rows.start, len(lon), len(SLOTS)))
+            count = np.zeros(total.shape, dtype=np.int32)
+            for part in partials:
+                band = np.asarray(part[rows], dtype=np.float64)
+                ok = ~np.isnan(band)
+                total[ok] += band[ok]
+                count += ok
+            with np.errstate(invalid="ignore", divide="ignore"):
+                arr[rows] = np.where(count > 0, total / count, np.nan)
+        arr.flush()
+        partials.clear()
+    arrays.clear()
+
+    meta = {
+        "kind": kind,
+        "years": years,
+        "stamps": stamps,
+        "files": len(files),
+        "bbox": list(bbox) if bbox is not None else None,
+        "vars": names,
+        "layout": "lat,lon,slot",
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    old_dir = out_dir + ".old"   # 先改名再刪，不會有 cube 不存在的空窗
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"✅ anomaly/{kind} → {out_dir}")
+    return out_dir
+
+
+# ==============================
+# Query
+# ==============================
+_open_cubes = {}
+
+
+def open_cube(kind, root=None):
+    """已 mmap 的 cube（meta.json 變動時自動重開）；沒建過回傳 None。root 預設是 pin 住的 snapshot 裡的"""
+    root = root or os.path.join(data_root(), "store", "anomaly")
+    cube_dir = os.path.join(root, kind)
+    meta_path = os.path.join(cube_dir, "meta.json")
+    try:
+        st = os.stat(meta_path)
+    except OSError:
+        return None
+    mtime = (st.st_ino, st.st_mtime_ns)   # rebuild 換上的是另一個檔
+    key = (root, kind)
+    cached = _open_cubes.get(key)
+    if cached is not None and cached["mtime"] == mtime:
+        return cached
+
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    for gone in [k for k in _open_cubes if not os.path.isdir(k[0])]:   # gc 掉的 snapshot
+        del _open_cubes[gone]
+    lat = np.load(os.path.join(cube_dir, "lat.npy"))
+    lon = np.load(os.path.join(cube_dir, "lon.npy"))
+    cube = {
+        "mtime": mtime,
+        "years": meta["years"],
+        "grid": grid_from_coords(lat, lon),
+        "vars": {name: np.load(os.path.join(cube_dir, f"{name}.npy"), mmap_mode="r") for name in meta["vars"]},
+    }
+    _open_cubes[key] = cube
+    return cube
+
+
+def _inside(coords, x):
+    """x 最近的格點是否在這塊座標裡（超出邊界半格以上就不算）"""
+    half = abs(coords[1] - coords[0]) / 2 if len(coords) > 1 else 0.5
+    return (x >= coords[0] - half) & (x <= coords[-1] + half)
+
+
+def cube_indices(lats, lons):
+    """
+    各 kind 的 (li, xi)；任何一個已建好的 cube 沒涵蓋全部點、或一個 cube 都沒有時回傳 None
+    （使用端退回讀原始日檔）。某個 kind 沒有 cube（例如沒有 aer_daily）時該 kind 不在結果裡。
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    out = {}
+    for kind in KIND_VARS:
+        cube = open_cube(kind)
+        if cube is None:
+            continue
+        grid = cube["grid"]
+        if not (_inside(grid.lats, lats).all() and _inside(grid.lons, lons).all()):
+            return None
+        out[kind] = (cube, *grid.nearest(lats, lons))
+    return out or None
+
+
+def anomalies_at(index, month, day):
+    """cube_indices 的結果 + (月, 日) → {var: (N,)}；NaN 表示沒資料（當 0）"""
+    s = SLOT_OF[(month, day)]
+    return {name: np.asarray(arr[li, xi, s], dtype=np.float64)
+            for cube, li, xi in index.values() for name, arr in cube["vars"].items()}
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Build the day-of-year anomaly cube from daily granules")
+    sub = p.add_subparsers(dest="cmd")
+    b = sub.add_parser("build")
+    b.add_argument("--kind", choices=list(KIND_VARS), action="append", help="repeatable; default all")
+    b.add_argument("--years", help="e.g. 2020-2024 (default: every year in the catalog)")
+    b.add_argument("--global", dest="whole", action="store_true", help="whole grid instead of INGEST_REGIONS")
+    b.add_argument("--full", action="store_true", help="recompute every year instead of reusing unchanged ones")
+    args = p.parse_args()
+
+    if args.cmd != "build":
+        p.print_help()
+        return
+    year_from, year_to = 0, 9999
+    if args.years:
+        lo, _, hi = args.years.partition("-")
+        year_from, year_to = int(lo), int(hi or lo)
+    bbox = None if args.whole else region_hull(parse_regions(INGEST_REGIONS))
+    for kind in args.kind or list(KIND_VARS):
+        build_kind(kind, year_from, year_to, bbox, full=args.full)
+
+
+if __name__ == "__main__":
+    main_cli()
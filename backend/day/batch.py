@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized forecast engine for many points at once.
+
+run_climate_forecast 是一次一個點、一天一天、一個變數一個變數算；這裡把 N 個點（或一整塊
+lat/lon tile）放進 (N, D) 的 NumPy 陣列一起算：
+    - 月資料：read_points_series，每個變數一次 fancy-index（或每個月檔開一次）
+    - 日資料：每個日檔只開一次，一次切出所有點
+    - anomaly / extreme_probs / compute_comfort_index 全部是陣列運算
+
+baseline：
+    "climatology"（預設）同月份歷史值的加權平均（權重同 monthly_baseline），完全向量化，
+                 給地圖 heatmap 用。
+    "model"      每個不同的格點呼叫一次 monthly_baseline（RF / 預訓練 artifact），
+                 結果和 /api/weather 一致，但較慢。
+"""
+import warnings
+import contextlib
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from day.daily import (
+    BASELINE_COLS, CATALOG_DAILY, CATALOG_MONTHLY, daily_granules, floor_nonneg, grid_cell,
+    monthly_baseline, imerg_month_to_mm_day, describe_daily_weather, generate_comfort_summary,
+)
+from utils import metrics
+from utils.grids import grid_of
+from utils.models import load_artifact
+from utils.periods import history_months
+from utils.store import product_units, read_points_series, read_var_points
+
+AER_VARS = ["BCSMASS", "OCSMASS", "SO4SMASS", "DUSMASS25", "SSSMASS25"]
+SLV_VARS = ["T2M", "PS", "QV2M", "U10M", "V10M"]
+EXTREME_KEYS = ["heatwave_probability", "cold_wave_probability", "heavy_rain_probability",
+                "drought_probability", "typhoon_probability", "strong_wind_probability",
+                "thunderstorm_probability", "AQ"]
+
+
+@contextlib.contextmanager
+def _quiet_nan():
+    """全 NaN 的列（點沒有資料）nanmean / nanmedian 回 NaN 就好，不要 "Mean of empty slice" 警告"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        yield
+
+
+# ==============================
+# 單位轉換（陣列版）
+# ==============================
+def humidity_gpkg(q):
+    q = np.clip(q, 1e-9, 0.04)
+    return 1000.0 * q / (1.0 - q)
+
+
+def pm25_ugm3(v):
+    return (v["BCSMASS"] + v["OCSMASS"] + 1.375 * v["SO4SMASS"] + v["DUSMASS25"] + v["SSSMASS25"]) * 1e9
+
+
+def slv_arrays(v):
+    return {
+        "temp": v["T2M"] - 273.15,
+        "pressure": v["PS"] / 100.0,
+        "humidity": humidity_gpkg(v["QV2M"]),
+        "wind": np.sqrt(v["U10M"]**2 + v["V10M"]**2),
+    }
+
+
+# ==============================
+# 月資料 → (N, M)
+# ==============================
+def load_monthly_points(lats, lons):
+    """load_monthly_records 的 N 點版 → (yms, {var: (N, M)})；月份同樣是各 product 的 history window"""
+    n = len(lats)
+    by_product = {}
+    window = {kind: set(history_months(product)) for kind, product in CATALOG_MONTHLY.items()}
+
+    times, cols = read_points_series("precipitation", lats, lons, ["precipitation"])
+    if cols:
+        units = product_units("precipitation").get("precipitation", "")
+        by_product["rain"] = (times, {"rain": imerg_month_to_mm_day(cols["precipitation"], units)})
+    times, cols = read_points_series("temperature", lats, lons, SLV_VARS)
+    if cols:
+        by_product["slv"] = (times, slv_arrays(cols))
+    times, cols = read_points_series("air_quality", lats, lons, AER_VARS)
+    if cols:
+        by_product["aer"] = (times, {"pm25": pm25_ugm3(cols)})
+
+    yms = sorted({(t.year, t.month) for kind, (times, _) in by_product.items() for t in times
+                  if (t.year, t.month) in window[kind]})
+    col_of = {ym: j for j, ym in enumerate(yms)}
+    out = {var: np.full((n, len(yms)), np.nan) for var in BASELINE_COLS}
+    for kind, (times, values) in by_product.items():
+        for t, when in enumerate(times):
+            j = col_of.get((when.year, when.month))
+            if j is None or (when.year, when.month) not in window[kind]:
+                continue
+            for var, arr in values.items():
+                out[var][:, j] = arr[:, t]
+
+    # 若 pm25 缺，proxy（同 load_monthly_records，median 以每個點自己的序列計）
+    with np.errstate(all="ignore"), _quiet_nan():
+        med = {v: np.nanmedian(out[v], axis=1, keepdims=True) for v in ("humidity", "wind", "rain")}
+    fill = {v: np.where(np.isnan(out[v]), med[v], out[v]) for v in med}
+    proxy = np.clip(0.8 * fill["humidity"] + 8.0 * np.maximum(0, 2.0 - fill["wind"]) - 0.05 * fill["rain"], 5, 150)
+    out["pm25"] = np.where(np.isnan(out["pm25"]), proxy, out["pm25"])
+    return yms, out
+
+
+def monthly_frames(lats, lons):
+    """load_monthly_points → 每個點一個 load_monthly_records 格式的 DataFrame（每個月檔只開一次）"""
+    yms, monthly = load_monthly_points(lats, lons)
+    dates = [datetime(y, m, 1) for y, m in yms]
+    return [pd.DataFrame({"date": dates, "year": [y for y, _ in yms], "month": [m for _, m in yms],
+                          **{var: monthly[var][i] for var in BASELINE_COLS}})
+            for i in range(len(lats))]
+
+
+def climatology_baseline(yms, monthly, month):
+    """同月份歷史的加權平均（權重 1 + 0.5*(year - (max_year-3))）→ {var: (N,)}"""
+    cols = [j for j, (_, m) in enumerate(yms) if m == month]
+    n = next(iter(monthly.values())).shape[0]
+    if not cols:
+        return {var: np.full(n, np.nan) for var in BASELINE_COLS}
+    years = np.array([yms[j][0] for j in cols], dtype=float)
+    w = 1 + 0.5 * (years - (years.max() - 3))
+    out = {}
+    for var in BASELINE_COLS:
+        x = monthly[var][:, cols]
+        ok = ~np.isnan(x)
+        wsum = (ok * w).sum(axis=1)
+        with np.errstate(all="ignore"):
+            out[var] = np.where(wsum > 0, np.where(ok, x, 0.0) @ w / wsum, np.nan)
+    return out
+
+
+# ==============================
+# 日資料 → (N, D)
+# ==============================
+def _iter_daily_files(kind):
+    return daily_granules(kind)
+
+
+@metrics.stage("extract")
+def read_daily_kind(kind, lats, lons, files):
+    """一種日檔（rain / slv / aer）、N 個點：每個檔只開一次 → {date: {var: (N,)}}"""
+    rec = {}
+    idx = None
+    for dt, fpath in files:
+        try:
+            ds = metrics.open_dataset(fpath, CATALOG_DAILY[kind])
+        except OSError:
+            continue
+        try:
+            if idx is None:   # 同一種日檔的網格都一樣，只算一次
+                idx = grid_of(ds).nearest(np.asarray(lats), np.asarray(lons))
+            li, xi = idx
+            if kind == "rain":
+                var = ds.variables.get("precipitation")
+                if var is None:
+                    continue
+                rain = read_var_points(var, li, xi)
+                if "mm/hr" in (getattr(var, "units", "") or "").lower():
+                    rain = rain * 24.0
+                rec.setdefault(dt, {})["rain"] = rain
+            else:
+                names = SLV_VARS if kind == "slv" else AER_VARS
+                raw = {n: (read_var_points(ds.variables[n], li, xi) if n in ds.variables
+                           else np.full(len(lats), np.nan)) for n in names}
+                rec.setdefault(dt, {}).update(slv_arrays(raw) if kind == "slv" else {"pm25": pm25_ugm3(raw)})
+        finally:
+            ds.close()
+    return rec
+
+
+def stack_daily(rec, n, columns=BASELINE_COLS):
+    """{date: {var: (N,)}} → (dates, {var: (N, D)})"""
+    dates = sorted(rec)
+    daily = {var: np.full((n, len(dates)), np.nan) for var in columns}
+    for j, dt in enumerate(dates):
+        for var, arr in rec[dt].items():
+            if var in daily:
+                daily[var][:, j] = arr
+    return dates, daily
+
+
+def load_daily_points(lats, lons):
+    """load_daily_2024 的 N 點版：每個日檔只開一次 → (dates, {var: (N, D)})"""
+    rec = {}   # date -> {var: (N,)}
+    for kind in ("rain", "slv", "aer"):
+        for dt, values in read_daily_kind(kind, lats, lons, _iter_daily_files(kind)).items():
+            rec.setdefault(dt, {}).update(values)
+    return stack_daily(rec, len(lats))
+
+
+def daily_anomalies(dates, daily, month, day):
+    """daily_anomaly_from_2024 的向量化版 → {var: (N,)}；該月完全沒日資料時為 NaN"""
+    n = next(iter(daily.values())).shape[0]
+    months = np.array([d.month for d in dates], dtype=int)
+    days = np.array([d.day for d in dates], dtype=int)
+    sel = months == month
+    out = {}
+    for var, arr in daily.items():
+        if not sel.any():
+            out[var] = np.full(n, np.nan)
+            continue
+        sub, sub_days = arr[:, sel], days[sel]
+        with np.errstate(all="ignore"), _quiet_nan():
+            month_mean = np.nanmean(sub, axis=1)
+        anom = np.full(n, np.nan)
+        # 當天 → ±1 → ±2 天
+        for dd in (day, day - 1, day + 1, day - 2, day + 2):
+            hit = np.where(sub_days == dd)[0]
+            if hit.size == 0:
+                continue
+            val = sub[:, hit[0]]
+            take = np.isnan(anom) & ~np.isnan(val)
+            anom[take] = val[take] - month_mean[take]
+        out[var] = np.where(np.isnan(anom), 0.0, anom)
+    return out
+
+
+# ==============================
+# 極端機率 / 舒適度（陣列版）
+# ==============================
+def _up(x, lo, hi):      # x<=lo→0, x>=hi→100；NaN→0
+    return np.where(np.isnan(x), 0.0, np.clip((x - lo) / (hi - lo), 0, 1) * 100)
+
+
+def _down(x, lo, hi):    # x>=hi→0, x<=lo→100；NaN→0
+    return np.where(np.isnan(x), 0.0, np.clip((hi - x) / (hi - lo), 0, 1) * 100)
+
+
+def extreme_probs_arrays(pred):
+    """extreme_probs 的向量化版：pred = {var: ndarray} → {key: ndarray}"""
+    temp, rain, press = pred["temp"], pred["rain"], pred["pressure"]
+    hum, wind, pm25 = pred["humidity"], pred["wind"], pred["pm25"]
+
+    probs = {}
+    probs["heatwave_probability"] = np.round(_up(temp, 30, 35), 1)
+    probs["cold_wave_probability"] = np.round(_down(temp, 5, 15), 1)
+    probs["heavy_rain_probability"] = np.round(_up(rain, 10, 50), 1)
+    drought = 0.7 * _down(rain, 0.2, 3.0) + 0.3 * _down(hum, 0.0, 8.0)
+    drought = np.where(~np.isnan(rain) & (rain >= 5.0), 0.0, drought)
+    probs["drought_probability"] = np.round(drought, 1)
+    probs["typhoon_probability"] = np.round(0.4 * _down(press, 990, 1008) + 0.25 * _up(hum, 10, 18)
+                                            + 0.25 * _up(temp, 25, 30) + 0.1 * _up(wind, 8, 20), 1)
+    probs["strong_wind_probability"] = np.round(_up(wind, 10, 17), 1)
+    probs["thunderstorm_probability"] = np.round(0.6 * _up(hum, 15, 30) + 0.4 * _up(rain, 5, 25), 1)
+    probs["AQ"] = np.round(_up(pm25, 35, 150), 1)
+
+    # 互斥修正：豪雨高 → 乾旱降低
+    probs["drought_probability"] = np.where(probs["heavy_rain_probability"] > 50,
+                                            np.round(probs["drought_probability"] * 0.2, 1),
+                                            probs["drought_probability"])
+    return probs
+
+
+def comfort_index_arrays(pred):
+    """compute_comfort_index 的向量化版"""
+    def lin(x, lo, hi):
+        return np.where(np.isnan(x), 0.0, np.clip((x - lo) / (hi - lo), 0, 1))
+
+    t, h, w, r = pred["temp"], pred["humidity"], pred["wind"], pred["rain"]
+    very_hot = lin(t, 30, 38)
+    very_cold = lin(10 - t, -5, 10)
+    very_windy = lin(w, 8, 18)
+    very_wet = np.maximum(lin(h, 15, 25), lin(r, 5, 20))
+    very_uncomfortable = np.clip(0.4 * very_hot + 0.2 * very_wet + 0.2 * very_windy + 0.2 * very_cold, 0, 1)
+    return {
+        "very_hot": np.round(very_hot, 2),
+        "very_cold": np.round(very_cold, 2),
+        "very_windy": np.round(very_windy, 2),
+        "very_wet": np.round(very_wet, 2),
+        "very_uncomfortable": np.round(very_uncomfortable, 2),
+    }
+
+
+# ==============================
+# 主流程
+# ==============================
+def forecast_points(lats, lons, start_date, end_date, baseline="climatology"):
+    """
+    N 個點、同一段日期一起預測。
+    回傳 dict：
+        lat, lon       (N,)
+        dates          每個點的 ['YYYY-MM-DD', ...]（D 天）
+        daily          {var: (N, D)}     已做 anomaly 修正、四捨五入
+        comfort        {key: (N, D)}
+        average        {var: (N,)}       整段平均
+        extreme        {key: (N,)}       由整段平均算的極端機率
+    """
+    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    if end_dt < start_dt:
+        raise ValueError("End date must be >= Start date")
+    n = len(np.atleast_1d(lats))
+    return forecast_windows(lats, lons, [start_dt] * n, (end_dt - start_dt).days + 1, baseline)
+
+
+def forecast_windows(lats, lons, starts, n_days, baseline="climatology"):
+    """
+    每個點各自的起始日（starts[i]）、同樣長度 n_days 的視窗。輸出格式同 forecast_points。
+    月資料、日資料都只讀一次；baseline 以 (month) 或 (cell, year, month) 為單位重用。
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    n, d = len(lats), int(n_days)
+    days = [pd.date_range(st, periods=d, freq="D") for st in starts]
+
+    if baseline == "climatology":
+        yms, monthly = load_monthly_points(lats, lons)
+        if not yms:
+            raise SystemExit("No monthly records found. Check DIRS_MONTHLY paths.")
+        base_for = lambda year, month: climatology_baseline(yms, monthly, month)
+    elif baseline == "model":
+        cells = [grid_cell(la, lo) for la, lo in zip(lats, lons)]
+        first_of = {}
+        for i, cell in enumerate(cells):
+            first_of.setdefault(cell, i)
+        dfm = {}
+
+        def records_of(cell):
+            """
+            有 artifact 的格點 monthly_baseline 不會叫這個。第一次被叫到時，沒有 artifact 的格點
+            一起用 N 點 reader 讀（每個月檔開一次，不是每個格點開一次）
+            """
+            if cell not in dfm:
+                todo = [c for c in first_of if c not in dfm and load_artifact("baseline", c) is None]
+                todo = todo if cell in todo else todo + [cell]
+                rows = [first_of[c] for c in todo]
+                dfm.update(zip(todo, monthly_frames(lats[rows], lons[rows])))
+            return dfm[cell]
+
+        def base_for(year, month):
+            per_cell = {cell: monthly_baseline(partial(records_of, cell), year, month, cell) for cell in first_of}
+            return {var: np.array([per_cell[c].get(var, np.nan) for c in cells], dtype=float)
+                    for var in BASELINE_COLS}
+    else:
+        raise ValueError(f"unknown baseline: {baseline}")
+
+    # anomaly cube 涵蓋所有點時直接 index；否則讀參考年份的日檔
+    from day.anomaly_cube import anomalies_at, cube_indices
+    cube_idx = cube_indices(lats, lons)
+    dates_2024, daily_2024 = load_daily_points(lats, lons) if cube_idx is None else ([], {})
+
+    # 依日期分組：同一個 (年, 月, 日) 的所有 (點, 第幾天) 一起算
+    slots = {}
+    for i in range(n):
+        for j, dd in enumerate(days[i]):
+            slots.setdefault((dd.year, dd.month, dd.day), []).append((i, j))
+
+    daily = {var: np.full((n, d), np.nan) for var in BASELINE_COLS}
+    base_cache = {}
+    for (year, month, day), pos in sorted(slots.items()):
+        key = (year, month) if baseline == "model" else month
+        if key not in base_cache:
+            base_cache[key] = base_for(year, month)
+        base = base_cache[key]
+        if cube_idx is not None:
+            anom = anomalies_at(cube_idx, month, day)
+        else:
+            anom = daily_anomalies(dates_2024, daily_2024, month, day) if dates_2024 else {}
+        rows = np.array([i for i, _ in pos])
+        cols = np.array([j for _, j in pos])
+        for var in BASELINE_COLS:
+            a = anom.get(var)
+            adj = base[var] if a is None else base[var] + np.where(np.isnan(a), 0.0, a)
+            daily[var][rows, cols] = np.round(floor_nonneg(var, adj), 2)[rows]
+
+    comfort = comfort_index_arrays(daily)
+    with np.errstate(all="ignore"), _quiet_nan():
+        average = {var: np.nanmean(daily[var], axis=1) for var in BASELINE_COLS}
+    return {
+        "lat": lats,
+        "lon": lons,
+        "dates": [[dd.date().isoformat() for dd in row] for row in days],
+        "daily": daily,
+        "comfort": comfort,
+        "average": average,
+        "extreme": extreme_probs_arrays(average),
+    }
+
+
+def point_report(res, i):
+    """把 forecast_points 的第 i 個點轉成 run_climate_forecast 的輸出格式（dict）"""
+    reports = []
+    dates = res["dates"][i]
+    for j, date in enumerate(dates):
+        v = {var: float(res["daily"][var][i, j]) for var in BASELINE_COLS}
+        comfort = {k: float(a[i, j]) for k, a in res["comfort"].items()}
+        desc = describe_daily_weather({
+            "rain_mm_day": v["rain"], "temp_C": v["temp"], "pressure_hPa": v["pressure"],
+            "humidity_gkg": v["humidity"], "wind_ms": v["wind"], "pm25_ugm3": v["pm25"],
+        })
+        row = {"date": date}
+        for var in BASELINE_COLS:
+            row[var] = v[var]
+            row[f"{var}_desc"] = desc[var]
+        row["comfort_index"] = comfort
+        row["climate_description"] = generate_comfort_summary(comfort)
+        reports.append(row)
+    return {
+        "location": {"lat": float(res["lat"][i]), "lon": float(res["lon"][i])},
+        "period": {"start": dates[0], "end": dates[-1]},
+        "summary": {
+            "average_conditions": {var: round(float(res["average"][var][i]), 2) for var in BASELINE_COLS},
+            "extreme_event_probabilities": {k: float(res["extreme"][k][i]) for k in EXTREME_KEYS},
+        },
+        "daily_reports": reports,
+    }
+
+
+def tile_points(lat_min, lon_min, lat_max, lon_max, step):
+    """規則 lat/lon tile → (lats_1d, lons_1d, 攤平後的 N 個點)"""
+    grid_lats = np.round(np.arange(lat_min, lat_max + step / 2, step), 6)
+    grid_lons = np.round(np.arange(lon_min, lon_max + step / 2, step), 6)
+    mesh_lat, mesh_lon = np.meshgrid(grid_lats, grid_lons, indexing="ij")
+    return grid_lats, grid_lons, mesh_lat.ravel(), mesh_lon.ravel()
+
+
+def forecast_tile(lat_min, lon_min, lat_max, lon_max, step, start_date, end_date):
+    """整塊 tile 一起算；每個輸出的 (N,) 欄位 reshape 成 (nlat, nlon)"""
+    grid_lats, grid_lons, pts_lat, pts_lon = tile_points(lat_min, lon_min, lat_max, lon_max, step)
+    res = forecast_points(pts_lat, pts_lon, start_date, end_date)
+    shape = (len(grid_lats), len(grid_lons))
+    return {
+        "lats": grid_lats,
+        "lons": grid_lons,
+        "dates": res["dates"][0],
+        "average": {k: v.reshape(shape) for k, v in res["average"].items()},
+        "extreme": {k: v.reshape(shape) for k, v in res["extreme"].items()},
+        "comfort": {k: v[:, 0].reshape(shape) for k, v in res["comfort"].items()},   # 第一天
+    }
+
+
+def batch_reports(items, n_days=4):
+    """
+    items = [(lat, lon, start_datetime), ...] → 每個 item 一份 run_climate_forecast 格式的 dict。
+    同一格點 + 同一天的 item 只算一次（baseline 用 model，結果和單點版一致）。
+    """
+    keys, unique = [], {}
+    for lat, lon, start in items:
+        key = (grid_cell(lat, lon), start.date())
+        unique.setdefault(key, (lat, lon, start))
+        keys.append(key)
+
+    order = list(unique)
+    res = forecast_windows([unique[k][0] for k in order], [unique[k][1] for k in order],
+                           [unique[k][2] for k in order], n_days, baseline="model")
+    reports = {key: point_report(res, i) for i, key in enumerate(order)}
+    return [reports[key] for key in keys]
@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import logging
 import netCDF4 as nc
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from sklearn.ensemble import RandomForestRegressor
+
+from utils.cache import LRUCache
+from utils.config import BASELINE_CACHE_SIZE, BASELINE_CACHE_TTL
+from utils.forecasting import get_backend
+from utils.models import BASELINE_GRIDS, load_artifact
+from utils.periods import daily_reference_year, history_months
+from utils.store import PRODUCTS, read_point_series, store_units, snap_to_grid, monthly_data_version
+from utils.grids import grid_of
+from utils import catalog, metrics
+
+log = logging.getLogger(__name__)
 
 # ==============================
 # 路徑設定（請依你實際資料夾調整）
@@ -21,6 +32,9 @@ DIRS_DAILY_2024 = {
     "slv":  os.path.join(BASE_DIR, "temp_daily"),   # MERRA-2 day slv
     "aer":  os.path.join(BASE_DIR, "aer_daily"),    # MERRA-2 day aer (可無)
 }
+# 上面兩組資料夾在 utils/catalog.py 裡的 product 名稱
+CATALOG_MONTHLY = {"rain": "precipitation", "slv": "temperature", "aer": "air_quality"}
+CATALOG_DAILY = {"rain": "rain_daily", "slv": "temp_daily", "aer": "aer_daily"}
 
 # ==============================
 # 使用者輸入
@@ -94,15 +108,30 @@ def list_month_subdirs(root_dir):
         p = os.path.join(root_dir, f"{mm:02d}")
         if os.path.isdir(p):
             out.append(p)
-    print(f"  - Found {len(out)} month subdirs in {root_dir}")
+    log.debug("month subdirs found", extra={"root": root_dir, "count": len(out)})
     return out
 
 
+def monthly_granules(kind, months=None):
+    """[(datetime(y, m, 1), path)]，查 catalog；months 預設是該 product 的 history window（utils/periods.py）"""
+    product = CATALOG_MONTHLY[kind]
+    months = set(history_months(product) if months is None else months)
+    return [(dt, p) for dt, p in catalog.monthly_files(product) if (dt.year, dt.month) in months]
+
+def daily_granules(kind, year=None):
+    """[(datetime(y, m, d), path)]；year 預設是 daily_reference_year（最新的完整年份）"""
+    product = CATALOG_DAILY[kind]
+    year = daily_reference_year(product) if year is None else year
+    return [] if year is None else catalog.daily_files(product, year, year)
+
+
 def get_indices(ds, lat, lon):
-    lats, lons = ds.variables["lat"][:], ds.variables["lon"][:]
-    lat_idx = int(np.abs(lats - lat).argmin())
-    lon_idx = int(np.abs(lons - lon).argmin())
-    return lat_idx, lon_idx
+    # 網格由 utils/grids.py 算 index，不再每個檔都讀整條座標
+    return grid_of(ds).nearest(lat, lon)
+
+def grid_cell(lat, lon):
+    """把 lat/lon 對到各月資料網格的 (lat_idx, lon_idx)；同一格的點共用 cache"""
+    return tuple(snap_to_grid(product, lat, lon) for product in BASELINE_GRIDS)
 
 def iter_nc_files(root_dir):
     for root, _, files in os.walk(root_dir):
@@ -124,16 +153,28 @@ def read_imerg_precip_month(ds, lat_idx, lon_idx):
         val = float(var[lat_idx, lon_idx])
     else:
         return np.nan
+    return imerg_month_to_mm_day(val, getattr(var, "units", ""), getattr(ds, "days_in_month", 30))
+
+def imerg_month_to_mm_day(val, units, days_in_month=30):
     # 換單位到 mm/day
-    units = (getattr(var, "units", "") or "").lower()
+    units = (units or "").lower()
     if "mm/hr" in units:
         val *= 24.0
     elif "mm/month" in units:
         # 沒有月天數就假定 30
-        val = val / float(getattr(ds, "days_in_month", 30))
+        val = val / float(days_in_month)
     # mm/day 保持不變
     return val
 
+def slv_point_values(v):
+    """MERRA-2 SLV 原始值 → temp(°C)/pressure(hPa)/humidity(g/kg)/wind(m/s)"""
+    return {
+        "temp": v.get("T2M", np.nan) - 273.15,
+        "pressure": v.get("PS", np.nan) / 100.0,
+        "humidity": merra_humidity_gpkg(v.get("QV2M", np.nan)),
+        "wind": float(np.sqrt(v.get("U10M", np.nan)**2 + v.get("V10M", np.nan)**2)),
+    }
+
 def read_imerg_precip_day(ds, lat_idx, lon_idx):
     """回傳 mm/day（日檔，通常變數 precipitation 已是當日累計或 mm/day）"""
     var = ds.variables.get("precipitation")
@@ -174,62 +215,40 @@ def compute_pm25_from_aer_vars(ds, lat_idx, lon_idx):
     ss  = ds["SSSMASS25"][0, lat_idx, lon_idx]
     return float((bc + oc + so4 + du + ss) * 1e9)
 
-# ========== 讀月資料（2022–2025）做當月基線 ==========
+# ========== 讀月資料（各 product 最新 HISTORY_MONTHS 個月）做當月基線 ==========
+@metrics.stage("extract")
 def load_monthly_records(lat, lon):
     records = {}  # dt(YYYY-MM-01) -> dict
-
-    def month_dirs_under(root, y0, y1):
-        # 走 ./<root>/<year>/<month>
-        for yname in sorted(os.listdir(root)):
-            ypath = os.path.join(root, yname)
-            if not (os.path.isdir(ypath) and re.fullmatch(r"\d{4}", yname)):
-                continue
-            y = int(yname)
-            if y < y0 or y > y1:
-                continue
-            for mm in range(1, 13):
-                mpath = os.path.join(ypath, f"{mm:02d}")
-                if os.path.isdir(mpath):
-                    yield mpath
+    window = {kind: set(history_months(product)) for kind, product in CATALOG_MONTHLY.items()}
+
+    # -------- 有 point store 就直接一次讀完（python -m utils.store build） --------
+    rain_pts = read_point_series("precipitation", lat, lon, ["precipitation"])
+    slv_pts = read_point_series("temperature", lat, lon, ["T2M", "PS", "QV2M", "U10M", "V10M"])
+    aer_pts = read_point_series("air_quality", lat, lon)
+    if rain_pts is not None:
+        units = store_units("precipitation").get("precipitation", "")
+        for (y, m), v in rain_pts.items():
+            if (y, m) in window["rain"]:
+                records.setdefault(datetime(y, m, 1), {})["rain"] = imerg_month_to_mm_day(v["precipitation"], units)
+    if slv_pts is not None:
+        for (y, m), v in slv_pts.items():
+            if (y, m) in window["slv"]:
+                records.setdefault(datetime(y, m, 1), {}).update(slv_point_values(v))
+    if aer_pts is not None:
+        for (y, m), v in aer_pts.items():
+            if (y, m) in window["aer"]:
+                records.setdefault(datetime(y, m, 1), {})["pm25"] = float(
+                    (v["BCSMASS"] + v["OCSMASS"] + 1.375 * v["SO4SMASS"] + v["DUSMASS25"] + v["SSSMASS25"]) * 1e9)
 
     # -------- rain (IMERG monthly) --------
-    if os.path.isdir(DIRS_MONTHLY["rain"]):
-        print("📅 Loading monthly precipitation...")
-        root = DIRS_MONTHLY["rain"]
-
-        # ./precipitation/<year>/<month>/*
-        for month_dir in month_dirs_under(root, 2022, 2024):
-            print(f"  - Scanning {month_dir} ...")
-            files = [f for f in os.listdir(month_dir)
-                     if f.lower().endswith((".nc4", ".hdf5", ".h5", ".nc"))]
-            for fname in sorted(files):
-                dt = extract_yyyymm(fname)
-                if not dt:
-                    continue
-                fpath = os.path.join(month_dir, fname)
-                try:
-                    ds = nc.Dataset(fpath)
-                    lat_idx, lon_idx = get_indices(ds, lat, lon)
-                    rain = read_imerg_precip_month(ds, lat_idx, lon_idx)
-                except:
-                    rain = np.nan
-                finally:
-                    try: ds.close()
-                    except: pass
-                records.setdefault(dt, {})["rain"] = rain
-
-        # 後援：若有平放在根目錄
-        flat_files = [f for f in os.listdir(root)
-                      if f.lower().endswith((".nc4", ".hdf5", ".h5", ".nc"))]
-        for fname in sorted(flat_files):
-            dt = extract_yyyymm(fname)
-            if not dt:
-                continue
-            fpath = os.path.join(root, fname)
+    if rain_pts is None:
+        log.debug("📅 loading monthly precipitation from raw files")
+        for dt, fpath in monthly_granules("rain", window["rain"]):
             try:
-                ds = nc.Dataset(fpath)
-                lat_idx, lon_idx = get_indices(ds, lat, lon)
-                rain = read_imerg_precip_month(ds, lat_idx, lon_idx)
+                ds = metrics.open_dataset(fpath, CATALOG_MONTHLY["rain"])
+                g = ds.groups.get(PRODUCTS["precipitation"]["group"], ds)   # IMERG 的座標/變數在 "Grid" group
+                lat_idx, lon_idx = get_indices(g, lat, lon)
+                rain = read_imerg_precip_month(g, lat_idx, lon_idx)
             except:
                 rain = np.nan
             finally:
@@ -238,51 +257,11 @@ def load_monthly_records(lat, lon):
             records.setdefault(dt, {})["rain"] = rain
 
     # -------- slv (MERRA-2 monthly) --------
-    if os.path.isdir(DIRS_MONTHLY["slv"]):
-        print("📅 Loading monthly SLV (T2M/PS/QV2M/U10M/V10M)...")
-        root = DIRS_MONTHLY["slv"]
-
-        for month_dir in month_dirs_under(root, 2022, 2024):
-            print(f"  - Scanning {month_dir} ...")
-            files = [f for f in os.listdir(month_dir)
-                     if f.lower().endswith((".nc4", ".nc"))]
-            for fname in sorted(files):
-                dt = extract_yyyymm(fname)
-                if not dt:
-                    continue
-                fpath = os.path.join(month_dir, fname)
-                try:
-                    ds = nc.Dataset(fpath)
-                    lat_idx, lon_idx = get_indices(ds, lat, lon)
-                    t2m = float(ds["T2M"][0, lat_idx, lon_idx]) - 273.15 if "T2M"  in ds.variables else np.nan
-                    ps  = float(ds["PS"][0,  lat_idx, lon_idx]) / 100.0   if "PS"   in ds.variables else np.nan
-                    q   = float(ds["QV2M"][0,lat_idx, lon_idx])           if "QV2M" in ds.variables else np.nan
-                    hum = merra_humidity_gpkg(q)
-                    if "U10M" in ds.variables and "V10M" in ds.variables:
-                        u10 = float(ds["U10M"][0, lat_idx, lon_idx])
-                        v10 = float(ds["V10M"][0, lat_idx, lon_idx])
-                        wind = float(np.sqrt(u10**2 + v10**2))
-                    else:
-                        wind = np.nan
-                except:
-                    t2m = ps = hum = wind = np.nan
-                finally:
-                    try: ds.close()
-                    except: pass
-                records.setdefault(dt, {}).update(
-                    {"temp": t2m, "pressure": ps, "humidity": hum, "wind": wind}
-                )
-
-        # 後援：平放在根目錄
-        flat_files = [f for f in os.listdir(root)
-                      if f.lower().endswith((".nc4", ".nc"))]
-        for fname in sorted(flat_files):
-            dt = extract_yyyymm(fname)
-            if not dt:
-                continue
-            fpath = os.path.join(root, fname)
+    if slv_pts is None:
+        log.debug("📅 loading monthly SLV (T2M/PS/QV2M/U10M/V10M) from raw files")
+        for dt, fpath in monthly_granules("slv", window["slv"]):
             try:
-                ds = nc.Dataset(fpath)
+                ds = metrics.open_dataset(fpath, CATALOG_MONTHLY["slv"])
                 lat_idx, lon_idx = get_indices(ds, lat, lon)
                 t2m = float(ds["T2M"][0, lat_idx, lon_idx]) - 273.15 if "T2M"  in ds.variables else np.nan
                 ps  = float(ds["PS"][0,  lat_idx, lon_idx]) / 100.0   if "PS"   in ds.variables else np.nan
@@ -304,40 +283,11 @@ def load_monthly_records(lat, lon):
             )
 
     # -------- aer (MERRA-2 aerosol monthly) --------
-    if os.path.isdir(DIRS_MONTHLY["aer"]):
-        print("📅 Loading monthly aerosol (PM2.5 components)...")
-        root = DIRS_MONTHLY["aer"]
-
-        for month_dir in month_dirs_under(root, 2022, 2024):
-            print(f"  - Scanning {month_dir} ...")
-            files = [f for f in os.listdir(month_dir)
-                     if f.lower().endswith((".nc4", ".nc"))]
-            for fname in sorted(files):
-                dt = extract_yyyymm(fname)
-                if not dt:
-                    continue
-                fpath = os.path.join(month_dir, fname)
-                try:
-                    ds = nc.Dataset(fpath)
-                    lat_idx, lon_idx = get_indices(ds, lat, lon)
-                    pm25 = compute_pm25_from_aer_vars(ds, lat_idx, lon_idx)
-                except:
-                    pm25 = np.nan
-                finally:
-                    try: ds.close()
-                    except: pass
-                records.setdefault(dt, {})["pm25"] = pm25
-
-        # 後援：平放在根目錄
-        flat_files = [f for f in os.listdir(root)
-                      if f.lower().endswith((".nc4", ".nc"))]
-        for fname in sorted(flat_files):
-            dt = extract_yyyymm(fname)
-            if not dt:
-                continue
-            fpath = os.path.join(root, fname)
+    if aer_pts is None:
+        log.debug("📅 loading monthly aerosol (PM2.5 components) from raw files")
+        for dt, fpath in monthly_granules("aer", window["aer"]):
             try:
-                ds = nc.Dataset(fpath)
+                ds = metrics.open_dataset(fpath, CATALOG_MONTHLY["aer"])
                 lat_idx, lon_idx = get_indices(ds, lat, lon)
                 pm25 = compute_pm25_from_aer_vars(ds, lat_idx, lon_idx)
             except:
@@ -375,71 +325,55 @@ def load_monthly_records(lat, lon):
     return dfm
 
 
-# ========== 讀 2024 daily（用於 anomaly） ==========
+# ========== 讀參考年份的 daily（用於 anomaly；年份見 daily_reference_year） ==========
+@metrics.stage("extract")
 def load_daily_2024(lat, lon):
     rec = {} 
     # rain
-    if os.path.isdir(DIRS_DAILY_2024["rain"]):
-        for fname in sorted(os.listdir(DIRS_DAILY_2024["rain"])):
-            print(f"  - Scanning {fname} ...")
-            if not fname or not fname.endswith(".nc4"): continue
-            dt = extract_yyyymmdd(fname)
-            if not dt or dt.year != 2024: continue
-            fpath = os.path.join(DIRS_DAILY_2024["rain"], fname)
-            try:
-                ds = nc.Dataset(fpath)
-                lat_idx, lon_idx = get_indices(ds, lat, lon)
-                rain = read_imerg_precip_day(ds, lat_idx, lon_idx)
-            except:
-                rain = np.nan
-            finally:
-                try: ds.close()
-                except: pass
-            rec.setdefault(dt, {})["rain"] = rain
+    for dt, fpath in daily_granules("rain"):
+        try:
+            ds = metrics.open_dataset(fpath, CATALOG_DAILY["rain"])
+            lat_idx, lon_idx = get_indices(ds, lat, lon)
+            rain = read_imerg_precip_day(ds, lat_idx, lon_idx)
+        except:
+            rain = np.nan
+        finally:
+            try: ds.close()
+            except: pass
+        rec.setdefault(dt, {})["rain"] = rain
     # slv
-    if os.path.isdir(DIRS_DAILY_2024["slv"]):
-        for fname in sorted(os.listdir(DIRS_DAILY_2024["slv"])):
-            print(f"  - Scanning {fname} ...")
-            if not fname.endswith(".nc4"): continue
-            dt = extract_yyyymmdd(fname)
-            if not dt or dt.year != 2024: continue
-            fpath = os.path.join(DIRS_DAILY_2024["slv"], fname)
-            try:
-                ds = nc.Dataset(fpath)
-                lat_idx, lon_idx = get_indices(ds, lat, lon)
-                t2m = float(ds["T2M"][0, lat_idx, lon_idx]) - 273.15 if "T2M" in ds.variables else np.nan
-                ps  = float(ds["PS"][0,  lat_idx, lon_idx]) / 100.0   if "PS"  in ds.variables else np.nan
-                q   = float(ds["QV2M"][0,lat_idx, lon_idx])           if "QV2M" in ds.variables else np.nan
-                hum = merra_humidity_gpkg(q)
-                if "U10M" in ds.variables and "V10M" in ds.variables:
-                    u10 = float(ds["U10M"][0, lat_idx, lon_idx])
-                    v10 = float(ds["V10M"][0, lat_idx, lon_idx])
-                    wind = float(np.sqrt(u10**2 + v10**2))
-                else:
-                    wind = np.nan
-            except:
-                t2m = ps = hum = wind = np.nan
-            finally:
-                try: ds.close()
-                except: pass
-            rec.setdefault(dt, {}).update({"temp": t2m, "pressure": ps, "humidity": hum, "wind": wind})
+    for dt, fpath in daily_granules("slv"):
+        try:
+            ds = metrics.open_dataset(fpath, CATALOG_DAILY["slv"])
+            lat_idx, lon_idx = get_indices(ds, lat, lon)
+            t2m = float(ds["T2M"][0, lat_idx, lon_idx]) - 273.15 if "T2M" in ds.variables else np.nan
+            ps  = float(ds["PS"][0,  lat_idx, lon_idx]) / 100.0   if "PS"  in ds.variables else np.nan
+            q   = float(ds["QV2M"][0,lat_idx, lon_idx])           if "QV2M" in ds.variables else np.nan
+            hum = merra_humidity_gpkg(q)
+            if "U10M" in ds.variables and "V10M" in ds.variables:
+                u10 = float(ds["U10M"][0, lat_idx, lon_idx])
+                v10 = float(ds["V10M"][0, lat_idx, lon_idx])
+                wind = float(np.sqrt(u10**2 + v10**2))
+            else:
+                wind = np.nan
+        except:
+            t2m = ps = hum = wind = np.nan
+        finally:
+            try: ds.close()
+            except: pass
+        rec.setdefault(dt, {}).update({"temp": t2m, "pressure": ps, "humidity": hum, "wind": wind})
     # aer
-    if os.path.isdir(DIRS_DAILY_2024["aer"]):
-        for fname in sorted(os.listdir(DIRS_DAILY_2024["aer"])):
-            if not fname.endswith(".nc4"): continue
-            dt = extract_yyyymmdd(fname)
-            if not dt or dt.year != 2024: continue
-            fpath = os.path.join(DIRS_DAILY_2024["aer"], fname)
-            try:
-                ds = nc.Dataset(fpath)
-                lat_idx, lon_idx = get_indices(ds, lat, lon)
-                pm25 = compute_pm25_from_aer_vars(ds, lat_idx, lon_idx)
-            except:
-                pm25 = np.nan
-            finally:
-                try: ds.close()
-                except: pass
-            rec.setdefault(dt, {})["pm25"] = pm25
+    for dt, fpath in daily_granules("aer"):
+        try:
+            ds = metrics.open_dataset(fpath, CATALOG_DAILY["aer"])
+            lat_idx, lon_idx = get_indices(ds, lat, lon)
+            pm25 = compute_pm25_from_aer_vars(ds, lat_idx, lon_idx)
+        except:
+            pm25 = np.nan
+        finally:
+            try: ds.close()
+            except: pass
+        rec.setdefault(dt, {})["pm25"] = pm25
 
     rows = []
     for dt, v in rec.items():
@@ -457,39 +391,74 @@ def load_daily_2024(lat, lon):
     return dfd
 
 # ========== 用歷史月資料做「當月基線」（加快運算） ==========
-_baseline_cache = {}
-
-def monthly_baseline(dfm, year, month):
-    key = (year, month)
-    if key in _baseline_cache:
-        return _baseline_cache[key]
-
-    hist = dfm[dfm["month"] == month].copy()
-    feature_cols = ["rain","temp","pressure","humidity","wind","pm25"]
-    target_cols  = feature_cols
-    out = {}
-
-    if hist.empty:
-        for c in target_cols: out[c] = np.nan
-        _baseline_cache[key] = out
-        return out
-
-    hist["weight"] = 1 + 0.5 * (hist["year"] - (hist["year"].max() - 3))
-    ref = hist[feature_cols].mean()
-
-    model_cache = {}
-    for tgt in target_cols:
-        sub = hist.dropna(subset=[tgt])
-        if len(sub) >= 3:
-            if tgt not in model_cache:
-                model = RandomForestRegressor(n_estimators=150, random_state=42, n_jobs=-1)
-                model.fit(sub[feature_cols], sub[tgt], sample_weight=sub["weight"])
-                model_cache[tgt] = model
-            out[tgt] = float(model_cache[tgt].predict(ref.values.reshape(1, -1))[0])
-        else:
-            out[tgt] = float(sub[tgt].mean()) if len(sub) else np.nan
+# key = (grid cell, year, month)；資料檔有變動（data version 改變）時整個清空
+_baseline_cache = LRUCache(maxsize=BASELINE_CACHE_SIZE, ttl=BASELINE_CACHE_TTL, name="baseline")
+_baseline_version = {"value": None}
 
-    _baseline_cache[key] = out
+def baseline_cache_stats():
+    return dict(_baseline_cache.stats(), data_version=_baseline_version["value"])
+
+BASELINE_COLS = ["rain","temp","pressure","humidity","wind","pm25"]
+NONNEG_COLS = ("rain", "humidity", "pm25")
+
+def floor_nonneg(var, value):
+    """
+    加上 anomaly 之後的下限：rain / humidity / pm25 不小於 0，沒有值（NaN）也當 0
+    （原本 max(0.0, nan) 的結果）。純量和 array 都可以，day/batch.py 用同一條規則。
+    """
+    if var not in NONNEG_COLS:
+        return value
+    return np.where(np.isnan(value), 0.0, np.maximum(0.0, value))
+
+# utils/forecasting.py：rf 是每個月一個 multi-output RF（特徵 = 當月各變數，在特徵平均處預測、近年權重較高）
+BASELINE_SPEC = dict(targets=BASELINE_COLS, features=BASELINE_COLS, reference="mean", weight="weight",
+                     fallback="mean", n_estimators=150, n_jobs=-1,
+                     bounds={"rain": (0, None), "humidity": (0, 100), "wind": (0, None), "pm25": (0, None)},
+                     label="baseline")
+
+def fit_baseline(dfm, month, backend=None):
+    """當月基線模型（離線訓練也用這個）；回傳 fitted.predict(year, month) → {tgt: value}"""
+    dfm = baseline_frame(dfm, month)
+    return None if dfm is None else get_backend(backend).fit(dfm, months=[month], **BASELINE_SPEC)
+
+def baseline_frame(dfm, month):
+    """加上 weight 欄（以當月最新年份為準，近年權重較高）；沒有這個月份的資料回傳 None"""
+    if dfm.empty or not (dfm["month"] == month).any():
+        return None
+    dfm = dfm.copy()
+    dfm["weight"] = 1 + 0.5 * (dfm["year"] - (dfm[dfm["month"] == month]["year"].max() - 3))
+    return dfm
+
+def predict_baseline(fitted, year, month):
+    if fitted is None:
+        return {c: np.nan for c in BASELINE_COLS}
+    return fitted.predict(year, month)
+
+def monthly_baseline(dfm, year, month, cell=None):
+    """
+    dfm 是 load_monthly_records 的結果，或回傳它的函式：cache 和 artifact 都沒有、真的要 fit 時
+    才呼叫，有 artifact 的格點完全不讀月資料
+    """
+    version = monthly_data_version()
+    if version != _baseline_version["value"]:
+        _baseline_cache.clear()
+        _baseline_version["value"] = version
+
+    key = (cell, year, month)
+    cached = _baseline_cache.get(key) if cell is not None else None
+    if cached is not None:
+        return cached
+
+    # 有離線訓練好的 artifact（以 grid_cell 為單位，跟當場 fit 讀到的資料相同）就只做 inference
+    art = load_artifact("baseline", cell) if cell is not None else None
+    if art is not None:
+        fitted = art["models"].get(month)
+    else:
+        fitted = fit_baseline(dfm() if callable(dfm) else dfm, month)
+    out = predict_baseline(fitted, year, month)
+
+    if cell is not None:
+        _baseline_cache.set(key, out)
     return out
 
 # ========== 用 2024 daily 做「當日 anomaly」 ==========
@@ -741,31 +710,47 @@ def run_climate_forecast(lat, lon, start_date, end_date):
     if END_DT < START_DT:
         raise ValueError("End date must be >= Start date")
 
-    print("📥 Loading monthly climatology ...")
-    df_month = load_monthly_records(lat, lon)
-    if df_month.empty:
-        raise SystemExit("No monthly records found. Check DIRS_MONTHLY paths.")
-
-    print("📥 Loading 2024 daily data for anomaly adjustment ...")
-    df_daily_2024 = load_daily_2024(lat, lon)
-    if df_daily_2024.empty:
-        print("⚠️ No 2024 daily data found. Will skip anomaly nudging.")
+    # 月資料只有 baseline 的 cache 和 artifact 都沒有時才讀（monthly_baseline 第一次要 fit 時）
+    df_month = {}
+
+    def monthly_records():
+        if "df" not in df_month:
+            log.debug("📥 loading monthly climatology", extra={"lat": lat, "lon": lon})
+            df = load_monthly_records(lat, lon)
+            if df.empty:
+                raise SystemExit("No monthly records found. Check DIRS_MONTHLY paths.")
+            df_month["df"] = df
+        return df_month["df"]
+
+    # 有 anomaly cube（python -m day.anomaly_cube build）就每天每個變數一次 index 讀取；
+    # 沒有、或這個點不在 cube 範圍內時才讀參考年份（daily_reference_year）的日檔
+    from day.anomaly_cube import anomalies_at, cube_indices
+    cube_idx = cube_indices(lat, lon)
+    df_daily_2024 = pd.DataFrame()
+    if cube_idx is None:
+        log.debug("📥 loading reference-year daily data for anomaly adjustment", extra={"lat": lat, "lon": lon})
+        df_daily_2024 = load_daily_2024(lat, lon)
+        if df_daily_2024.empty:
+            log.warning("⚠️ no reference-year daily data found, skipping anomaly nudging", extra={"lat": lat, "lon": lon})
 
     # 主迴圈
+    cell = grid_cell(lat, lon)
     results = []
     for d in pd.date_range(START_DT, END_DT, freq="D"):
-        base = monthly_baseline(df_month, d.year, d.month)
+        base = monthly_baseline(monthly_records, d.year, d.month, cell)
+        cube_anom = anomalies_at(cube_idx, d.month, d.day) if cube_idx is not None else None
         adjusted = {}
         for var in ["rain","temp","pressure","humidity","wind","pm25"]:
             base_val = base.get(var, np.nan)
-            if df_daily_2024.empty or np.isnan(base_val):
+            if cube_anom is not None and not np.isnan(base_val):
+                anom = float(cube_anom[var][0]) if var in cube_anom else np.nan
+                adj_val = base_val + (anom if not np.isnan(anom) else 0.0)
+            elif df_daily_2024.empty or np.isnan(base_val):
                 adj_val = base_val
             else:
                 anom = daily_anomaly_from_2024(df_daily_2024, d.month, d.day, var)
                 adj_val = base_val + (anom if not np.isnan(anom) else 0.0)
-            if var in ["rain", "humidity", "pm25"]:
-                adj_val = max(0.0, adj_val)
-            adjusted[var] = float(round(adj_val, 2))
+            adjusted[var] = float(round(float(floor_nonneg(var, adj_val)), 2))
 
         comfort = compute_comfort_index(adjusted)
         description = generate_comfort_summary(comfort)
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, Query, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from pydantic import BaseModel
@@ -11,15 +11,96 @@ import os
 import io
 import numpy as np
 import json
+import time
+import asyncio
+import signal
+import logging
+import importlib
+from contextlib import asynccontextmanager
 
-from utils.plot import plot_all
-from month.precipitation import pred_precipitation
-from month.temperature import pred
-from month.air import pred_air_quality
-from day.daily import run_climate_forecast
-from utils.generate_csv import generate_monthly_csv
+# 重的模組（sklearn / matplotlib / xarray / pandas）不在這裡 import：
+# forecast / plot 用 "module:function" 交給 worker process，history 串流在 handler 裡才 import
+from utils.config import MAX_GRID_POINTS, MAX_BATCH_ITEMS, MAX_BULK_SITES, HISTORY_YEAR_FROM, HISTORY_YEAR_TO, WARMUP
+from utils.config import FORECAST_BACKEND, SNAPSHOT_DRAIN_SECONDS
+from utils import catalog, metrics, profiler, response_cache, snapshots
+from utils.log import setup_logging
+from utils.periods import shift
+from utils.workers import LANES, Saturated, shutdown_pool, warm_up
 
-app = FastAPI(title="My Monorepo API", version="0.1.0")
+setup_logging()
+log = logging.getLogger(__name__)
+
+# /api/weather 用到的資料：月資料 baseline + 日資料 anomaly
+WEATHER_PRODUCTS = response_cache.MONTHLY_PRODUCTS + response_cache.DAILY_PRODUCTS
+
+# 每條 lane 用到的模組：pool lane 在 worker 裡 import，串流 lane 在這個 process 的 thread 裡
+_MODEL_MODULES = ["sklearn.ensemble"] if FORECAST_BACKEND == "rf" else []   # utils/forecasting.py 用到才 import
+POOL_MODULES = {
+    "weather": ["day.daily"] + _MODEL_MODULES,
+    "weather_month": ["month.temperature", "month.precipitation", "month.air"] + _MODEL_MODULES,
+    "weather_batch": ["day.batch"],
+    "weather_grid": ["day.batch"],
+    "plot": ["utils.plot"],
+}
+STREAM_MODULES = {
+    "history": ["utils.generate_csv"],
+    "history_bulk": ["utils.bulk_export"],
+}
+
+def _warmup_lanes():
+    if WARMUP.strip().lower() == "all":
+        return list(LANES)
+    lanes = [name.strip() for name in WARMUP.split(",") if name.strip()]
+    unknown = [name for name in lanes if name not in LANES]
+    if unknown:
+        log.warning("⚠️ unknown WARMUP lanes ignored", extra={"lanes": ",".join(unknown)})
+    return [name for name in lanes if name in LANES]
+
+async def _warm_up(lanes):
+    """背景預熱：/api/health 不等它；第一個 request 到的時候 worker 多半已經 import 好了"""
+    t0 = time.perf_counter()
+    pool_modules = sorted({m for lane in lanes for m in POOL_MODULES.get(lane, [])})
+    stream_modules = sorted({m for lane in lanes for m in STREAM_MODULES.get(lane, [])})
+    try:
+        if stream_modules:
+            await asyncio.to_thread(lambda: [importlib.import_module(m) for m in stream_modules])
+        if pool_modules:
+            await warm_up(pool_modules)
+    except Exception:
+        log.exception("❌ warm-up failed")
+        return
+    log.info("🔥 warm-up done", extra={"lanes": ",".join(lanes), "seconds": round(time.perf_counter() - t0, 2)})
+
+async def _gc_snapshots(delay):
+    """切換後等舊 snapshot 上的 request 都做完（SNAPSHOT_DRAIN_SECONDS）再刪"""
+    await asyncio.sleep(delay)
+    removed = await asyncio.to_thread(snapshots.gc)
+    if removed:
+        log.info("🧹 old snapshots removed", extra={"snapshots": ",".join(removed)})
+
+def _snapshot_switched():
+    """CURRENT 換了：這個 process 立刻改用新的（不等 DATA_VERSION_CHECK_SECONDS），排一次 gc"""
+    log.info("📸 serving snapshot", extra={"snapshot": snapshots.current(force=True)})
+    asyncio.get_running_loop().create_task(_gc_snapshots(SNAPSHOT_DRAIN_SECONDS + 1))
+
+@asynccontextmanager
+async def lifespan(app):
+    # 啟動時讓 granule catalog 跟上資料夾（沒變的檔案只有 stat）
+    log.info("🗂️ catalog refreshed", extra=await asyncio.to_thread(catalog.refresh))
+    if snapshots.current(force=True):
+        log.info("📸 serving snapshot", extra={"snapshot": snapshots.current()})
+    try:   # python -m utils.snapshots activate <id> 之後 kill -USR1 <pid>
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, _snapshot_switched)
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        pass   # Windows / 不在 main thread（uvloop 丟 ValueError）：等 DATA_VERSION_CHECK_SECONDS 自己看到
+    lanes = _warmup_lanes()
+    warming = asyncio.create_task(_warm_up(lanes)) if lanes else None
+    yield
+    if warming is not None:
+        warming.cancel()
+    shutdown_pool()
+
+app = FastAPI(title="My Monorepo API", version="0.1.0", lifespan=lifespan)
 
 allow_origins = os.getenv("ALLOW_ORIGINS", "*").split(",")
 app.add_middleware(
@@ -32,10 +113,142 @@ app.add_middleware(
 BACKEND_DIR = Path(__file__).resolve().parent
 app.mount("/static", StaticFiles(directory=str(BACKEND_DIR)), name="static")
 
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    admin 標記的 request（X-Profile: 1 或 ?profile=1，加上 X-Admin-Token）在 worker 裡用
+    sampling profiler 跑；結果存成一份 profile，response 帶 X-Profile-Id。
+    """
+    flag = request.headers.get("x-profile") or request.query_params.get("profile")
+    if flag not in ("1", "true"):
+        return await call_next(request)
+    if not profiler.is_admin(request.headers.get("x-admin-token")):
+        return JSONResponse({"detail": "Profiling requires a valid X-Admin-Token."}, status_code=403)
+
+    profile = profiler.Profile(f"{request.method} {request.url.path}"
+                               + (f"?{request.url.query}" if request.url.query else ""))
+    token = profiler.current.set(profile)
+    t0 = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.current.reset(token)
+    await asyncio.to_thread(profile.save, response.status_code, time.perf_counter() - t0)
+    response.headers["X-Profile-Id"] = profile.id
+    response.headers["X-Profile-Url"] = f"/api/admin/profiles/{profile.id}"
+    return response
+
+@app.middleware("http")
+async def pin_snapshot(request: Request, call_next):
+    """
+    整個 request（含 worker 裡的工作、串流的 response）都讀開始時上線的 data snapshot（utils/snapshots.py），
+    中途切換不會讀到一半新一半舊。沒有 snapshot 時照舊讀 ./data。
+    """
+    with snapshots.request_pin() as snapshot_id:
+        response = await call_next(request)
+    if snapshot_id:
+        response.headers["X-Data-Snapshot"] = snapshot_id
+    return response
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """http_request_seconds{route, method, status}；route 用路由樣板（/api/history.{fmt}），不用實際 URL"""
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or ("/static" if request.url.path.startswith("/static") else "other")
+        metrics.observe("http_request_seconds", time.perf_counter() - t0,
+                        route=path, method=request.method, status=status)
+
+@app.exception_handler(Saturated)
+async def saturated_handler(request: Request, ex: Saturated):
+    return JSONResponse(
+        {"detail": f"Server busy ({ex.lane}), retry later."},
+        status_code=503,
+        headers={"Retry-After": str(ex.retry_after)},
+    )
+
 @app.get("/api/health")
 def health():
     return {"DFSB4-NASA-Hackathon": True}
 
+@app.get("/api/catalog")
+def catalog_summary(year_from: int = Query(HISTORY_YEAR_FROM), year_to: int = Query(HISTORY_YEAR_TO)):
+    """每個 product 有幾個 granule、涵蓋範圍，以及 [year_from, year_to] 內缺的月份"""
+    products = catalog.stats()
+    today = dt.now()
+    last_ended = shift(today.year, today.month, -1)   # 這個月還沒結束，不算缺
+    for name, info in products.items():
+        if catalog.DATASETS[name][1] == "monthly":
+            info["missing"] = catalog.missing(name, year_from, year_to, until=last_ended)
+    return products
+
+@app.get("/api/metrics")
+def metrics_endpoint():
+    """Prometheus text format：各 stage 的耗時分布、開檔數 / 大小、model fit 次數、cache hit、lane 狀態"""
+    for name, lane in LANES.items():
+        metrics.set_gauge("lane_running", lane.running, lane=name)
+        metrics.set_gauge("lane_waiting", lane.waiting, lane=name)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _require_admin(request: Request):
+    if not profiler.is_admin(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+@app.get("/api/admin/profiles")
+def list_profiles(request: Request):
+    """最近存下來的 request profile（新的在前）"""
+    _require_admin(request)
+    return profiler.list_profiles()
+
+@app.get("/api/admin/profiles/{profile_id}")
+def get_profile(
+    request: Request,
+    profile_id: str,
+    format: Literal["tree", "collapsed", "json"] = "tree",
+    min_percent: float = Query(1.0, ge=0, le=100),
+):
+    """tree = 文字 call tree 摘要；collapsed = flamegraph.pl / speedscope 的輸入；json = 原始資料"""
+    _require_admin(request)
+    doc = profiler.load(profile_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    if format == "json":
+        return doc
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed(doc))
+    return PlainTextResponse(profiler.call_tree(doc, min_percent=min_percent))
+
+class SnapshotIn(BaseModel):
+    id: str
+
+@app.get("/api/admin/snapshots")
+def list_snapshots(request: Request):
+    """所有 data snapshot（新的在前）、哪個上線中、這個 process 裡各有幾個 request 還在用"""
+    _require_admin(request)
+    return snapshots.list_snapshots()
+
+@app.post("/api/admin/snapshots/activate")
+async def activate_snapshot(request: Request, body: SnapshotIn):
+    """切換上線的 snapshot（也用來 rollback）；新的 request 立刻改讀它，舊的讀完再 gc"""
+    _require_admin(request)
+    try:
+        await asyncio.to_thread(snapshots.activate, body.id)
+    except ValueError as ex:
+        raise HTTPException(status_code=404, detail=str(ex))
+    _snapshot_switched()
+    return {"current": body.id}
+
+@app.post("/api/admin/snapshots/gc")
+async def gc_snapshots(request: Request):
+    _require_admin(request)
+    return {"removed": await asyncio.to_thread(snapshots.gc)}
+
 class EchoIn(BaseModel):
     message: str
 
@@ -50,10 +263,16 @@ class PlotIn(BaseModel):
     lon: float = Field(..., ge=-180, le=180)
 
 @app.post("/api/plot")
-def plot(body: PlotIn):
-    out_paths = plot_all(body.month, body.lat, body.lon)
+async def plot(body: PlotIn):
+    # 同一格點、同一個月的圖只畫一次（POST 不走 HTTP cache，只有 server 端的 response cache）
+    key = await asyncio.to_thread(response_cache.request_key, "plot", body.lat, body.lon,
+                                  response_cache.MONTHLY_PRODUCTS, body.month)
+    out_paths, cache_status = await response_cache.get_or_compute(
+        key, lambda: LANES["plot"].run("utils.plot:plot_all", body.month, body.lat, body.lon),
+        valid=lambda paths: all(os.path.exists("." + p) for p in paths))   # 圖檔可能已被 plot cache 淘汰
     urls = [f"/static{Path(p).as_posix()}" for p in out_paths]
-    return JSONResponse({"month": body.month, "lat": body.lat, "lon": body.lon, "images": urls})
+    return JSONResponse({"month": body.month, "lat": body.lat, "lon": body.lon, "images": urls},
+                        headers={"X-Cache": cache_status.upper()})
 
 
 def _to_ymd(s: str) -> str:
@@ -77,7 +296,7 @@ def _nn(x):
         return None
     
 @app.get("/api/weather")
-def get_weather(
+async def get_weather(
     request: Request,
     latitude: float,
     longitude: float,
@@ -88,15 +307,33 @@ def get_weather(
 
     ed = sd + timedelta(days=3)
     e = ed.strftime("%Y-%m-%d")
+
+    # 結果只取決於格點 + 日期 + data version：同一格的點共用快取，ETag 對上直接 304
+    key = await asyncio.to_thread(response_cache.request_key, "weather", latitude, longitude,
+                                  WEATHER_PRODUCTS, s, e)
+    tag = response_cache.etag(key, latitude, longitude, s)
+    if response_cache.not_modified(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=response_cache.cache_headers(tag))
+
+    async def compute():
+        return json.loads(await LANES["weather"].run("day.daily:run_climate_forecast", latitude, longitude, s, e))
+
     try:
-        result_json = run_climate_forecast(latitude, longitude, s, e)
-        result = json.loads(result_json)
+        result, cache_status = await response_cache.get_or_compute(key, compute)
+    except Saturated:
+        raise
     except SystemExit as ex:
         raise HTTPException(status_code=422, detail=f"No data available: {ex}")
     except Exception as ex:
         raise HTTPException(status_code=500, detail=f"Forecast failed: {ex}")
 
     # 3) 組裝回傳
+    return JSONResponse(_weather_payload(latitude, longitude, s, result),
+                        headers={**response_cache.cache_headers(tag), "X-Cache": cache_status.upper()})
+
+
+def _weather_payload(latitude, longitude, s, result):
+    """run_climate_forecast 格式的結果 → /api/weather 的回傳格式"""
     summary = result.get("summary", {}) or {}
     summary_avg = summary.get("average_conditions", {}) or {}
     probs = summary.get("extreme_event_probabilities", {}) or {}
@@ -121,16 +358,114 @@ def get_weather(
         "climate_description": first_day.get("climate_description"),
     }
 
-    payload = {
+    return {
         "location": {"latitude": latitude, "longitude": longitude},
-        "datetime": s,  
+        "datetime": s,
         "data": data_block,
     }
+
+
+class WeatherPoint(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    datetime: str
+
+class WeatherBatchIn(BaseModel):
+    items: List[WeatherPoint]
+
+@app.post("/api/weather/batch")
+async def get_weather_batch(body: WeatherBatchIn):
+    """
+    多點版 /api/weather：同一格點 + 同一天的 item 只算一次，
+    月資料每個格點讀一次、日資料每個檔案只開一次（day/batch.py）。
+    """
+    if not body.items:
+        return JSONResponse({"results": []})
+    if len(body.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items: {len(body.items)} (max {MAX_BATCH_ITEMS})")
+
+    days, points = [], []
+    for k, it in enumerate(body.items):
+        try:
+            s = _to_ymd(it.datetime)
+            sd = _parse_date(s)
+        except HTTPException as ex:
+            raise HTTPException(status_code=400, detail=f"items[{k}]: {ex.detail}")
+        days.append(s)
+        points.append((it.latitude, it.longitude, sd))
+
+    try:
+        reports = await LANES["weather_batch"].run("day.batch:batch_reports", points)
+    except Saturated:
+        raise
+    except SystemExit as ex:
+        raise HTTPException(status_code=422, detail=f"No data available: {ex}")
+    except Exception as ex:
+        raise HTTPException(status_code=500, detail=f"Forecast failed: {ex}")
+
+    results = [_weather_payload(it.latitude, it.longitude, s, rep)
+               for it, s, rep in zip(body.items, days, reports)]
+    return JSONResponse({"results": results})
+
+
+@app.get("/api/weather/grid")
+async def get_weather_grid(
+    request: Request,
+    lat_min: float = Query(..., ge=-90, le=90),
+    lon_min: float = Query(..., ge=-180, le=180),
+    lat_max: float = Query(..., ge=-90, le=90),
+    lon_max: float = Query(..., ge=-180, le=180),
+    datetime: str = Query(...),
+    step: float = Query(0.5, gt=0),
+):
+    """Heatmap overlay：整塊 tile 一次算完（day/batch.py），每個欄位是 [lat][lon] 二維陣列"""
+    if lat_max < lat_min or lon_max < lon_min:
+        raise HTTPException(status_code=400, detail="lat_max/lon_max must be >= lat_min/lon_min")
+    n_points = (int((lat_max - lat_min) / step) + 1) * (int((lon_max - lon_min) / step) + 1)
+    if n_points > MAX_GRID_POINTS:
+        raise HTTPException(status_code=400, detail=f"Tile too large: {n_points} points (max {MAX_GRID_POINTS}). Increase step.")
+
+    s = _to_ymd(datetime)
+    sd = _parse_date(s)
+    e = (sd + timedelta(days=3)).strftime("%Y-%m-%d")
+    try:
+        tile = await LANES["weather_grid"].run("day.batch:forecast_tile", lat_min, lon_min, lat_max, lon_max, step, s, e)
+    except Saturated:
+        raise
+    except SystemExit as ex:
+        raise HTTPException(status_code=422, detail=f"No data available: {ex}")
+    except Exception as ex:
+        raise HTTPException(status_code=500, detail=f"Forecast failed: {ex}")
+
+    def grid(a):
+        return [[_nn(v) for v in row] for row in a]
+
+    avg, probs = tile["average"], tile["extreme"]
+    payload = {
+        "bbox": {"lat_min": lat_min, "lon_min": lon_min, "lat_max": lat_max, "lon_max": lon_max, "step": step},
+        "datetime": s,
+        "lats": [float(v) for v in tile["lats"]],
+        "lons": [float(v) for v in tile["lons"]],
+        "layers": {
+            "temperature":   grid(avg["temp"]),
+            "precipitation": grid(avg["rain"]),
+            "humidity":      grid(avg["humidity"]),
+            "windspeed":     grid(avg["wind"]),
+            "air_quality":   grid(avg["pm25"]),
+            "typhoon_probability":      grid(probs["typhoon_probability"] / 100.0),
+            "heatwave_probability":     grid(probs["heatwave_probability"] / 100.0),
+            "cold_wave_probability":    grid(probs["cold_wave_probability"] / 100.0),
+            "heavy_rain_probability":   grid(probs["heavy_rain_probability"] / 100.0),
+            "strong_wind_probability":  grid(probs["strong_wind_probability"] / 100.0),
+            "thunderstorm_probability": grid(probs["thunderstorm_probability"] / 100.0),
+            "very_uncomfortable":       grid(tile["comfort"]["very_uncomfortable"]),
+        },
+    }
     return JSONResponse(payload)
 
 
 @app.get("/api/weather/month")
-def get_monthly_weather(
+async def get_monthly_weather(
     request: Request,
     latitude: float,
     longitude: float,
@@ -139,25 +474,40 @@ def get_monthly_weather(
 ):
     try:
         iso = starttime.replace("Z", "+00:00")
-        t = dt.fromisoformat(iso)
+        dt.fromisoformat(iso)   # 只檢查格式
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid datetime. Use ISO 8601, e.g. 2025-10-04T08:00:00Z")
-    month = f"{t.month:02d}"
     description = []
-    temperature, humidity, windspeed, level = pred(latitude, longitude)
-    precipitation, rain_level = pred_precipitation(latitude, longitude)
-    air_quality, air_level = pred_air_quality(latitude, longitude)
+
+    # 預測只取決於三個月資料網格上的格點 + data version + 預測的起始月份（request_key 都有算進去；
+    # starttime / endtime 只是原樣回傳）
+    key = await asyncio.to_thread(response_cache.request_key, "weather_month", latitude, longitude,
+                                  response_cache.MONTHLY_PRODUCTS)
+    tag = response_cache.etag(key, latitude, longitude, starttime, endtime)
+    if response_cache.not_modified(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=response_cache.cache_headers(tag))
+
+    def images_exist(parts):
+        return all(os.path.exists("." + url) for part in parts for url in part[-1].values())
+
+    parts, cache_status = await response_cache.get_or_compute(
+        key,
+        lambda: LANES["weather_month"].gather(
+            ("month.temperature:pred", latitude, longitude),
+            ("month.precipitation:pred_precipitation", latitude, longitude),
+            ("month.air:pred_air_quality", latitude, longitude),
+        ),
+        valid=images_exist)
+    (temperature, humidity, windspeed, level, t_images), (precipitation, rain_level, p_images), \
+        (air_quality, air_level, a_images) = parts
     description.append(level)
     description.append(rain_level)
     description.append(air_level)
 
-    url_map = {
-        "temperature":   "/static/result/temperature/forecast_series.png",
-        "precipitation": "/static/result/precipitation/forecast_series.png",
-        "humidity":      "/static/result/humidity/forecast_series.png",
-        "windspeed":     "/static/result/windspeed/forecast_series.png",
-        "air_quality":   "/static/result/air_quality/forecast_series.png",
-    }
+    # 每個 request 拿到自己格點的圖（./result/cache/<hash>.png），不會被別的地點覆蓋
+    images = {**t_images, **p_images, **a_images}
+    url_map = {k: f"/static{images[k]}"
+               for k in ("temperature", "precipitation", "humidity", "windspeed", "air_quality")}
 
     payload = {
         "location": {"latitude": latitude, "longitude": longitude},
@@ -175,26 +525,95 @@ def get_monthly_weather(
             ),
         },
     }
-    return JSONResponse(payload)
+    return JSONResponse(payload, headers={**response_cache.cache_headers(tag), "X-Cache": cache_status.upper()})
 
-@app.get("/api/history.csv")
-def get_history_csv(
+class LaneStreamingResponse(StreamingResponse):
+    """
+    body 是 workers.Lane.stream 的 StreamBody：response 結束時一定釋放 lane 名額和 snapshot，
+    包括 client 在第一個 chunk 前就斷線、body 根本沒開始送的情況（取消時 finally 照樣會跑）
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.body_iterator.close()
+
+@app.get("/api/history.{fmt}")
+async def get_history(
     request: Request,
+    fmt: Literal["csv", "ndjson", "parquet", "arrow"],
     latitude: float,
     longitude: float,
+    interp: Literal["nearest", "bilinear"] = "nearest",
+    year_from: int = Query(HISTORY_YEAR_FROM, ge=1980, le=2100),
+    year_to: int = Query(HISTORY_YEAR_TO, ge=1980, le=2100),
 ):
-    df = generate_monthly_csv(latitude, longitude)
-    if df.empty:
+    from utils.generate_csv import HISTORY_FORMATS, arrow_available, encode_rows, iter_monthly_rows
+
+    if year_from > year_to:
+        raise HTTPException(status_code=400, detail="year_from must be <= year_to")
+    if fmt in ("parquet", "arrow") and not arrow_available():
+        raise HTTPException(status_code=501, detail=f"{fmt} export requires pyarrow on the server")
+
+    # 逐月讀、逐月送：第一個月讀完就開始傳，記憶體不隨年份範圍成長
+    rows = iter_monthly_rows(latitude, longitude, year_from, year_to, interp)
+    body = await LANES["history"].stream(encode_rows(rows, fmt))
+    if body is None:
         raise HTTPException(status_code=404, detail="No data found for the given parameters.")
-   
-    csv_io = io.StringIO()
-    df.to_csv(csv_io, index=False)
-    csv_io.seek(0)
-
-    filename = f"history_{latitude:.2f}_{longitude:.2f}.csv"
-    return StreamingResponse(
-        csv_io,
-        media_type="text/csv",
+
+    filename = f"history_{latitude:.2f}_{longitude:.2f}.{fmt}"
+    return LaneStreamingResponse(
+        body,
+        media_type=HISTORY_FORMATS[fmt],
         headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
+
+
+class BulkSite(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    id: str | None = None
+
+class HistoryBulkIn(BaseModel):
+    sites: List[BulkSite] = []
+    bbox: List[float] | None = Field(None, min_length=4, max_length=4)   # lat_min, lon_min, lat_max, lon_max
+    year_from: int = Field(HISTORY_YEAR_FROM, ge=1980, le=2100)
+    year_to: int = Field(HISTORY_YEAR_TO, ge=1980, le=2100)
+    format: Literal["csv", "ndjson", "parquet", "arrow"] = "csv"
+
+@app.post("/api/history/bulk")
+async def get_history_bulk(body: HistoryBulkIn):
+    """
+    多點 history：每個 granule 只開一次、所有點一次取出（utils/bulk_export.py），
+    回傳一個合併檔，依 (月份, site) 排序。sites 和 bbox 擇一（bbox = 範圍內所有 MERRA-2 格點）。
+    """
+    from utils.bulk_export import bbox_size, encode_bulk, sites_in_bbox
+    from utils.generate_csv import HISTORY_FORMATS, arrow_available
+
+    if body.year_from > body.year_to:
+        raise HTTPException(status_code=400, detail="year_from must be <= year_to")
+    if body.format in ("parquet", "arrow") and not arrow_available():
+        raise HTTPException(status_code=501, detail=f"{body.format} export requires pyarrow on the server")
+    if bool(body.sites) == bool(body.bbox):
+        raise HTTPException(status_code=400, detail="Give either sites or bbox.")
+
+    # 網格座標第一次要讀檔，放到 thread；bbox 先用 index 範圍算格點數，太大就不建 list
+    n = await asyncio.to_thread(bbox_size, tuple(body.bbox)) if body.bbox else len(body.sites)
+    if n > MAX_BULK_SITES:
+        raise HTTPException(status_code=400, detail=f"Too many sites: {n} (max {MAX_BULK_SITES})")
+    if body.bbox:
+        sites = await asyncio.to_thread(sites_in_bbox, tuple(body.bbox))
+    else:
+        sites = [(st.id or str(k), st.latitude, st.longitude) for k, st in enumerate(body.sites)]
+
+    stream = await LANES["history_bulk"].stream(encode_bulk(sites, body.format, body.year_from, body.year_to))
+    if stream is None:
+        raise HTTPException(status_code=404, detail="No data found for the given parameters.")
+    return LaneStreamingResponse(
+        stream,
+        media_type=HISTORY_FORMATS[body.format],
+        headers={"Content-Disposition": f'attachment; filename="history_bulk.{body.format}"'}
+    )
+
 # local test: uvicorn main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
@@ -1,81 +1,102 @@
-import os
-import netCDF4 as nc
+import logging
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from sklearn.ensemble import RandomForestRegressor
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
+from utils import metrics
+from utils.forecasting import get_backend
+from utils.models import load_artifact
+from utils.periods import forecast_months, history_months, span
+from utils.store import month_file, read_point_series, snap_to_grid
+from utils.grids import grid_of
+from utils.plot_cache import cached_plot, save_figure, url_path
 
-def pred_air_quality(lat, lon):
+AER_VARS = ['BCSMASS', 'OCSMASS', 'SO4SMASS', 'DUSMASS25', 'SSSMASS25']
+
+
+FEATURES = ["bc", "oc", "so4", "dust", "sea"]
+# utils/forecasting.py：rf 是每個目標月份一個 RF，成分 → PM2.5
+MODEL_SPEC = dict(targets=["pm25"], features=FEATURES, holdout_last=True,
+                  bounds={"pm25": (0, None)}, label="air_quality")
+
+log = logging.getLogger(__name__)
+
+
+@metrics.stage("extract")
+def load_history(lat, lon):
+    """讀最新 HISTORY_MONTHS 個月的 MERRA-2 aerosol 月資料 → DataFrame(date, year, month, pm25, 各成分)"""
     # === Config ===
-    data_dir = "./data/air_quality/" 
     target_lat, target_lon = lat, lon
     records = []
-
-    # === Read monthly data ===
-    for year in range(2022, 2025):
-        for month in range(1, 13):
-            fname = f"{year}/{month:02d}/MERRA2_400.tavgM_2d_aer_Nx.{year}{month:02d}.nc4"
-            fpath = os.path.join(data_dir, fname)
-            if not os.path.exists(fpath):
-                print(f"⚠️ Missing: {fname}")
+    point = read_point_series("air_quality", target_lat, target_lon, AER_VARS)  # None → read raw files
+
+    # === Read the monthly history window (utils/periods.py) ===
+    for year, month in history_months("air_quality"):
+        fname = f"air_quality {year}/{month:02d}"
+        if point is not None:
+            v = point.get((year, month))
+            if v is None:
+                log.debug("⚠️ missing month", extra={"month": fname})
+                continue
+        else:
+            fpath = month_file("air_quality", year, month)  # utils/catalog.py
+            if fpath is None:
+                log.debug("⚠️ missing month", extra={"month": fname})
                 continue
 
-            ds = nc.Dataset(fpath)
-            lat, lon = ds['lat'][:], ds['lon'][:]
-            lat_idx, lon_idx = np.abs(lat - target_lat).argmin(), np.abs(lon - target_lon).argmin()
-
-            bc = float(ds['BCSMASS'][0, lat_idx, lon_idx])
-            oc = float(ds['OCSMASS'][0, lat_idx, lon_idx])
-            so4 = float(ds['SO4SMASS'][0, lat_idx, lon_idx])
-            dust = float(ds['DUSMASS25'][0, lat_idx, lon_idx])
-            sea = float(ds['SSSMASS25'][0, lat_idx, lon_idx])
+            ds = metrics.open_dataset(fpath, "air_quality")
+            lat_idx, lon_idx = grid_of(ds).nearest(target_lat, target_lon)
+            v = {name: float(ds[name][0, lat_idx, lon_idx]) for name in AER_VARS}
             ds.close()
 
-            pm25 = (bc + oc + so4 * 1.375 + dust + sea) * 1e9
+        bc, oc, so4, dust, sea = (v[name] for name in AER_VARS)
+
+        pm25 = (bc + oc + so4 * 1.375 + dust + sea) * 1e9
 
-            records.append({
-                "date": datetime(year, month, 1),
-                "year": year,
-                "month": month,
-                "pm25": pm25,
-                "bc": bc * 1e9,
-                "oc": oc * 1e9,
-                "so4": so4 * 1e9,
-                "dust": dust * 1e9,
-                "sea": sea * 1e9
-            })
+        records.append({
+            "date": datetime(year, month, 1),
+            "year": year,
+            "month": month,
+            "pm25": pm25,
+            "bc": bc * 1e9,
+            "oc": oc * 1e9,
+            "so4": so4 * 1e9,
+            "dust": dust * 1e9,
+            "sea": sea * 1e9
+        })
 
     df = pd.DataFrame(records).sort_values("date").reset_index(drop=True)
-    print(f"📊 Loaded {len(df)} months from {df['date'].min()} to {df['date'].max()}")
+    log.debug("📊 monthly history loaded", extra={"product": "air_quality", "months": len(df)})
 
-    # === Predict each future month (2025/10–2026/05) ===
-    forecast_list = []
-    predict_years = [2025, 2026]
-    predict_months = list(range(10, 13)) + list(range(1, 6))
+    return df
 
-    for year in predict_years:
-        for month in predict_months:
-            if year == 2025 and month < 10: continue
-            if year == 2026 and month > 5: continue
 
-            month_df = df[df["month"] == month]
-            if len(month_df) < 3:
-                print(f"⚠️ {year}/{month:02d} insufficient samples ({len(month_df)})")
-                continue
+def fit_models(df, backend=None, months=None):
+    """回傳 fitted.predict(year, month) → {"pm25": value}；months 沒給時 12 個月份都 fit"""
+    return get_backend(backend).fit(df, months=months, **MODEL_SPEC)
 
-            X = month_df[["bc", "oc", "so4", "dust", "sea"]]
-            y = month_df["pm25"]
 
-            model = RandomForestRegressor(n_estimators=200, random_state=42)
-            model.fit(X.iloc[:-1], y.iloc[:-1])
-            X_next = pd.DataFrame([X.iloc[-1].to_dict()])
-            pred = float(model.predict(X_next)[0])
+def pred_air_quality(lat, lon):
+    df = load_history(lat, lon)
+
+    # === Predict each month of the forecast window (utils/periods.py) ===
+    cell = snap_to_grid("air_quality", lat, lon)
+    art = load_artifact("air_quality", cell)
+    targets = forecast_months()
+    models = art["models"] if art is not None else fit_models(df, months=sorted({m for _, m in targets}))
+
+    forecast_list = []
+    for year, month in targets:
+        month_df = df[df["month"] == month]
+        pred = models.predict(year, month)["pm25"]
+        if np.isnan(pred):
+            log.debug("⚠️ insufficient samples", extra={"month": f"{year}/{month:02d}", "samples": len(month_df)})
+            continue
 
-            forecast_list.append({"date": datetime(year, month, 1), "pred_pm25": pred})
+        forecast_list.append({"date": datetime(year, month, 1), "pred_pm25": pred})
 
     forecast_df = pd.DataFrame(forecast_list).sort_values("date")
 
@@ -97,22 +118,24 @@ def pred_air_quality(lat, lon):
     forecast_df["category"] = forecast_df["pred_pm25"].apply(classify_pm25)
 
     # === Output ===
-    print("\n🌫️ PM2.5 Forecast (Taipei, 2025/10–2026/05):\n")
-    for _, r in forecast_df.iterrows():
-        ym = r["date"].strftime("%B %Y")
-        print(f"{ym}: Predicted PM2.5 = {r['pred_pm25']:.1f} µg/m³ — {r['category']}")
-
-    # === Plot ===
-    out_dir = "./result/air_quality/"
-    plt.figure(figsize=(10,5))
-    plt.plot(df["date"], df["pm25"], "o-", label="Observed (2022–2025)", alpha=0.6)
-    plt.plot(forecast_df["date"], forecast_df["pred_pm25"], "r--o", label="Predicted (2025/10–2026/05)")
-    plt.title("Predicted Monthly PM2.5")
-    plt.ylabel("PM2.5 (µg/m³)")
-    plt.xlabel("Date")
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, "forecast_series.png"), dpi=150, bbox_inches="tight")
-
-    return forecast_df.iloc[0]['pred_pm25'], forecast_df.iloc[0]['category']
\ No newline at end of file
+    if log.isEnabledFor(logging.DEBUG):
+        for _, r in forecast_df.iterrows():
+            ym = r["date"].strftime("%B %Y")
+            log.debug(f"{ym}: Predicted PM2.5 = {r['pred_pm25']:.1f} µg/m³ — {r['category']}")
+
+    # === Plot（content-addressed 快取，見 utils/plot_cache.py） ===
+    path, hit = cached_plot("forecast_series", "air_quality", cell or (lat, lon), targets[0])
+    if not hit:
+        plt.figure(figsize=(10,5))
+        plt.plot(df["date"], df["pm25"], "o-", label=f"Observed ({span(list(zip(df['year'], df['month'])))})", alpha=0.6)
+        plt.plot(forecast_df["date"], forecast_df["pred_pm25"], "r--o", label=f"Predicted ({span(targets)})")
+        plt.title("Predicted Monthly PM2.5")
+        plt.ylabel("PM2.5 (µg/m³)")
+        plt.xlabel("Date")
+        plt.grid(True)
+        plt.legend()
+        plt.tight_layout()
+        save_figure(plt, path, dpi=150, bbox_inches="tight")
+    images = {"air_quality": url_path(path)}
+
+    return forecast_df.iloc[0]['pred_pm25'], forecast_df.iloc[0]['category'], images
\ No newline at end of file
@@ -1,91 +1,109 @@
-import os
-import netCDF4 as nc
+import logging
+import calendar
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from sklearn.ensemble import RandomForestRegressor
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
+from utils import metrics
+from utils.forecasting import get_backend
+from utils.models import load_artifact
+from utils.periods import forecast_months, history_months, span
+from utils.store import month_file, read_point_series, snap_to_grid
+from utils.grids import grid_of
+from utils.plot_cache import cached_plot, save_figure, url_path
 
-def pred_precipitation(lat, lon):
+IMERG_VARS = ['precipitation', 'precipitationQualityIndex', 'gaugeRelativeWeighting', 'randomError']
+
+
+FEATURES = ['precipitation', 'quality_index', 'gauge_weight', 'random_error']
+# utils/forecasting.py：rf 是每個目標月份一個 RF，用前幾年同月的特徵 → rain_prob
+MODEL_SPEC = dict(targets=['rain_prob'], features=FEATURES, holdout_last=True,
+                  bounds={'rain_prob': (0, 100)}, label="precipitation")
+
+log = logging.getLogger(__name__)
+
+
+@metrics.stage("extract")
+def load_history(lat, lon):
+    """讀最新 HISTORY_MONTHS 個月的 IMERG 月資料（utils/periods.py）→ DataFrame（含 0–100 的 rain_prob）"""
     # === Basic settings ===
-    data_dir = "./data/precipitation/"
     target_lat, target_lon = lat, lon
     records = []
-
-    # === Automatically load all monthly files ===
-    for year in range(2022, 2026):
-        for month in range(1, 13):
-            if (year == 2025 and month > 5):  # up to 2025/05
-                break
-            fname = f"{year}/{month:02d}/3B-MO.MS.MRG.3IMERG.{year}{month:02d}01-S000000-E235959.{month:02d}.V07B.HDF5"
-            fpath = os.path.join(data_dir, fname)
-
-            if not os.path.exists(fpath):
-                print(f"⚠️ Missing: {fname}")
+    point = read_point_series("precipitation", target_lat, target_lon, IMERG_VARS)  # None → read raw files
+
+    # === Load the monthly history window ===
+    for year, month in history_months("precipitation"):
+        fname = f"precipitation {year}/{month:02d}"
+        if point is not None:
+            v = point.get((year, month))
+            if v is None:
+                log.debug("⚠️ missing month", extra={"month": fname})
+                continue
+        else:
+            fpath = month_file("precipitation", year, month)  # utils/catalog.py
+            if fpath is None:
+                log.debug("⚠️ missing month", extra={"month": fname})
                 continue
 
-            ds = nc.Dataset(fpath)
+            ds = metrics.open_dataset(fpath, "precipitation")
             grp = ds.groups["Grid"]
-            lat, lon = grp.variables['lat'][:], grp.variables['lon'][:]
-            lat_idx, lon_idx = np.abs(lat - target_lat).argmin(), np.abs(lon - target_lon).argmin()
-
-            rain_amt = float(grp.variables['precipitation'][0, lon_idx, lat_idx])
-            quality = float(grp.variables['precipitationQualityIndex'][0, lon_idx, lat_idx])
-            gauge = float(grp.variables['gaugeRelativeWeighting'][0, lon_idx, lat_idx])
-            error = float(grp.variables['randomError'][0, lon_idx, lat_idx])
+            lat_idx, lon_idx = grid_of(grp).nearest(target_lat, target_lon)
+            v = {name: float(grp.variables[name][0, lon_idx, lat_idx]) for name in IMERG_VARS}
             ds.close()
 
-            records.append({
-                'date': datetime(year, month, 1),
-                'year': year,
-                'month': month,
-                'precipitation': rain_amt,
-                'quality_index': quality,
-                'gauge_weight': gauge,
-                'random_error': error
-            })
+        rain_amt = v['precipitation']
+        quality = v['precipitationQualityIndex']
+        gauge = v['gaugeRelativeWeighting']
+        error = v['randomError']
+
+        records.append({
+            'date': datetime(year, month, 1),
+            'year': year,
+            'month': month,
+            'precipitation': rain_amt,
+            'quality_index': quality,
+            'gauge_weight': gauge,
+            'random_error': error
+        })
 
     # === Create DataFrame ===
     df = pd.DataFrame(records).sort_values('date').reset_index(drop=True)
-    print(f"\n📊 Loaded {len(df)} months from {df['date'].min().strftime('%Y-%m')} to {df['date'].max().strftime('%Y-%m')}")
+    log.debug("📊 monthly history loaded", extra={"product": "precipitation", "months": len(df)})
 
     # === Normalize precipitation as proxy for rain probability (0–100) ===
     p = df['precipitation'].astype(float)
     pmin, pmax = np.nanpercentile(p, 5), np.nanpercentile(p, 95)
     df['rain_prob'] = (np.clip(p, pmin, pmax) - pmin) / (pmax - pmin) * 100.0
 
-    # === Train per-month models ===
-    forecast_list = []
-    predict_years = [2025, 2026]
-    predict_months = list(range(10, 13)) + list(range(1, 6))  # 2025/10–2026/05
+    return df
 
-    for year in predict_years:
-        for month in predict_months:
-            if year == 2025 and month < 10:
-                continue
-            if year == 2026 and month > 5:
-                continue
 
-            # Extract same-month historical data
-            month_df = df[df['month'] == month]
-            if len(month_df) < 3:
-                print(f"⚠️ {year}/{month:02d} - Not enough samples ({len(month_df)})")
-                continue
+def fit_models(df, backend=None, months=None):
+    """回傳 fitted.predict(year, month) → {"rain_prob": value}；months 沒給時 12 個月份都 fit"""
+    return get_backend(backend).fit(df, months=months, **MODEL_SPEC)
 
-            features = ['precipitation', 'quality_index', 'gauge_weight', 'random_error']
-            X = month_df[features]
-            y = month_df['rain_prob']
 
-            model = RandomForestRegressor(n_estimators=200, random_state=42)
-            X_train, y_train = X.iloc[:-1], y.iloc[:-1]
-            X_next = X.iloc[[-1]]
-            model.fit(X_train, y_train)  # Train on previous years
-            pred = model.predict(X_next)[0]  # Predict next year
+def pred_precipitation(lat, lon):
+    df = load_history(lat, lon)
+
+    # === Per-month models: pretrained artifact if present, otherwise fit now ===
+    cell = snap_to_grid("precipitation", lat, lon)
+    art = load_artifact("precipitation", cell)
+    targets = forecast_months()
+    models = art["models"] if art is not None else fit_models(df, months=sorted({m for _, m in targets}))
+
+    forecast_list = []
+    for year, month in targets:
+        month_df = df[df['month'] == month]
+        pred = models.predict(year, month)['rain_prob']  # Predict next year
+        if np.isnan(pred):
+            log.debug("⚠️ not enough samples", extra={"month": f"{year}/{month:02d}", "samples": len(month_df)})
+            continue
 
-            forecast_list.append({'date': datetime(year, month, 1), 'predicted_rain_prob': pred})
+        forecast_list.append({'date': datetime(year, month, 1), 'predicted_rain_prob': pred})
 
     forecast_df = pd.DataFrame(forecast_list).sort_values('date').reset_index(drop=True)
 
@@ -103,60 +121,66 @@ def pred_precipitation(lat, lon):
     forecast_df['rain_level'] = forecast_df['predicted_rain_prob'].apply(classify_rain_level)
 
     # === Output English descriptions ===
-    print("\n🌦️ Rainfall outlook for Oct 2025 – May 2026:\n")
-    for _, row in forecast_df.iterrows():
-        ym = row['date'].strftime('%B %Y')
-        prob = row['predicted_rain_prob']
-        desc = row['rain_level']
-        print(f"{ym}: Predicted rain index {prob:.1f}. {desc}")
-
-    # === Visualization ===
-    out_dir = "./result/precipitation"
-    os.makedirs(out_dir, exist_ok=True)
-    plt.figure(figsize=(10,5))
-    plt.plot(df['date'], df['rain_prob'], 'o-', color='gray', alpha=0.6, label='Observed (2022/06–2025/05)')
-    plt.plot(forecast_df['date'], forecast_df['predicted_rain_prob'], 'r--', label='Predicted (Oct 2025–May 2026)')
-    plt.title('Predicted Monthly Precipitation (2025/10–2026/05)')
-    plt.ylabel('Precipitation (mm/h)')
-    plt.xlabel('Date')
-    plt.legend()
-    plt.grid(True)
-    series_path = os.path.join(out_dir, "forecast_series.png")
-    plt.savefig(series_path, dpi=150, bbox_inches="tight")
-
-    oct_hist = df[df['month'] == 10][['date', 'rain_prob']].copy()
-    oct_hist['year'] = oct_hist['date'].dt.year
-    oct_hist = oct_hist.sort_values('year')
-
-    oct_pred = forecast_df[forecast_df['date'].dt.month == 10][['date', 'predicted_rain_prob']].copy()
-    oct_pred['year'] = oct_pred['date'].dt.year
-
-    plot_df_hist = oct_hist[['year', 'rain_prob']].rename(columns={'rain_prob': 'value'})
-    plot_df_hist['type'] = 'Observed'
-    plot_df_pred = oct_pred[['year', 'predicted_rain_prob']].rename(columns={'predicted_rain_prob': 'value'})
-    plot_df_pred['type'] = 'Predicted'
-
-    plot_df = pd.concat([plot_df_hist, plot_df_pred], ignore_index=True).sort_values('year')
-
-    plt.figure(figsize=(8,5))
-    hist_part = plot_df[plot_df['type']=='Observed']
-    plt.bar(hist_part['year'].astype(str), hist_part['value'], label='Observed Oct rain index', alpha=0.6, edgecolor='black')
-    pred_part = plot_df[plot_df['type']=='Predicted']
-    plt.bar(pred_part['year'].astype(str), pred_part['value'], label='Predicted Oct 2025 rain index', alpha=0.9, edgecolor='black')
-
-    for _, r in plot_df.iterrows():
-        plt.text(str(r['year']), r['value']+1, f"{r['value']:.1f}", ha='center', va='bottom', fontsize=9)
-
-    plt.title('Rain Probability: Observed vs Predicted')
-    plt.ylabel('Rain Probability Index (0–100)')
-    plt.xlabel('Year')
-    plt.ylim(0, 105)
-    plt.grid(axis='y', linestyle='--', alpha=0.4)
-    plt.legend()
-    plt.tight_layout()
-    bar_path = os.path.join(out_dir, "bar.png")
-    plt.savefig(bar_path, dpi=150, bbox_inches="tight")
+    if log.isEnabledFor(logging.DEBUG):
+        for _, row in forecast_df.iterrows():
+            ym = row['date'].strftime('%B %Y')
+            log.debug(f"{ym}: Predicted rain index {row['predicted_rain_prob']:.1f}. {row['rain_level']}")
+
+    # === Visualization（content-addressed 快取，見 utils/plot_cache.py） ===
+    images = {}
+    key_cell = cell or (lat, lon)
+    path, hit = cached_plot("forecast_series", "precipitation", key_cell, targets[0])
+    if not hit:
+        observed = span(list(zip(df['year'], df['month'])))
+        plt.figure(figsize=(10,5))
+        plt.plot(df['date'], df['rain_prob'], 'o-', color='gray', alpha=0.6, label=f'Observed ({observed})')
+        plt.plot(forecast_df['date'], forecast_df['predicted_rain_prob'], 'r--', label=f'Predicted ({span(targets)})')
+        plt.title(f'Predicted Monthly Precipitation ({span(targets)})')
+        plt.ylabel('Precipitation (mm/h)')
+        plt.xlabel('Date')
+        plt.legend()
+        plt.grid(True)
+        save_figure(plt, path, dpi=150, bbox_inches="tight")
+    images["precipitation"] = url_path(path)
+
+    # 預報第一個月：往年同月的觀測 vs 預測
+    first_year, first_month = targets[0]
+    month_name = calendar.month_abbr[first_month]
+    path, hit = cached_plot("bar", "precipitation", key_cell, targets[0])
+    if not hit:
+        month_hist = df[df['month'] == first_month][['date', 'rain_prob']].copy()
+        month_hist['year'] = month_hist['date'].dt.year
+        month_hist = month_hist.sort_values('year')
+
+        month_pred = forecast_df[forecast_df['date'].dt.month == first_month][['date', 'predicted_rain_prob']].copy()
+        month_pred['year'] = month_pred['date'].dt.year
+
+        plot_df_hist = month_hist[['year', 'rain_prob']].rename(columns={'rain_prob': 'value'})
+        plot_df_hist['type'] = 'Observed'
+        plot_df_pred = month_pred[['year', 'predicted_rain_prob']].rename(columns={'predicted_rain_prob': 'value'})
+        plot_df_pred['type'] = 'Predicted'
+
+        plot_df = pd.concat([plot_df_hist, plot_df_pred], ignore_index=True).sort_values('year')
+
+        plt.figure(figsize=(8,5))
+        hist_part = plot_df[plot_df['type']=='Observed']
+        plt.bar(hist_part['year'].astype(str), hist_part['value'], label=f'Observed {month_name} rain index', alpha=0.6, edgecolor='black')
+        pred_part = plot_df[plot_df['type']=='Predicted']
+        plt.bar(pred_part['year'].astype(str), pred_part['value'], label=f'Predicted {month_name} {first_year} rain index', alpha=0.9, edgecolor='black')
+
+        for _, r in plot_df.iterrows():
+            plt.text(str(r['year']), r['value']+1, f"{r['value']:.1f}", ha='center', va='bottom', fontsize=9)
+
+        plt.title('Rain Probability: Observed vs Predicted')
+        plt.ylabel('Rain Probability Index (0–100)')
+        plt.xlabel('Year')
+        plt.ylim(0, 105)
+        plt.grid(axis='y', linestyle='--', alpha=0.4)
+        plt.legend()
+        plt.tight_layout()
+        save_figure(plt, path, dpi=150, bbox_inches="tight")
+    images["precipitation_bar"] = url_path(path)
 
     first_pred = float(forecast_df.iloc[0]['predicted_rain_prob'])
     first_level = str(forecast_df.iloc[0]['rain_level'])
-    return first_pred, first_level
+    return first_pred, first_level, images
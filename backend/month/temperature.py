@@ -1,103 +1,108 @@
-import os
-import netCDF4 as nc
+import logging
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from sklearn.ensemble import RandomForestRegressor
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
-def pred(lat, lon):
+from utils import metrics
+from utils.forecasting import get_backend
+from utils.models import load_artifact
+from utils.periods import forecast_months, history_months, span
+from utils.store import month_file, read_point_series, snap_to_grid
+from utils.grids import grid_of
+from utils.plot_cache import cached_plot, save_figure, url_path
+
+SLV_VARS = ['T2M', 'QV2M', 'SLP', 'U10M', 'V10M']
+
+TARGETS = ['T2M', 'QV2M', 'SLP', 'WIND']
+# utils/forecasting.py：rf 是每個月份一個 multi-output RF（X = year，最後一年不進訓練）
+MODEL_SPEC = dict(targets=TARGETS, holdout_last=True,
+                  bounds={'QV2M': (0, None), 'WIND': (0, None)}, label="temperature")
+
+log = logging.getLogger(__name__)
+
+@metrics.stage("extract")
+def load_history(lat, lon):
+    """讀最新 HISTORY_MONTHS 個月的月資料（utils/periods.py）→ DataFrame(date, year, month, T2M, QV2M, SLP, WIND)"""
     # === Basic Config ===
-    data_dir = "./data/temperature/"  # MERRA-2 tavgM_2d_slv_Nx monthly files
     target_lat, target_lon = lat, lon
     records = []
-
-    # === Read monthly data 2022/06–2025/05 ===
-    for year in range(2022, 2026):
-        for month in range(1, 13):
-            if (year == 2022 and month < 6):
+    point = read_point_series("temperature", target_lat, target_lon, SLV_VARS)  # None → read raw files
+
+    # === Read the monthly history window ===
+    for year, month in history_months("temperature"):
+        fname = f"temperature {year}/{month:02d}"
+        if point is not None:
+            v = point.get((year, month))
+            if v is None:
+                log.debug("⚠️ missing month", extra={"month": fname})
                 continue
-            if (year == 2025 and month > 5):
-                break
-
-            fname = f"{year}/{month:02d}/MERRA2_400.tavgM_2d_slv_Nx.{year}{month:02d}.nc4"
-            fpath = os.path.join(data_dir, fname)
-            if not os.path.exists(fpath):
-                print(f"⚠️ Missing: {fname}")
+        else:
+            fpath = month_file("temperature", year, month)  # utils/catalog.py
+            if fpath is None:
+                log.debug("⚠️ missing month", extra={"month": fname})
                 continue
 
-            ds = nc.Dataset(fpath)
-            lat = ds.variables['lat'][:]
-            lon = ds.variables['lon'][:]
-            lat_idx = np.abs(lat - target_lat).argmin()
-            lon_idx = np.abs(lon - target_lon).argmin()
-
-            # Extract key variables
-            t2m = float(ds.variables['T2M'][0, lat_idx, lon_idx]) - 273.15  # °C
-            qv2m = float(ds.variables['QV2M'][0, lat_idx, lon_idx]) * 1000  # g/kg (rough conversion)
-            slp = float(ds.variables['SLP'][0, lat_idx, lon_idx]) / 100.0   # hPa
-            u10m = float(ds.variables['U10M'][0, lat_idx, lon_idx])
-            v10m = float(ds.variables['V10M'][0, lat_idx, lon_idx])
-            wind_speed = np.sqrt(u10m**2 + v10m**2)  # m/s
+            ds = metrics.open_dataset(fpath, "temperature")
+            lat_idx, lon_idx = grid_of(ds).nearest(target_lat, target_lon)
+            v = {name: float(ds.variables[name][0, lat_idx, lon_idx]) for name in SLV_VARS}
             ds.close()
 
-            records.append({
-                'date': datetime(year, month, 1),
-                'year': year,
-                'month': month,
-                'T2M': t2m,
-                'QV2M': qv2m,
-                'SLP': slp,
-                'WIND': wind_speed
-            })
+        # Extract key variables
+        t2m = v['T2M'] - 273.15  # °C
+        qv2m = v['QV2M'] * 1000  # g/kg (rough conversion)
+        slp = v['SLP'] / 100.0   # hPa
+        wind_speed = np.sqrt(v['U10M']**2 + v['V10M']**2)  # m/s
+
+        records.append({
+            'date': datetime(year, month, 1),
+            'year': year,
+            'month': month,
+            'T2M': t2m,
+            'QV2M': qv2m,
+            'SLP': slp,
+            'WIND': wind_speed
+        })
 
     # === Build DataFrame ===
     df = pd.DataFrame(records).sort_values('date').reset_index(drop=True)
-    print(f"\n📊 Loaded {len(df)} months from {df['date'].min().strftime('%Y-%m')} to {df['date'].max().strftime('%Y-%m')}")
+    log.debug("📊 monthly history loaded", extra={"product": "temperature", "months": len(df)})
+    return df
 
-    # === Prediction setup ===
-    forecast_list = []
-    predict_years = [2025, 2026]
-    predict_months = list(range(10, 13)) + list(range(1, 6))
-
-    def rf_forecast(month_df, var_name, year):
-        """Train and predict one variable"""
-        if len(month_df) < 3:
-            return None
-        X = month_df[['year']]
-        y = month_df[var_name]
-        model = RandomForestRegressor(n_estimators=200, random_state=42)
-        model.fit(X.iloc[:-1], y.iloc[:-1])
-        X_next = pd.DataFrame({'year': [year]})
-        return float(model.predict(X_next)[0])
-
-    # === Train & Predict ===
-    for year in predict_years:
-        for month in predict_months:
-            if year == 2025 and month < 10:
-                continue
-            if year == 2026 and month > 5:
-                continue
+def fit_models(df, backend=None, months=None):
+    """
+    回傳 fitted.predict(year, month) → {var: value}；backend 預設 FORECAST_BACKEND。
+    months 沒給時 12 個月份都 fit（離線 artifact 要能用在任何預報視窗）
+    """
+    return get_backend(backend).fit(df, months=months, **MODEL_SPEC)
 
-            month_df = df[df['month'] == month]
-            if len(month_df) < 3:
-                print(f"⚠️ {year}/{month:02d} insufficient data ({len(month_df)} samples)")
-                continue
+def pred(lat, lon):
+    df = load_history(lat, lon)
 
-            temp_pred = rf_forecast(month_df, 'T2M', year)
-            humid_pred = rf_forecast(month_df, 'QV2M', year)
-            pres_pred = rf_forecast(month_df, 'SLP', year)
-            wind_pred = rf_forecast(month_df, 'WIND', year)
+    # === Models: pretrained artifact if present, otherwise fit now ===
+    cell = snap_to_grid("temperature", lat, lon)
+    art = load_artifact("temperature", cell)
+    targets = forecast_months()
+    models = art["models"] if art is not None else fit_models(df, months=sorted({m for _, m in targets}))
 
-            forecast_list.append({
-                'date': datetime(year, month, 1),
-                'Pred_Temp': temp_pred,
-                'Pred_Humidity': humid_pred,
-                'Pred_Pressure': pres_pred,
-                'Pred_Wind': wind_pred
-            })
+    # === Predict ===
+    forecast_list = []
+    for year, month in targets:
+        p = models.predict(year, month)
+        if any(np.isnan(v) for v in p.values()):
+            log.debug("⚠️ insufficient data", extra={"month": f"{year}/{month:02d}",
+                                                    "samples": len(df[df['month'] == month])})
+            continue
+
+        forecast_list.append({
+            'date': datetime(year, month, 1),
+            'Pred_Temp': p['T2M'],
+            'Pred_Humidity': p['QV2M'],
+            'Pred_Pressure': p['SLP'],
+            'Pred_Wind': p['WIND']
+        })
 
     forecast_df = pd.DataFrame(forecast_list).sort_values('date').reset_index(drop=True)
 
@@ -125,58 +130,59 @@ def pred(lat, lon):
     forecast_df['description'] = forecast_df.apply(lambda r: classify_weather(r.Pred_Temp, r.Pred_Humidity, r.Pred_Wind), axis=1)
 
     # === Output summary ===
-    print("\n Predicted Climate Summary (Taipei, 2025/10–2026/05):\n")
-    for _, row in forecast_df.iterrows():
-        ym = row['date'].strftime('%Y-%m')
-        print(f"{ym}: Temp {row.Pred_Temp:.1f}°C, Humidity {row.Pred_Humidity:.1f} g/kg, "
-            f"Pressure {row.Pred_Pressure:.1f} hPa, Wind {row.Pred_Wind:.1f} m/s — {row.description}")
+    if log.isEnabledFor(logging.DEBUG):
+        for _, row in forecast_df.iterrows():
+            ym = row['date'].strftime('%Y-%m')
+            log.debug(f"{ym}: Temp {row.Pred_Temp:.1f}°C, Humidity {row.Pred_Humidity:.1f} g/kg, "
+                      f"Pressure {row.Pred_Pressure:.1f} hPa, Wind {row.Pred_Wind:.1f} m/s — {row.description}")
 
     # === Visualization ===
-    out_dir = "./result/temperature/"
-    os.makedirs(out_dir, exist_ok=True)
-
+    # 圖檔以 (變數, 格點, 預報起始月, data version) 定址，同一格點第二次起直接用快取
+    images = {}
+    key_cell = cell or (lat, lon)
     # 1) Temperature (°C)
-    plt.figure(figsize=(12,6))
-    plt.plot(df['date'], df['T2M'], 'gray', alpha=0.5, label='Observed Temp (°C)')
-    plt.plot(forecast_df['date'], forecast_df['Pred_Temp'], 'r--o', label='Predicted Temp')
-    plt.title("Predicted Monthly Temperature (2025/10–2026/05)")
-    plt.ylabel("Temperature (°C)")
-    plt.xlabel("Date")
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-    temp_series_path = os.path.join(out_dir, "forecast_series.png")
-    plt.savefig(temp_series_path, dpi=150, bbox_inches="tight")
-    plt.close()
+    path, hit = cached_plot("forecast_series", "temperature", key_cell, targets[0])
+    if not hit:
+        plt.figure(figsize=(12,6))
+        plt.plot(df['date'], df['T2M'], 'gray', alpha=0.5, label='Observed Temp (°C)')
+        plt.plot(forecast_df['date'], forecast_df['Pred_Temp'], 'r--o', label='Predicted Temp')
+        plt.title(f"Predicted Monthly Temperature ({span(targets)})")
+        plt.ylabel("Temperature (°C)")
+        plt.xlabel("Date")
+        plt.grid(True)
+        plt.legend()
+        plt.tight_layout()
+        save_figure(plt, path, dpi=150, bbox_inches="tight")
+    images["temperature"] = url_path(path)
 
     # 2) Humidity (QV2M, g/kg)
-    out_dir = "./result/humidity/"
-    plt.figure(figsize=(12,6))
-    plt.plot(df['date'], df['QV2M'], 'gray', alpha=0.5, label='Observed Humidity (g/kg)')
-    plt.plot(forecast_df['date'], forecast_df['Pred_Humidity'], 'r--o', label='Predicted Humidity')
-    plt.title("Predicted Monthly Humidity (2025/10–2026/05)")
-    plt.ylabel("Specific Humidity (g/kg)")
-    plt.xlabel("Date")
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-    humid_series_path = os.path.join(out_dir, "forecast_series.png")
-    plt.savefig(humid_series_path, dpi=150, bbox_inches="tight")
-    plt.close()
+    path, hit = cached_plot("forecast_series", "humidity", key_cell, targets[0])
+    if not hit:
+        plt.figure(figsize=(12,6))
+        plt.plot(df['date'], df['QV2M'], 'gray', alpha=0.5, label='Observed Humidity (g/kg)')
+        plt.plot(forecast_df['date'], forecast_df['Pred_Humidity'], 'r--o', label='Predicted Humidity')
+        plt.title(f"Predicted Monthly Humidity ({span(targets)})")
+        plt.ylabel("Specific Humidity (g/kg)")
+        plt.xlabel("Date")
+        plt.grid(True)
+        plt.legend()
+        plt.tight_layout()
+        save_figure(plt, path, dpi=150, bbox_inches="tight")
+    images["humidity"] = url_path(path)
 
     # 3) Wind (m/s)
-    out_dir = "./result/windspeed/"
-    plt.figure(figsize=(12,6))
-    plt.plot(df['date'], df['WIND'], 'gray', alpha=0.5, label='Observed Wind (m/s)')
-    plt.plot(forecast_df['date'], forecast_df['Pred_Wind'], 'r--o', label='Predicted Wind')
-    plt.title("Predicted Monthly Wind Speed (2025/10–2026/05)")
-    plt.ylabel("Wind Speed (m/s)")
-    plt.xlabel("Date")
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-    wind_series_path = os.path.join(out_dir, "forecast_series.png")
-    plt.savefig(wind_series_path, dpi=150, bbox_inches="tight")
-    plt.close()
-
-    return forecast_df.iloc[0]['Pred_Temp'], forecast_df.iloc[0]['Pred_Humidity'], forecast_df.iloc[0]['Pred_Wind'], forecast_df.iloc[0]['description']
\ No newline at end of file
+    path, hit = cached_plot("forecast_series", "windspeed", key_cell, targets[0])
+    if not hit:
+        plt.figure(figsize=(12,6))
+        plt.plot(df['date'], df['WIND'], 'gray', alpha=0.5, label='Observed Wind (m/s)')
+        plt.plot(forecast_df['date'], forecast_df['Pred_Wind'], 'r--o', label='Predicted Wind')
+        plt.title(f"Predicted Monthly Wind Speed ({span(targets)})")
+        plt.ylabel("Wind Speed (m/s)")
+        plt.xlabel("Date")
+        plt.grid(True)
+        plt.legend()
+        plt.tight_layout()
+        save_figure(plt, path, dpi=150, bbox_inches="tight")
+    images["windspeed"] = url_path(path)
+
+    return forecast_df.iloc[0]['Pred_Temp'], forecast_df.iloc[0]['Pred_Humidity'], forecast_df.iloc[0]['Pred_Wind'], forecast_df.iloc[0]['description'], images
\ No newline at end of file
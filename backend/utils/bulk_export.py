@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-location bulk history export.
+
+/api/history.csv 一次一個點，每次都把 2020 年起的每個 granule 重開一遍；
+這裡一次處理 N 個點：每個 granule 只開一次，所有點一次取出（store.read_points_series），
+成本跟檔案數成正比，而不是檔案數 × 點數。
+
+    python -m utils.bulk_export --sites sites.csv --out ./result/bulk --format parquet
+    python -m utils.bulk_export --bbox 24.5,121,25.5,122 --year-from 2020 --year-to 2025
+
+sites.csv 需要 lat,lon 欄位（id 可有可無）。輸出依年份分區：
+    <out>/year=2020/part-0.parquet
+    <out>/year=2021/part-0.parquet ...
+欄位 = site + generate_csv.COLUMNS。
+"""
+import os
+import csv
+import argparse
+from itertools import groupby
+
+import numpy as np
+
+from utils.config import HISTORY_YEAR_FROM, HISTORY_YEAR_TO, MAX_BULK_SITES
+from utils.generate_csv import COLUMNS, encode_rows
+from utils.store import grid_coords, read_points_series
+
+BULK_COLUMNS = ["site"] + COLUMNS
+EXT = {"csv": "csv", "ndjson": "ndjson", "parquet": "parquet", "arrow": "arrows"}
+
+
+def _bbox_index(bbox, product):
+    """bbox 內的 (lats, lons, 緯度 index, 經度 index)；沒有網格時 None"""
+    coords = grid_coords(product)
+    if coords is None:
+        return None
+    lats, lons = coords
+    lat_min, lon_min, lat_max, lon_max = bbox
+    li = np.where((lats >= lat_min) & (lats <= lat_max))[0]
+    xi = np.where((lons >= lon_min) & (lons <= lon_max))[0]
+    return lats, lons, li, xi
+
+
+def bbox_size(bbox, product="temperature"):
+    """bbox 內有幾個格點（只算 index 範圍，不建 site list）"""
+    idx = _bbox_index(bbox, product)
+    return 0 if idx is None else len(idx[2]) * len(idx[3])
+
+
+def sites_in_bbox(bbox, product="temperature"):
+    """bbox 內某個 product 網格的所有格點 → [(id, lat, lon)]（預設 MERRA-2 格點）"""
+    idx = _bbox_index(bbox, product)
+    if idx is None:
+        return []
+    lats, lons, li, xi = idx
+    return [(f"{lats[i]:.3f}_{lons[j]:.3f}", float(lats[i]), float(lons[j])) for i in li for j in xi]
+
+
+def read_sites_csv(path):
+    with open(path, newline="") as f:
+        return [(row.get("id") or f"{i}", float(row["lat"]), float(row["lon"]))
+                for i, row in enumerate(csv.DictReader(f))]
+
+
+def load_bulk_arrays(lats, lons, year_from, year_to):
+    """三個 product 各讀一次 → (yms, {column: (N, M)})；某 product 缺的月份是 NaN"""
+    n = len(lats)
+    parts = []
+
+    times, cols = read_points_series("precipitation", lats, lons, ["precipitation"], year_from, year_to)
+    if cols:
+        parts.append((times, {"per": cols["precipitation"]}))  # mm/h
+    times, cols = read_points_series("temperature", lats, lons, ["T2M", "QV2M", "U10M", "V10M"],
+                                     year_from, year_to)
+    if cols:
+        parts.append((times, {"tem": cols["T2M"] - 273.15,                          # °C
+                              "hum": cols["QV2M"] * 1000.0,                         # g/kg
+                              "wind": np.sqrt(cols["U10M"]**2 + cols["V10M"]**2)}))  # m/s
+    times, cols = read_points_series("air_quality", lats, lons, None, year_from, year_to)
+    if cols:
+        parts.append((times, {"pm25": (cols["BCSMASS"] + cols["OCSMASS"] + 1.375*cols["SO4SMASS"]
+                                       + cols["DUSMASS25"] + cols["SSSMASS25"]) * 1e9}))  # µg/m³
+
+    yms = sorted({(t.year, t.month) for times, _ in parts for t in times})
+    col_of = {ym: j for j, ym in enumerate(yms)}
+    out = {c: np.full((n, len(yms)), np.nan) for c in COLUMNS[3:]}
+    for times, arrays in parts:
+        idx = [col_of[(t.year, t.month)] for t in times]
+        for name, arr in arrays.items():
+            out[name][:, idx] = arr
+    return yms, out
+
+
+def iter_bulk_rows(sites, year_from=HISTORY_YEAR_FROM, year_to=HISTORY_YEAR_TO):
+    """sites: [(id, lat, lon)] → 依 (月份, site) 排序的 row dict"""
+    if len(sites) > MAX_BULK_SITES:
+        raise ValueError(f"too many sites ({len(sites)} > {MAX_BULK_SITES})")
+    if not sites:
+        return
+    ids = [s[0] for s in sites]
+    lats = np.array([s[1] for s in sites], dtype=np.float64)
+    lons = np.array([s[2] for s in sites], dtype=np.float64)
+    yms, arrays = load_bulk_arrays(lats, lons, year_from, year_to)
+    for j, (y, m) in enumerate(yms):
+        ym = f"{y:04d}/{m:02d}"
+        for i, site in enumerate(ids):
+            row = {"site": str(site), "year/month": ym, "lat": float(lats[i]), "lon": float(lons[i])}
+            for c in COLUMNS[3:]:
+                row[c] = float(arrays[c][i, j])
+            yield row
+
+
+def encode_bulk(sites, fmt="csv", year_from=HISTORY_YEAR_FROM, year_to=HISTORY_YEAR_TO):
+    """單一合併檔的 bytes chunks（API 用）"""
+    rows = iter_bulk_rows(sites, year_from, year_to)
+    return encode_rows(rows, fmt, columns=BULK_COLUMNS, batch_rows=max(12, min(12 * len(sites), 65536)))
+
+
+def write_partitioned(sites, out_dir, fmt="parquet", year_from=HISTORY_YEAR_FROM, year_to=HISTORY_YEAR_TO):
+    """依年份分區寫檔 → 寫出的檔案路徑 list"""
+    written = []
+    rows = iter_bulk_rows(sites, year_from, year_to)
+    for year, year_rows in groupby(rows, key=lambda r: r["year/month"][:4]):
+        part_dir = os.path.join(out_dir, f"year={year}")
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, f"part-0.{EXT[fmt]}")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            for chunk in encode_rows(year_rows, fmt, columns=BULK_COLUMNS,
+                                     batch_rows=max(12, min(12 * len(sites), 65536))):
+                f.write(chunk)
+        os.replace(tmp, path)
+        written.append(path)
+        print(f"  📦 {path}")
+    return written
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Bulk monthly history export for many sites")
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--sites", help="CSV with lat,lon[,id] columns")
+    src.add_argument("--bbox", help="lat_min,lon_min,lat_max,lon_max (every MERRA-2 cell inside)")
+    p.add_argument("--out", default="./result/bulk")
+    p.add_argument("--format", choices=list(EXT), default="parquet")
+    p.add_argument("--year-from", type=int, default=HISTORY_YEAR_FROM)
+    p.add_argument("--year-to", type=int, default=HISTORY_YEAR_TO)
+    args = p.parse_args()
+
+    if args.sites:
+        sites = read_sites_csv(args.sites)
+    else:
+        sites = sites_in_bbox(tuple(float(x) for x in args.bbox.split(",")))
+    print(f"▶️  {len(sites)} sites, {args.year_from}–{args.year_to} → {args.out}")
+    files = write_partitioned(sites, args.out, args.format, args.year_from, args.year_to)
+    print(f"✅ {len(files)} partitions written")
+
+
+if __name__ == "__main__":
+    main_cli()
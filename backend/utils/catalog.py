@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+Granule catalog (SQLite).
+
+每個資料檔一列：product、stream（MERRA2_400/401、IMERG V07B）、日期、網格、變數、大小、checksum。
+loader 用有 index 的查詢找檔案，不再 os.listdir + re.search 檔名 + 試 MERRA2_400/401 檔名。
+
+    ./data/catalog.sqlite
+    path 存相對於 data root 的路徑（backend/ 或 backend/utils/ 底下執行都能用）
+
+誰寫入：
+    - utils/downloader.py 下載完成（含 manifest 的 checksum）、utils/ingest.py 裁切後 → register()
+    - refresh()：掃一遍資料夾，只重讀 (size, mtime) 有變的檔案；main.py 啟動時跑一次
+    - catalog 檔不存在時，第一次查詢會自動 refresh
+查詢預設讀 utils/snapshots.data_root()：request 裡是它 pin 住的 snapshot 的 catalog 複本，否則 ./data。
+
+    python -m utils.catalog refresh [--checksum]
+    python -m utils.catalog missing --product temperature --year-from 2020 --year-to 2025
+    python -m utils.catalog stats
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import calendar
+import threading
+from datetime import datetime
+
+from utils.snapshots import data_root as serving_root
+
+DATA_ROOT = "./data/"
+CATALOG_NAME = "catalog.sqlite"
+
+# product -> (資料夾, 週期, 副檔名)
+DATASETS = {
+    "precipitation": ("precipitation", "monthly", (".hdf5", ".h5", ".nc4", ".nc")),   # IMERG monthly
+    "temperature": ("temperature", "monthly", (".nc4", ".nc")),                        # MERRA-2 SLV monthly
+    "air_quality": ("air_quality", "monthly", (".nc4", ".nc")),                        # MERRA-2 AER monthly
+    "rain_daily": ("rain_daily", "daily", (".nc4",)),                                  # IMERG daily
+    "temp_daily": ("temp_daily", "daily", (".nc4",)),                                  # MERRA-2 SLV daily
+    "aer_daily": ("aer_daily", "daily", (".nc4",)),                                    # MERRA-2 AER daily
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS granules (
+    path       TEXT PRIMARY KEY,      -- relative to the data root
+    product    TEXT NOT NULL,
+    cadence    TEXT NOT NULL,         -- monthly | daily
+    stream     TEXT,                  -- MERRA-2 400/401, IMERG V07B ...
+    year       INTEGER NOT NULL,
+    month      INTEGER NOT NULL,
+    day        INTEGER,
+    grid       TEXT,                  -- nlat x nlon @ lat0,lon0 / dlat,dlon
+    variables  TEXT,                  -- JSON list
+    size       INTEGER,
+    mtime_ns   INTEGER,
+    checksum   TEXT,
+    indexed_at REAL
+);
+CREATE INDEX IF NOT EXISTS granules_by_time ON granules (product, year, month, day);
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+# ==============================
+# Connection
+# ==============================
+def catalog_path(data_root=DATA_ROOT):
+    return os.path.join(data_root, CATALOG_NAME)
+
+
+def _open(data_root):
+    """每個 thread / process 各自一條連線 → (conn, 這次才建立 catalog 檔)"""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = os.path.abspath(data_root)
+    if key in conns:
+        return conns[key], False
+    for gone in [k for k in conns if not os.path.isdir(k)]:   # gc 掉的 snapshot
+        conns.pop(gone).close()
+    path = catalog_path(data_root)
+    created = not os.path.exists(path)
+    os.makedirs(data_root, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    conns[key] = conn
+    return conn, created
+
+
+def _connect(data_root=None):
+    """查詢用（data_root 預設是 serving_root()）：catalog 檔還不存在時先完整掃一次"""
+    data_root = data_root or serving_root()
+    conn, created = _open(data_root)
+    if created:
+        refresh(data_root)
+    return conn
+
+
+# ==============================
+# Indexing
+# ==============================
+_YYYYMM = re.compile(r"(19|20)\d{4,6}")
+_YYYYMMDD = re.compile(r"(19|20)\d{6,8}")
+
+
+def _granule_date(product, rel_path):
+    """(year, month, day)：月資料看 <year>/<month> 資料夾（平放的看檔名），日資料看檔名"""
+    cadence = DATASETS[product][1]
+    parts = rel_path.replace(os.sep, "/").split("/")
+    name = parts[-1]
+    if cadence == "monthly":
+        if len(parts) >= 4 and re.fullmatch(r"\d{4}", parts[1]) and re.fullmatch(r"\d{2}", parts[2]):
+            return int(parts[1]), int(parts[2]), None
+        m = _YYYYMM.search(name)
+        if m:
+            try:
+                d = datetime.strptime(m.group()[:6], "%Y%m")
+                return d.year, d.month, None
+            except ValueError:
+                return None
+        return None
+    m = _YYYYMMDD.search(name)
+    if not m:
+        return None
+    try:
+        d = datetime.strptime(m.group()[:8], "%Y%m%d")
+    except ValueError:
+        return None
+    return d.year, d.month, d.day
+
+
+def _stream(name):
+    m = re.search(r"MERRA2_(\d{3})", name) or re.search(r"\.(V\d+\w?)\.", name)
+    return m.group(1) if m else ""
+
+
+def _describe(path):
+    """(grid, variables)：只讀 metadata 和座標頭尾"""
+    import netCDF4 as nc   # 只有新檔案才需要；server 開機時多半只有 stat
+    try:
+        ds = nc.Dataset(path)
+    except OSError:
+        return None, None
+    try:
+        g = ds.groups["Grid"] if "Grid" in ds.groups else ds
+        names = sorted(g.variables)
+        grid = None
+        if "lat" in g.variables and "lon" in g.variables:
+            lat, lon = g.variables["lat"], g.variables["lon"]
+            nlat, nlon = len(lat), len(lon)
+            dlat = float(lat[1] - lat[0]) if nlat > 1 else 0.0
+            dlon = float(lon[1] - lon[0]) if nlon > 1 else 0.0
+            grid = f"{nlat}x{nlon}@{float(lat[0]):.4f},{float(lon[0]):.4f}/{dlat:.4f},{dlon:.4f}"
+        return grid, json.dumps(names)
+    finally:
+        ds.close()
+
+
+def _file_md5(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(1 << 20), b""):
+            h.update(b)
+    return h.hexdigest()
+
+
+def _product_of(rel_path):
+    top = rel_path.replace(os.sep, "/").split("/")[0]
+    for product, (subdir, _, exts) in DATASETS.items():
+        if top == subdir and rel_path.lower().endswith(exts):
+            return product
+    return None
+
+
+def _upsert(conn, data_root, rel_path, product, st, checksum=None):
+    when = _granule_date(product, rel_path)
+    if when is None:
+        return False
+    grid, variables = _describe(os.path.join(data_root, rel_path))
+    conn.execute(
+        "INSERT INTO granules (path, product, cadence, stream, year, month, day, grid, variables, "
+        "size, mtime_ns, checksum, indexed_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?) "
+        "ON CONFLICT(path) DO UPDATE SET product=excluded.product, cadence=excluded.cadence, "
+        "stream=excluded.stream, year=excluded.year, month=excluded.month, day=excluded.day, "
+        "grid=excluded.grid, variables=excluded.variables, size=excluded.size, "
+        "mtime_ns=excluded.mtime_ns, checksum=excluded.checksum, indexed_at=excluded.indexed_at",
+        (rel_path, product, DATASETS[product][1], _stream(os.path.basename(rel_path)), *when,
+         grid, variables, st.st_size, st.st_mtime_ns, checksum, time.time()))
+    return True
+
+
+def refresh(data_root=DATA_ROOT, checksums=False, products=None):
+    """
+    掃一遍 dataset 資料夾（products 預設全部）：新檔 / (size, mtime) 變了的重新建檔，消失的刪掉。
+    沒變的檔案只有一次 stat。回傳 {"added": n, "updated": n, "removed": n, "total": n}。
+    """
+    conn, created = _open(data_root)
+    products = list(DATASETS if created or not products else products)   # 新建的 catalog 一定完整掃
+    marks = ",".join("?" * len(products))
+    known = {p: (size, mtime, ck) for p, size, mtime, ck in conn.execute(
+        f"SELECT path, size, mtime_ns, checksum FROM granules WHERE product IN ({marks})", products)}
+    seen = set()
+    added = updated = 0
+    with _lock, conn:
+        for product in products:
+            subdir, _, exts = DATASETS[product]
+            root = os.path.join(data_root, subdir)
+            for dirpath, _, files in os.walk(root):
+                for fname in sorted(files):
+                    if not fname.lower().endswith(exts):
+                        continue
+                    full = os.path.join(dirpath, fname)
+                    rel = os.path.relpath(full, data_root)
+                    seen.add(rel)
+                    st = os.stat(full)
+                    old = known.get(rel)
+                    if old and old[0] == st.st_size and old[1] == st.st_mtime_ns and (old[2] or not checksums):
+                        continue
+                    checksum = _file_md5(full) if checksums else (old[2] if old and old[0] == st.st_size else None)
+                    if _upsert(conn, data_root, rel, product, st, checksum):
+                        if old:
+                            updated += 1
+                        else:
+                            added += 1
+        gone = [p for p in known if p not in seen]
+        conn.executemany("DELETE FROM granules WHERE path = ?", [(p,) for p in gone])
+    total = conn.execute("SELECT COUNT(*) FROM granules").fetchone()[0]
+    return {"added": added, "updated": updated, "removed": len(gone), "total": total}
+
+
+def register(path, checksum=None, data_root=None):
+    """
+    下載 / ingest 完成的單一檔案寫進 catalog。data_root 沒給時，
+    從路徑往上找 dataset 資料夾（<data_root>/<product dir>/...）。
+    """
+    full = os.path.abspath(path)
+    if data_root is None:
+        probe = os.path.dirname(full)
+        while probe != os.path.dirname(probe):
+            if os.path.basename(probe) in {d for d, _, _ in DATASETS.values()}:
+                data_root = os.path.dirname(probe)
+                break
+            probe = os.path.dirname(probe)
+        if data_root is None:
+            return False
+    rel = os.path.relpath(full, os.path.abspath(data_root))
+    product = _product_of(rel)
+    if product is None:
+        return False
+    conn, _ = _open(data_root)
+    with _lock, conn:
+        return _upsert(conn, data_root, rel, product, os.stat(full), checksum)
+
+
+# ==============================
+# Queries
+# ==============================
+def monthly_files(product, year_from=0, year_to=9999, data_root=None):
+    """[(datetime(year, month, 1), path)]，每個月一個檔（同月有多個 stream 時取路徑排序第一個）"""
+    data_root = data_root or serving_root()
+    rows = _connect(data_root).execute(
+        "SELECT year, month, path FROM granules WHERE product = ? AND year BETWEEN ? AND ? "
+        "ORDER BY year, month, path", (product, year_from, year_to))
+    out, last = [], None
+    for y, m, rel in rows:
+        if (y, m) == last:
+            continue
+        last = (y, m)
+        out.append((datetime(y, m, 1), os.path.join(data_root, rel)))
+    return out
+
+
+def month_file(product, year, month, data_root=None):
+    data_root = data_root or serving_root()
+    row = _connect(data_root).execute(
+        "SELECT path FROM granules WHERE product = ? AND year = ? AND month = ? ORDER BY path LIMIT 1",
+        (product, year, month)).fetchone()
+    return os.path.join(data_root, row[0]) if row else None
+
+
+def daily_files(product, year_from=0, year_to=9999, data_root=None):
+    """[(datetime(y, m, d), path)]，依日期排序（同一天多個檔就都回傳）"""
+    data_root = data_root or serving_root()
+    rows = _connect(data_root).execute(
+        "SELECT year, month, day, path FROM granules WHERE product = ? AND year BETWEEN ? AND ? "
+        "ORDER BY year, month, day, path", (product, year_from, year_to))
+    return [(datetime(y, m, d), os.path.join(data_root, rel)) for y, m, d, rel in rows]
+
+
+def grids(product, data_root=None):
+    """該 product 的檔案用到的網格（_describe 的字串）；通常只有一種，裁切前後的檔案混用時會有多種"""
+    return [g for (g,) in _connect(data_root).execute(
+        "SELECT DISTINCT grid FROM granules WHERE product = ? AND grid IS NOT NULL ORDER BY grid", (product,))]
+
+
+def fingerprint(products=None, data_root=None):
+    """granule 集合的指紋：任何一個檔案新增、刪除、改寫（size / mtime 變了）都會變"""
+    products = list(products or DATASETS)
+    marks = ",".join("?" * len(products))
+    rows = _connect(data_root).execute(
+        f"SELECT product, COUNT(*), SUM(size), SUM(mtime_ns % 1000000007), MAX(mtime_ns) FROM granules "
+        f"WHERE product IN ({marks}) GROUP BY product ORDER BY product", products).fetchall()
+    return hashlib.sha1(repr(rows).encode()).hexdigest()[:12]
+
+
+def missing(product, year_from=None, year_to=None, data_root=None, until=None):
+    """
+    範圍內沒有檔案的月份（"YYYY-MM"）或日期（"YYYY-MM-DD"）。
+    範圍預設是 catalog 裡該 product 的第一年到最後一年；until=(year, month) 時不列出之後的月份
+    （還沒結束的月份本來就不會有檔案，不算缺）。
+    """
+    conn = _connect(data_root)
+    lo, hi = conn.execute("SELECT MIN(year), MAX(year) FROM granules WHERE product = ?", (product,)).fetchone()
+    year_from = year_from if year_from is not None else lo
+    year_to = year_to if year_to is not None else hi
+    if year_from is None or year_to is None:
+        return []
+    have = {tuple(r) for r in conn.execute(
+        "SELECT year, month, COALESCE(day, 0) FROM granules WHERE product = ? AND year BETWEEN ? AND ?",
+        (product, year_from, year_to))}
+    out = []
+    daily = DATASETS[product][1] == "daily"
+    for y in range(year_from, year_to + 1):
+        for m in range(1, 13):
+            if until is not None and (y, m) > tuple(until):
+                break
+            if not daily:
+                if (y, m, 0) not in have:
+                    out.append(f"{y:04d}-{m:02d}")
+                continue
+            for d in range(1, calendar.monthrange(y, m)[1] + 1):
+                if (y, m, d) not in have:
+                    out.append(f"{y:04d}-{m:02d}-{d:02d}")
+    return out
+
+
+def stats(data_root=None):
+    """每個 product 的檔案數、時間範圍、總大小"""
+    out = {}
+    for product, n, y0, m0, y1, m1, size in _connect(data_root).execute(
+            "SELECT product, COUNT(*), MIN(year * 100 + month) / 100, MIN(year * 100 + month) % 100, "
+            "MAX(year * 100 + month) / 100, MAX(year * 100 + month) % 100, SUM(size) "
+            "FROM granules GROUP BY product"):
+        out[product] = {"granules": n, "first": f"{y0:04d}-{m0:02d}", "last": f"{y1:04d}-{m1:02d}",
+                        "bytes": size}
+    return out
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Granule catalog")
+    sub = p.add_subparsers(dest="cmd")
+    r = sub.add_parser("refresh", help="index new / changed files, drop removed ones")
+    r.add_argument("--checksum", action="store_true", help="also compute md5 of every file")
+    m = sub.add_parser("missing", help="list months (or days) without a granule")
+    m.add_argument("--product", choices=list(DATASETS), required=True)
+    m.add_argument("--year-from", type=int)
+    m.add_argument("--year-to", type=int)
+    sub.add_parser("stats", help="granule counts per product")
+    args = p.parse_args()
+
+    if args.cmd == "refresh":
+        print(f"✅ {refresh(checksums=args.checksum)}")
+    elif args.cmd == "missing":
+        gaps = missing(args.product, args.year_from, args.year_to)
+        print(f"{args.product}: {len(gaps)} missing")
+        for g in gaps:
+            print(f"  {g}")
+    elif args.cmd == "stats":
+        print(json.dumps(stats(), indent=2))
+    else:
+        p.print_help()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Deployment settings，全部可用環境變數覆寫（和 main.py 的 ALLOW_ORIGINS 一樣）。
+"""
+import os
+from datetime import date
+
+
+def _int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def _float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+# ---- day/daily.py monthly_baseline ----
+BASELINE_CACHE_SIZE = _int("BASELINE_CACHE_SIZE", 512)        # 最多幾個 (cell, year, month)
+BASELINE_CACHE_TTL = _float("BASELINE_CACHE_TTL", 6 * 3600)   # 秒；<= 0 表示不過期
+
+# ---- data version（偵測 ./data 檔案變動）----
+DATA_VERSION_CHECK_SECONDS = _float("DATA_VERSION_CHECK_SECONDS", 5)
+
+# ---- utils/models.py 已載入的 artifact 數量上限 ----
+MODEL_CACHE_SIZE = _int("MODEL_CACHE_SIZE", 256)
+
+# ---- utils/forecasting.py：rf（RandomForest）或 harmonic（趨勢 + 季節 harmonic 的最小平方法）----
+FORECAST_BACKEND = os.getenv("FORECAST_BACKEND", "rf")
+FORECAST_HARMONICS = _int("FORECAST_HARMONICS", 2)
+
+# ---- utils/train_models.py 預設訓練範圍："name:lat_min,lon_min,lat_max,lon_max;..." ----
+MODEL_REGIONS = os.getenv("MODEL_REGIONS", "taiwan:21.5,119.5,25.5,122.5")
+
+# ---- /api/weather/grid 一次最多幾個點 ----
+MAX_GRID_POINTS = _int("MAX_GRID_POINTS", 20000)
+
+# ---- POST /api/weather/batch 一次最多幾個 item ----
+MAX_BATCH_ITEMS = _int("MAX_BATCH_ITEMS", 500)
+
+# ---- utils/workers.py：CPU-bound 工作（forecast / plot）跑在 process pool ----
+WORKER_PROCESSES = _int("WORKER_PROCESSES", os.cpu_count() or 2)
+WORKER_START_METHOD = os.getenv("WORKER_START_METHOD", "spawn")   # HDF5 不是 fork-safe
+RETRY_AFTER_SECONDS = _int("RETRY_AFTER_SECONDS", 5)
+
+# 每個 endpoint：(同時執行數, 最多排隊數)；滿了直接回 503 + Retry-After
+LANE_LIMITS = {
+    "weather": (_int("WEATHER_CONCURRENCY", 4), _int("WEATHER_QUEUE", 32)),
+    "weather_month": (_int("WEATHER_MONTH_CONCURRENCY", 2), _int("WEATHER_MONTH_QUEUE", 8)),
+    "weather_batch": (_int("WEATHER_BATCH_CONCURRENCY", 1), _int("WEATHER_BATCH_QUEUE", 4)),
+    "weather_grid": (_int("WEATHER_GRID_CONCURRENCY", 1), _int("WEATHER_GRID_QUEUE", 4)),
+    "plot": (_int("PLOT_CONCURRENCY", 2), _int("PLOT_QUEUE", 8)),
+    "history": (_int("HISTORY_CONCURRENCY", 2), _int("HISTORY_QUEUE", 8)),
+    "history_bulk": (_int("HISTORY_BULK_CONCURRENCY", 1), _int("HISTORY_BULK_QUEUE", 4)),
+}
+
+# ---- utils/plot_cache.py：content-addressed 圖檔快取 ----
+PLOT_CACHE_DIR = os.getenv("PLOT_CACHE_DIR", "./result/cache")
+PLOT_CACHE_MAX_BYTES = _int("PLOT_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+PLOT_CACHE_MIN_AGE = _float("PLOT_CACHE_MIN_AGE", 60)             # 這幾秒內寫過 / 用過的圖不刪（URL 剛回給 client）
+PLOT_CACHE_RESCAN_SECONDS = _float("PLOT_CACHE_RESCAN_SECONDS", 300)   # 其他 process 寫的檔，最晚這麼久算進來
+
+# ---- utils/downloader.py ----
+DOWNLOAD_WORKERS = _int("DOWNLOAD_WORKERS", 4)
+DOWNLOAD_RETRIES = _int("DOWNLOAD_RETRIES", 5)
+DOWNLOAD_BACKOFF = _float("DOWNLOAD_BACKOFF", 1.0)   # 秒；第 n 次重試等 backoff * 2^n（含 jitter）
+
+# ---- utils/ingest.py：下載後只留這些 region（格式同 MODEL_REGIONS）----
+INGEST_REGIONS = os.getenv("INGEST_REGIONS", MODEL_REGIONS)
+INGEST_MARGIN_DEG = _float("INGEST_MARGIN_DEG", 1.0)
+INGEST_SUBSET = _int("INGEST_SUBSET", 1)   # 0 = downloader 保留完整的全球 granule
+
+# ---- utils/periods.py：時間視窗跟著目前提供服務的資料走，不寫死年份 ----
+HISTORY_MONTHS = _int("HISTORY_MONTHS", 36)              # 模型 / baseline 用最新幾個月的月資料
+FORECAST_HORIZON = _int("FORECAST_HORIZON", 8)           # 月預報幾個月
+FORECAST_START = os.getenv("FORECAST_START", "")         # "YYYY-MM"；空 = 當月
+DAILY_REFERENCE_YEAR = _int("DAILY_REFERENCE_YEAR", 0)   # 沒有 anomaly cube 時用哪一年的日檔；0 = 最新的完整年份
+
+# ---- utils/update.py --watch 的預設間隔（秒）----
+UPDATE_INTERVAL = _float("UPDATE_INTERVAL", 900)
+
+# ---- utils/snapshots.py：換掉的 snapshot 至少留多久才刪（> 最慢的 request），另外多留幾個給 rollback ----
+SNAPSHOT_DRAIN_SECONDS = _float("SNAPSHOT_DRAIN_SECONDS", 600)
+SNAPSHOT_KEEP = _int("SNAPSHOT_KEEP", 1)
+
+# ---- /api/history.*：預設年份範圍（query 的 year_from / year_to 可覆寫）----
+HISTORY_YEAR_FROM = _int("HISTORY_YEAR_FROM", 2020)
+HISTORY_YEAR_TO = _int("HISTORY_YEAR_TO", date.today().year)
+
+# ---- utils/bulk_export.py / POST /api/history/bulk：一次最多幾個點 ----
+MAX_BULK_SITES = _int("MAX_BULK_SITES", 20000)
+
+# ---- utils/log.py：LOG_LEVEL = DEBUG 時才會有逐檔 / 逐月的進度訊息；LOG_FORMAT = text | json ----
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# ---- utils/profiler.py：admin 用 X-Profile: 1 + X-Admin-Token 對單一 request 取樣；ADMIN_TOKEN 沒設 = 關閉 ----
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./result/profiles")
+PROFILE_INTERVAL_MS = _int("PROFILE_INTERVAL_MS", 5)
+PROFILE_KEEP = _int("PROFILE_KEEP", 200)
+
+# ---- main.py 開機預熱：哪些 lane 的模組先 import（"all"、逗號分隔的 lane 名稱，或空字串 = 第一個 request 才載入）----
+WARMUP = os.getenv("WARMUP", "all")
+
+# ---- utils/response_cache.py：/api/weather、/api/weather/month、/api/plot 的結果快取 ----
+RESPONSE_CACHE_SIZE = _int("RESPONSE_CACHE_SIZE", 4096)
+RESPONSE_CACHE_TTL = _float("RESPONSE_CACHE_TTL", 24 * 3600)   # 秒；data version 變了 key 本來就會換
+RESPONSE_MAX_AGE = _int("RESPONSE_MAX_AGE", 600)               # Cache-Control max-age（之後瀏覽器 / CDN 用 ETag 重新驗證）
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "")  # "" | dir:/path | redis://host:6379/0
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel daily ingest: hourly MERRA-2 granules → one reduced daily file each.
+
+M2T1NXSLV 一天一個 granule、裡面 24 個小時。這裡每個 granule：
+    1. 下載到 ./data/.scratch/daily/<name>.part（可續傳、驗證 size/checksum）
+    2. 一個小時一個小時讀（不把 24 小時整個載進記憶體），累計 mean / min / max
+    3. 寫成 (time=1, lat, lon) 的 NETCDF4（zlib）到 ./data/temp_daily/<同檔名>，刪掉原始檔
+輸出變數：
+    T2M, PS, QV2M, U10M, V10M            日平均（load_daily_2024 / batch 直接讀這幾個）
+    T2M_MIN/MAX, PS_MIN/MAX, QV2M_MIN/MAX
+    WS10M, WS10M_MIN, WS10M_MAX          逐時 10 m 風速的平均 / 最小 / 最大
+INGEST_SUBSET=1（預設）時同樣只留 INGEST_REGIONS 的外接矩形。
+
+一個 granule 是一個 process pool 的工作（下載 + 彙總都在 worker 裡）；
+進度記在 ./data/temp_daily/manifest.json（同 utils/downloader.py），完成的寫進 catalog。
+
+    python -m utils.daily_ingest --years 2024 --months 7-12 --jobs 8
+    python -m utils.daily_ingest --years 2024 --source local:/mnt/mirror
+"""
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import netCDF4 as nc
+
+from utils import catalog
+from utils.config import DOWNLOAD_WORKERS, INGEST_REGIONS, INGEST_SUBSET
+from utils.downloader import Manifest, download_verified, file_digest, is_complete, make_client, \
+    month_date_range, parse_range, with_retries
+from utils.ingest import _index_range, parse_regions, region_hull
+from utils.store import BASE_DIR
+
+SCRATCH_DIR = os.path.join(BASE_DIR, ".scratch", "daily")   # 原始 hourly 檔暫放處，彙總完就刪
+REDUCED_ATTR = "daily_reduced"   # global attribute：彙總資訊；有這個的檔案就不再處理
+
+# kind -> (short_name, version, bbox, out_root)
+SOURCES = {
+    "slv": ("M2T1NXSLV", "5.12.4", (-180, -90, 180, 90), os.path.join(BASE_DIR, "temp_daily")),   # MERRA-2 hourly SLV
+}
+MEAN_VARS = ["T2M", "PS", "QV2M", "U10M", "V10M"]
+RANGE_VARS = ["T2M", "PS", "QV2M", "WS10M"]
+
+
+# ==============================
+# Reduce
+# ==============================
+def _field(ds, name, t, rows, cols):
+    return np.ma.filled(np.ma.asarray(ds.variables[name][t, rows, cols], dtype=np.float64), np.nan)
+
+
+def reduce_hourly(src, dst, bbox=None):
+    """
+    hourly granule → 日彙總檔（tmp + os.replace）；一次只讀一個小時。
+    回傳輸出檔大小。
+    """
+    tmp = f"{dst}.{os.getpid()}.reduce"
+    with nc.Dataset(src) as ds:
+        lat = np.asarray(ds.variables["lat"][:], dtype=np.float64)
+        lon = np.asarray(ds.variables["lon"][:], dtype=np.float64)
+        rows = _index_range(lat, bbox[0], bbox[2]) if bbox else slice(None)
+        cols = _index_range(lon, bbox[1], bbox[3]) if bbox else slice(None)
+        lat, lon = lat[rows], lon[cols]
+        n_hours = len(ds.dimensions["time"])
+
+        total, count, lo, hi = {}, {}, {}, {}
+        for t in range(n_hours):
+            fields = {n: _field(ds, n, t, rows, cols) for n in MEAN_VARS}
+            fields["WS10M"] = np.hypot(fields["U10M"], fields["V10M"])
+            for name, f in fields.items():
+                ok = ~np.isnan(f)
+                if name not in total:
+                    total[name], count[name] = np.zeros_like(f), np.zeros(f.shape, dtype=np.int32)
+                    lo[name], hi[name] = f.copy(), f.copy()
+                total[name] += np.where(ok, f, 0.0)
+                count[name] += ok
+                lo[name] = np.fmin(lo[name], f)
+                hi[name] = np.fmax(hi[name], f)
+
+        out = {}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for name in MEAN_VARS + ["WS10M"]:
+                out[name] = np.where(count[name] > 0, total[name] / count[name], np.nan)
+        for name in RANGE_VARS:
+            out[f"{name}_MIN"], out[f"{name}_MAX"] = lo[name], hi[name]
+
+        units = {n: getattr(ds.variables[n], "units", "") or "" for n in MEAN_VARS}
+        units["WS10M"] = units["U10M"]
+        time_var = ds.variables["time"]
+
+        with nc.Dataset(tmp, "w", format="NETCDF4") as ds_out:
+            ds_out.setncatts({k: ds.getncattr(k) for k in ds.ncattrs()})
+            ds_out.setncattr(REDUCED_ATTR, json.dumps({"source": os.path.basename(src), "hours": n_hours,
+                                                       "bbox": list(bbox) if bbox else None}))
+            ds_out.createDimension("time", 1)
+            ds_out.createDimension("lat", len(lat))
+            ds_out.createDimension("lon", len(lon))
+            v = ds_out.createVariable("time", time_var.dtype, ("time",))
+            v.setncatts({k: time_var.getncattr(k) for k in time_var.ncattrs() if k != "_FillValue"})
+            v[:] = time_var[:1]
+            for name, coords in (("lat", lat), ("lon", lon)):
+                v = ds_out.createVariable(name, "f8", (name,))
+                v.setncatts({k: ds.variables[name].getncattr(k) for k in ds.variables[name].ncattrs()
+                             if k != "_FillValue"})
+                v[:] = coords
+            for name, data in out.items():
+                base, _, stat = name.partition("_")
+                v = ds_out.createVariable(name, "f4", ("time", "lat", "lon"), zlib=True, complevel=4,
+                                          shuffle=True, fill_value=np.float32(np.nan))
+                v.units = units[base]
+                v.cell_methods = f"time: {stat.lower() or 'mean'}"
+                v[0, :, :] = data.astype(np.float32)
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+def is_reduced(path):
+    try:
+        with nc.Dataset(path) as ds:
+            return REDUCED_ATTR in ds.ncattrs()
+    except OSError:
+        return False
+
+
+# ==============================
+# Worker
+# ==============================
+_clients = {}
+
+
+def _client(source):
+    """每個 worker process 自己登入一次"""
+    if source not in _clients:
+        _clients[source] = make_client(source)
+    return _clients[source]
+
+
+def _ingest_one(task):
+    """一個 granule：下載 → 彙總 → 刪原始檔。回傳給 parent 更新 manifest / catalog 的 dict"""
+    source, granule, out_dir, scratch, bbox = task
+    dest = os.path.join(out_dir, granule["name"])
+    raw = None
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        if not (os.path.exists(dest) and is_reduced(dest)):
+            raw = download_verified(_client(source), granule, os.path.join(scratch, granule["name"]))
+            source_size = os.path.getsize(raw)
+            reduce_hourly(raw, dest, bbox)
+        else:
+            source_size = granule.get("size")
+        return {"id": granule["id"], "status": "done", "path": dest, "size": os.path.getsize(dest),
+                "checksum": file_digest(dest, "md5"), "algorithm": "MD5", "source_size": source_size,
+                "source_checksum": granule.get("checksum"), "source_algorithm": granule.get("algorithm"),
+                "error": None}
+    except Exception as e:
+        return {"id": granule["id"], "status": "failed", "path": dest, "error": str(e)}
+    finally:
+        if raw and os.path.exists(raw):
+            os.remove(raw)
+
+
+# ==============================
+# Pipeline
+# ==============================
+def ingest_daily(kind, years, months, source="earthdata", jobs=DOWNLOAD_WORKERS, out_root=None,
+                 subset=INGEST_SUBSET):
+    """
+    kind 在 years × months 的每一天：已完成（manifest done 且大小正確）的跳過。
+    回傳 manifest 的狀態統計。
+    """
+    short_name, version, search_bbox, default_root = SOURCES[kind]
+    out_root = out_root or default_root
+    bbox = region_hull(parse_regions(INGEST_REGIONS)) if subset else None
+    manifest = Manifest(out_root)
+    client = make_client(source)
+    months_todo = [(y, m) for y in years for m in months]
+    print(f"▶️  {kind} ({short_name}): {len(months_todo)} months, {jobs} workers → {out_root}")
+
+    # 1) search（每個月一次，I/O bound → threads）
+    tasks = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        searches = {pool.submit(with_retries,
+                                lambda y=y, m=m: client.search(short_name, version, month_date_range(y, m),
+                                                               search_bbox),
+                                f"search {short_name} {y}-{m:02d}"): (y, m)
+                    for y, m in months_todo}
+        for fut in as_completed(searches):
+            y, m = searches[fut]
+            try:
+                granules = fut.result()
+            except Exception as e:
+                print(f"❌ search {y}-{m:02d}：{e}")
+                continue
+            if not granules:
+                print(f"⚠️ 無資料：{y}-{m:02d}")
+            for g in granules:
+                if not is_complete(manifest.get(g["id"])):
+                    manifest.update(g["id"], url=g["url"], size=None, status="queued")
+                    tasks.append((source, g, out_root, SCRATCH_DIR, bbox))
+
+    # 2) download + reduce（CPU + netCDF → processes）
+    print(f"⬇️  {len(tasks)} daily granules to ingest")
+    raw_bytes = out_bytes = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for i, res in enumerate(pool.map(_ingest_one, tasks), 1):
+            gid = res.pop("id")
+            manifest.update(gid, **res)
+            if res["status"] != "done":
+                print(f"  [{i}/{len(tasks)}] ❌ {res['path']}：{res['error']}")
+                continue
+            catalog.register(res["path"], checksum=res["checksum"])
+            raw_bytes += res["source_size"] or 0
+            out_bytes += res["size"]
+            print(f"  [{i}/{len(tasks)}] ✅ {res['path']}")
+
+    if out_bytes:
+        print(f"📉 {raw_bytes / 1e6:.1f} MB hourly → {out_bytes / 1e6:.2f} MB daily "
+              f"({raw_bytes / out_bytes:.0f}x)")
+    summary = manifest.summary()
+    print(f"✅ {kind} 完成：{summary}")
+    return summary
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Parallel, resumable hourly → daily ingest")
+    p.add_argument("--kind", choices=list(SOURCES), default="slv")
+    p.add_argument("--years", required=True, help="e.g. 2024 or 2020-2024")
+    p.add_argument("--months", default="1-12", help="e.g. 7-12")
+    p.add_argument("--jobs", type=int, default=DOWNLOAD_WORKERS)
+    p.add_argument("--source", default="earthdata", help="earthdata | local:<dir>")
+    p.add_argument("--global", dest="whole", action="store_true", help="keep the whole grid")
+    args = p.parse_args()
+    ingest_daily(args.kind, parse_range(args.years), parse_range(args.months), source=args.source,
+                 jobs=args.jobs, subset=INGEST_SUBSET and not args.whole)
+
+
+if __name__ == "__main__":
+    main_cli()
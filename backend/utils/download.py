@@ -10,6 +10,9 @@ from typing import Tuple, Optional, List, Iterable
 import earthaccess
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.downloader import EarthdataClient, download
+
 # === Dataset roots ===
 OUT_ROOT       = "./data/precipitation"   # IMERG monthly
 TEMP_OUT_ROOT  = "./data/temperature"     # MERRA2 SLV
@@ -99,25 +102,13 @@ def download_month_across_years(kind: str, month: int):
     if not (1 <= month <= 12):
         raise ValueError("month 必須是 1..12")
 
-    load_dotenv()
-    print("🔐 Earthdata login")
-    earthaccess.login(strategy="environment")
-
     years = list(range(2020, 2025))
 
-    short_name, version, bbox, out_root = dataset_profile(kind)
+    _, _, _, out_root = dataset_profile(kind)
 
     print(f"▶️  任務：{kind}，月份 {month:02d}，年份 {years[0]}–{years[-1]}")
-    for y in years:
-        download_one_month(
-            year=y, month=month,
-            short_name=short_name,
-            version=version,
-            bbox=bbox,
-            out_root=out_root
-        )
-        time.sleep(SLEEP_BETWEEN_CALLS)
-    print("✅ 下載完成")
+    # 並行 + manifest + 續傳，見 utils/downloader.py（EarthdataClient 會負責登入）
+    return download(kind, years, [month], client=EarthdataClient(), out_root=out_root)
 
 # -------- 安全刪除（指定月份 × 多個年份） --------
 def _safe_rmtree(target_dir: str, allowed_roots: Iterable[str], dry_run: bool = False) -> None:
@@ -9,6 +9,9 @@ import numpy as np
 import earthaccess
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.downloader import EarthdataClient, download
+
 # precipitation
 SHORT_NAME = "GPM_3IMERGM"   # IMERG Monthly Final Run V07
 VERSION    = "07"
@@ -73,67 +76,40 @@ def download_one_month(year: int, month: int,
         print(f"fail: {e}")
         return None
 
-def precipitation():
-    load_dotenv()
-
-    print("🔐 Earthdata loggin")
-    earthaccess.login(strategy="environment")
+def backfill(kind: str, years: List[int], out_root: str) -> None:
+    """並行、可續傳的下載（utils/downloader.py）；資料只到 2025/05"""
+    client = EarthdataClient()
+    full_years = [y for y in years if y < 2025]
+    if full_years:
+        download(kind, full_years, list(range(1, 13)), client=client, out_root=out_root)
+    if 2025 in years:
+        download(kind, [2025], list(range(1, 6)), client=client, out_root=out_root)
 
+def precipitation():
     years = list(range(2020, 2026))
-    months = list(range(1, 13))
 
     if len(sys.argv) == 3:
         y0, y1 = int(sys.argv[1]), int(sys.argv[2])
         years = list(range(y0, y1 + 1))
 
-
-    for y in years:
-        for m in months:
-            if y == 2025 and m > 5:
-                break
-            download_one_month(y, m)
-            time.sleep(SLEEP_BETWEEN_CALLS)
-
+    backfill("precipitation", years, OUT_ROOT)
     print("finished")
 
 # temperature
 def temperature(dataset: str = "merra2_t2m"):
-    load_dotenv()
-    print("🔐 Earthdata login")
-    earthaccess.login(strategy="environment")
-
     years = list(range(2020, 2026))
-    months = list(range(1, 13))
     if len(sys.argv) == 4:
         y0, y1 = int(sys.argv[2]), int(sys.argv[3])
         years = list(range(y0, y1 + 1))
 
     if dataset == "merra2_t2m":
-        short_name = "M2TMNXSLV"
-        version = "5.12.4"
-        out_root = TEMP_OUT_ROOT
-        bbox = (-180, -90, 180, 90) 
+        kind, out_root = "temperature", TEMP_OUT_ROOT
     elif dataset == "merra2_aer":
-        short_name = "M2TMNXAER"
-        version = "5.12.4"
-        out_root = AIR_OUT_ROOT
-        bbox = (-180, -90, 180, 90)
+        kind, out_root = "air_quality", AIR_OUT_ROOT
     else:
         raise ValueError("fail")
 
-    for y in years:
-        for m in months:
-            if y == 2025 and m > 5:
-                break
-            download_one_month(
-                year=y, month=m,
-                short_name=short_name,
-                version=version,
-                bbox=bbox,
-                out_root=out_root
-            )
-            time.sleep(SLEEP_BETWEEN_CALLS)
-
+    backfill(kind, years, out_root)
     print("temperature download finished")
     
 if __name__ == "__main__":
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, resumable bulk downloader for the monthly datasets.
+
+    python -m utils.downloader --kind temperature --years 2020-2025 --jobs 8
+    python -m utils.downloader --kind precipitation --years 2024 --months 6-12
+    python -m utils.downloader --source local:/mnt/mirror ...   # 本地替身，不連 Earthdata
+
+流程：
+    1. 每個 (year, month) 做一次 search（也在 worker pool 裡跑，有 retry）
+    2. 每個 granule 記進 <out_root>/manifest.json：id / url / size / checksum / status
+    3. 下載寫到 <file>.part；中斷後用 HTTP Range 從 .part 的大小接著下載
+    4. 大小、checksum 對得上才 os.replace 成正式檔名 → loader 永遠看不到半個檔案
+    5. 失敗用 exponential backoff 重試；最後仍失敗的在 manifest 標 failed，下次再跑會重試
+    6. INGEST_SUBSET=1（預設）時交給 utils/ingest.py 裁切成 region + 需要的變數
+    7. 完成的檔案寫進 utils/catalog.py（loader 從 catalog 找檔案）
+
+client 介面（EarthdataClient / LocalClient）：
+    search(short_name, version, temporal, bbox) -> [granule dict]
+    open_range(url, start) -> (iterator of bytes chunks, total_size or None)
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import calendar
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils import catalog
+from utils.config import DOWNLOAD_WORKERS, DOWNLOAD_RETRIES, DOWNLOAD_BACKOFF, INGEST_SUBSET
+
+CHUNK = 1 << 20
+MANIFEST_NAME = "manifest.json"
+
+# kind -> (short_name, version, bbox, out_root)
+DATASETS = {
+    "precipitation": ("GPM_3IMERGM", "07", (-180, -90, 180, 90), "./data/precipitation"),   # IMERG monthly
+    "temperature": ("M2TMNXSLV", "5.12.4", (-180, -90, 180, 90), "./data/temperature"),     # MERRA-2 SLV
+    "air_quality": ("M2TMNXAER", "5.12.4", (-180, -90, 180, 90), "./data/air_quality"),     # MERRA-2 AER
+}
+
+
+def month_date_range(year, month):
+    last_day = calendar.monthrange(year, month)[1]
+    return (f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-{last_day:02d}")
+
+
+# ==============================
+# Clients
+# ==============================
+class EarthdataClient:
+    """earthaccess 的 search + 已登入的 https session（支援 Range）"""
+
+    def __init__(self):
+        import earthaccess
+        from dotenv import load_dotenv
+        load_dotenv()
+        print("🔐 Earthdata login")
+        earthaccess.login(strategy="environment")
+        self._ea = earthaccess
+        self._local = threading.local()
+
+    def _session(self):
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = self._ea.get_requests_https_session()
+        return s
+
+    def search(self, short_name, version, temporal, bbox):
+        results = self._ea.search_data(short_name=short_name, version=version,
+                                       temporal=temporal, bounding_box=bbox)
+        return [_granule_from_umm(g) for g in results]
+
+    def open_range(self, url, start):
+        headers = {"Range": f"bytes={start}-"} if start else {}
+        r = self._session().get(url, headers=headers, stream=True, timeout=60)
+        r.raise_for_status()
+        if start and r.status_code != 206:
+            raise IOError(f"server ignored Range for {url}")
+        total = None
+        if "Content-Range" in r.headers:
+            total = int(r.headers["Content-Range"].rsplit("/", 1)[-1])
+        elif "Content-Length" in r.headers:
+            total = int(r.headers["Content-Length"])
+        return r.iter_content(CHUNK), total
+
+
+def _granule_from_umm(g):
+    umm = g.get("umm", {})
+    info = (umm.get("DataGranule", {}).get("ArchiveAndDistributionInformation") or [{}])[0]
+    checksum = info.get("Checksum") or {}
+    url = g.data_links(access="external")[0]
+    return {
+        "id": g.get("meta", {}).get("concept-id") or umm.get("GranuleUR") or url,
+        "url": url,
+        "name": os.path.basename(url),
+        "size": info.get("SizeInBytes"),
+        "checksum": checksum.get("Value"),
+        "algorithm": checksum.get("Algorithm"),
+    }
+
+
+class LocalClient:
+    """
+    本地替身：<root>/<short_name>/<YYYY>/<MM>/<files>
+    search 回傳該月的檔案（size + md5），open_range 直接讀檔；用來離線測試 resume / retry。
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def search(self, short_name, version, temporal, bbox):
+        year, month = temporal[0][:4], temporal[0][5:7]
+        month_dir = os.path.join(self.root, short_name, year, month)
+        if not os.path.isdir(month_dir):
+            return []
+        out = []
+        for name in sorted(os.listdir(month_dir)):
+            path = os.path.join(month_dir, name)
+            out.append({"id": f"{short_name}/{year}/{month}/{name}", "url": path, "name": name,
+                        "size": os.path.getsize(path), "checksum": file_digest(path, "MD5"),
+                        "algorithm": "MD5"})
+        return out
+
+    def open_range(self, url, start):
+        total = os.path.getsize(url)
+
+        def chunks():
+            with open(url, "rb") as f:
+                f.seek(start)
+                while True:
+                    b = f.read(CHUNK)
+                    if not b:
+                        return
+                    yield b
+        return chunks(), total
+
+
+def make_client(source):
+    if source in (None, "", "earthdata"):
+        return EarthdataClient()
+    if source.startswith("local:"):
+        return LocalClient(source[len("local:"):])
+    raise ValueError(f"unknown source: {source}")
+
+
+# ==============================
+# Manifest
+# ==============================
+class Manifest:
+    """<out_root>/manifest.json：granule id -> job；每次狀態改變就原子寫回"""
+
+    def __init__(self, out_root):
+        self.path = os.path.join(out_root, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.jobs = json.load(f).get("granules", {})
+
+    def get(self, gid):
+        with self.lock:
+            return dict(self.jobs.get(gid, {}))
+
+    def update(self, gid, **fields):
+        with self.lock:
+            self.jobs.setdefault(gid, {}).update(fields)
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"granules": self.jobs}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def summary(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.get("status")] = counts.get(job.get("status"), 0) + 1
+            return counts
+
+
+def file_digest(path, algorithm="MD5"):
+    h = hashlib.new((algorithm or "md5").replace("-", "").lower())
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(CHUNK), b""):
+            h.update(b)
+    return h.hexdigest()
+
+
+def is_complete(job):
+    """manifest 說 done 而且檔案大小對得上（被手動刪掉或截斷的會重新下載）"""
+    path = job.get("path")
+    if job.get("status") != "done" or not path or not os.path.exists(path):
+        return False
+    return job.get("size") is None or os.path.getsize(path) == job["size"]
+
+
+# ==============================
+# Download
+# ==============================
+def with_retries(fn, what, retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF):
+    """exponential backoff + jitter：backoff * 2^attempt"""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            print(f"⚠️ {what} 失敗（{e}），{delay:.1f}s 後重試 [{attempt + 1}/{retries}]")
+            time.sleep(delay)
+
+
+def download_verified(client, granule, dest):
+    """
+    下載 granule 到 dest（可從 dest.part 續傳、失敗依 with_retries 重試），size / checksum 驗證過才
+    rename 成 dest；回傳 dest。granule 沒給 size 時會補上 server 回報的大小。
+    utils/daily_ingest.py 下載原始 hourly 檔也用這個。
+    """
+    part = dest + ".part"
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+
+    def verified(path):
+        if granule.get("size") is not None and os.path.getsize(path) != granule["size"]:
+            return False
+        return not granule.get("checksum") or \
+            file_digest(path, granule.get("algorithm")).lower() == granule["checksum"].lower()
+
+    def attempt():
+        # 舊腳本下載過、manifest 沒有記錄的檔案：驗證通過就直接收編
+        if os.path.exists(dest) and not os.path.exists(part):
+            if verified(dest):
+                return dest
+            os.remove(dest)
+        start = os.path.getsize(part) if os.path.exists(part) else 0
+        if granule.get("size") is not None and start > granule["size"]:
+            os.remove(part)
+            start = 0
+        if granule.get("size") is None or start < granule["size"]:
+            chunks, total = client.open_range(granule["url"], start)
+            with open(part, "ab" if start else "wb") as f:
+                for b in chunks:
+                    f.write(b)
+            if granule.get("size") is None and total is not None:
+                granule["size"] = total
+
+        if not verified(part):
+            size = os.path.getsize(part)
+            if granule.get("size") is None or size >= granule["size"]:
+                os.remove(part)   # 內容壞了，續傳沒意義
+            raise IOError(f"incomplete or corrupt download ({size} bytes)")
+        os.replace(part, dest)
+        return dest
+
+    return with_retries(attempt, granule["name"])
+
+
+def fetch_granule(client, granule, out_dir, manifest, post=None):
+    """下載一個 granule（download_verified），再跑 post(path)（ingest）；回傳最終路徑"""
+    gid = granule["id"]
+    dest = os.path.join(out_dir, granule["name"])
+    os.makedirs(out_dir, exist_ok=True)
+    manifest.update(gid, url=granule["url"], path=dest, size=granule.get("size"),
+                    source_checksum=granule.get("checksum"), source_algorithm=granule.get("algorithm"),
+                    status="downloading")
+
+    try:
+        path = download_verified(client, granule, dest)
+        source_size = os.path.getsize(path)
+        if post is not None:
+            post(path)
+    except Exception as e:
+        manifest.update(gid, status="failed", error=str(e))
+        print(f"❌ {granule['name']}：{e}")
+        return None
+    # manifest 和 catalog 記的都是硬碟上那個檔（裁切後）的 size / md5，上游的另外放在 source_*；
+    # 沒裁切過而且上游給的就是 md5 時直接沿用
+    same = post is None and (granule.get("algorithm") or "md5").replace("-", "").lower() == "md5"
+    checksum = granule["checksum"] if same and granule.get("checksum") else file_digest(path, "md5")
+    manifest.update(gid, status="done", size=os.path.getsize(path), checksum=checksum, algorithm="MD5",
+                    source_size=source_size, error=None)
+    catalog.register(path, checksum=checksum)
+    return path
+
+
+def search_month(client, kind, year, month):
+    short_name, version, bbox, _ = DATASETS[kind]
+    return with_retries(lambda: client.search(short_name, version, month_date_range(year, month), bbox),
+                        f"search {kind} {year}-{month:02d}")
+
+
+def download(kind, years, months, client=None, jobs=DOWNLOAD_WORKERS, out_root=None, subset=INGEST_SUBSET):
+    """
+    下載 kind 在 years × months 的所有 granule；已完成（manifest done 且大小正確）的跳過。
+    回傳 manifest 的狀態統計，例如 {"done": 70, "failed": 2}。
+    """
+    client = client or EarthdataClient()
+    post = None
+    if subset:
+        from utils.ingest import subset_file
+        post = lambda path: subset_file(kind, path)
+    out_root = out_root or DATASETS[kind][3]
+    manifest = Manifest(out_root)
+    months_todo = [(y, m) for y in years for m in months]
+    print(f"▶️  {kind}: {len(months_todo)} months, {jobs} workers → {out_root}")
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        # 1) search
+        searches = {pool.submit(search_month, client, kind, y, m): (y, m) for y, m in months_todo}
+        tasks = []
+        for fut in as_completed(searches):
+            y, m = searches[fut]
+            try:
+                granules = fut.result()
+            except Exception as e:
+                print(f"❌ search {y}-{m:02d}：{e}")
+                continue
+            if not granules:
+                print(f"⚠️ 無資料：{y}-{m:02d}")
+            out_dir = os.path.join(out_root, f"{y:04d}", f"{m:02d}")
+            for g in granules:
+                if is_complete(manifest.get(g["id"])):
+                    continue
+                tasks.append((g, out_dir))
+
+        # 2) download
+        print(f"⬇️  {len(tasks)} granules to fetch")
+        futures = [pool.submit(fetch_granule, client, g, d, manifest, post) for g, d in tasks]
+        for i, fut in enumerate(as_completed(futures), 1):
+            path = fut.result()
+            if path:
+                print(f"  [{i}/{len(futures)}] ✅ {path}")
+
+    summary = manifest.summary()
+    print(f"✅ {kind} 完成：{summary}")
+    return summary
+
+
+def parse_range(spec):
+    """'2020-2025' / '3' / '1-5,10' → [..]"""
+    out = []
+    for part in spec.split(","):
+        lo, _, hi = part.partition("-")
+        out.extend(range(int(lo), int(hi or lo) + 1))
+    return out
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Parallel, resumable monthly data downloader")
+    p.add_argument("--kind", choices=list(DATASETS), action="append", help="repeatable; default all")
+    p.add_argument("--years", required=True, help="e.g. 2020-2025")
+    p.add_argument("--months", default="1-12", help="e.g. 1-12 or 6,7,8")
+    p.add_argument("--jobs", type=int, default=DOWNLOAD_WORKERS)
+    p.add_argument("--source", default="earthdata", help="earthdata | local:<dir>")
+    args = p.parse_args()
+
+    client = make_client(args.source)
+    for kind in args.kind or list(DATASETS):
+        download(kind, parse_range(args.years), parse_range(args.months), client=client, jobs=args.jobs)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Offline accuracy / latency comparison of the forecasting backends (utils/forecasting.py).
+
+每個抽樣格點：最後 --holdout 個月當測試資料，其餘拿來 fit，預測測試月份，算每個 target 的
+MAE / RMSE；同時量每個格點 fit + predict 的時間（= endpoint 沒有 artifact 時每次 request 的成本），
+和 fit_many 一次 fit 全部格點時平均每格的時間（= 離線訓練的成本）。
+
+Usage（在 backend/ 底下執行）：
+    python -m utils.evaluate_models                                  # MODEL_REGIONS、全部 kind、全部 backend
+    python -m utils.evaluate_models --kind temperature --cells 50 --bbox 24.5,121,25.5,122
+    python -m utils.evaluate_models --backend rf --backend harmonic --out ./result/eval.json
+
+資料只有 3 年時，留一年當測試後同月份只剩 2 個樣本，所以 rf 的 min_samples 用 --min-samples（預設 2）。
+"""
+import json
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+from utils.config import MODEL_REGIONS
+from utils.forecasting import BACKENDS, get_backend
+from utils.ingest import parse_regions
+from utils.train_models import KINDS, fit_many, kind_cells, load_cell, model_spec
+
+
+def sample_cells(kind, bboxes, n):
+    """bbox 內的 cell 平均抽 n 個"""
+    cells = [c for bbox in bboxes for c in kind_cells(kind, bbox)]
+    if len(cells) > n:
+        cells = [cells[int(i)] for i in np.linspace(0, len(cells) - 1, n)]
+    return cells
+
+
+def targets_of(kind):
+    if kind == "baseline":
+        from day.daily import BASELINE_COLS
+        return BASELINE_COLS
+    return model_spec(kind)["targets"]
+
+
+def split(df, holdout):
+    """時間排序後最後 holdout 個月當測試"""
+    df = df.sort_values(["year", "month"]).reset_index(drop=True)
+    return df.iloc[:-holdout], df.iloc[-holdout:]
+
+
+def fit_one(kind, train, months, backend, min_samples):
+    """單一格點：同 endpoint 當場 fit 的路徑，只有 months / min_samples 換成評估用的"""
+    if kind == "baseline":
+        from day import daily
+        out = {}
+        for m in months:
+            frame = daily.baseline_frame(train, m)
+            out[m] = None if frame is None else backend.fit(
+                frame, **dict(daily.BASELINE_SPEC, months=[m], min_samples=min_samples))
+        return out
+    return backend.fit(train, **dict(model_spec(kind), months=months, min_samples=min_samples))
+
+
+def predict_one(kind, fitted, year, month):
+    if kind == "baseline":
+        from day.daily import predict_baseline
+        return predict_baseline(fitted.get(month), year, month)
+    return fitted.predict(year, month)
+
+
+def evaluate(kind, histories, backend, holdout, min_samples):
+    targets = targets_of(kind)
+    errors = {t: [] for t in targets}
+    missing = 0
+    latency = []
+    trains, months_all = [], set()
+    for df in histories:
+        if len(df) <= holdout:
+            continue
+        train, test = split(df, holdout)
+        trains.append(train)
+        months = sorted(set(test["month"]))
+        months_all.update(months)
+        t0 = time.perf_counter()
+        fitted = fit_one(kind, train, months, backend, min_samples)
+        preds = [predict_one(kind, fitted, int(r.year), int(r.month)) for r in test.itertuples()]
+        latency.append(time.perf_counter() - t0)
+        for (_, row), p in zip(test.iterrows(), preds):
+            for t in targets:
+                if np.isnan(row[t]):
+                    continue
+                if np.isnan(p.get(t, np.nan)):
+                    missing += 1
+                    continue
+                errors[t].append(p[t] - row[t])
+
+    # 離線訓練的路徑：所有格點一次 fit_many
+    overrides = {"min_samples": min_samples}
+    if kind != "baseline":
+        overrides["months"] = sorted(months_all)
+    t0 = time.perf_counter()
+    if trains:
+        fit_many(kind, trains, backend.name, **overrides)
+    batch = (time.perf_counter() - t0) / max(len(trains), 1)
+
+    per_target = {}
+    for t, e in errors.items():
+        e = np.asarray(e)
+        per_target[t] = {"n": int(e.size),
+                         "mae": float(np.abs(e).mean()) if e.size else None,
+                         "rmse": float(np.sqrt((e ** 2).mean())) if e.size else None}
+    ms = sorted(1000 * s for s in latency)
+    return {"cells": len(trains), "targets": per_target, "missing_predictions": missing,
+            "per_call_ms": {"median": statistics.median(ms) if ms else None,
+                            "p95": ms[int(0.95 * (len(ms) - 1))] if ms else None},
+            "batched_fit_ms_per_cell": 1000 * batch}
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Compare forecasting backends: hold-out error and per-call latency")
+    p.add_argument("--bbox", help="lat_min,lon_min,lat_max,lon_max (default: MODEL_REGIONS)")
+    p.add_argument("--kind", choices=KINDS, action="append", help="repeatable; default all")
+    p.add_argument("--backend", choices=list(BACKENDS), action="append", help="repeatable; default all")
+    p.add_argument("--cells", type=int, default=20, help="grid cells sampled per kind")
+    p.add_argument("--holdout", type=int, default=12, help="months held out at the end of each series")
+    p.add_argument("--min-samples", type=int, default=2, help="rf: minimum same-month samples to fit")
+    p.add_argument("--out", help="also write the result JSON here")
+    args = p.parse_args()
+
+    if args.bbox:
+        bboxes = [tuple(float(x) for x in args.bbox.split(","))]
+    else:
+        bboxes = list(parse_regions(MODEL_REGIONS).values())
+
+    report = {}
+    for kind in args.kind or KINDS:
+        cells = sample_cells(kind, bboxes, args.cells)
+        histories = [load_cell(kind, lat, lon) for _, lat, lon in cells]
+        print(f"📊 {kind}: {len(histories)} cells, last {args.holdout} months held out")
+        report[kind] = {}
+        for name in args.backend or list(BACKENDS):
+            r = report[kind][name] = evaluate(kind, histories, get_backend(name), args.holdout, args.min_samples)
+            lat_ms = r["per_call_ms"]
+            print(f"  {name:<9} per call {lat_ms['median'] or 0:8.2f} ms (p95 {lat_ms['p95'] or 0:8.2f})   "
+                  f"batched fit {r['batched_fit_ms_per_cell']:7.3f} ms/cell   missing {r['missing_predictions']}")
+            for t, e in r["targets"].items():
+                if e["n"]:
+                    print(f"      {t:<10} MAE {e['mae']:10.4f}   RMSE {e['rmse']:10.4f}   n={e['n']}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
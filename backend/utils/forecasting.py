@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Forecasting backends for the monthly forecasters (month/*.py) and the daily baseline (day/daily.py).
+
+每個 forecaster 只用 MODEL_SPEC 描述「要預測什麼」（targets、features、哪些月份…），
+怎麼 fit 由 backend 決定，fit 出來的物件一律用 .predict(year, month) → {target: value}：
+
+    rf        每個月份一個 multi-output RandomForest（原本的做法；沒給 features 時 X = year）
+    harmonic  整條月序列一起 fit：線性趨勢 + FORECAST_HARMONICS 組年週期 sin/cos，NumPy 最小平方法。
+              fit_many 把很多格點（時間軸相同）疊成一個矩陣，一次 lstsq 解完
+
+    fitted = get_backend().fit(df, targets=["T2M"], label="temperature")
+    fitted.predict(2026, 1)   # {"T2M": 17.3}；資料不足的 target 是 NaN
+
+FORECAST_BACKEND 選預設 backend，會算進 utils/models.model_version(kind)：換 backend 後舊的
+artifact / response cache 自動失效。兩者的誤差和延遲用 python -m utils.evaluate_models 比較。
+"""
+import numpy as np
+import pandas as pd
+
+from utils import metrics
+from utils.config import FORECAST_BACKEND, FORECAST_HARMONICS
+
+
+def _clip(values, bounds):
+    for tgt, (lo, hi) in (bounds or {}).items():
+        if tgt in values and not np.isnan(values[tgt]):
+            values[tgt] = float(np.clip(values[tgt], lo, hi))
+    return values
+
+
+# ==============================
+# RandomForest（原本的做法）
+# ==============================
+class RandomForestFit:
+    def __init__(self, targets, features):
+        self.targets = list(targets)
+        self.features = features
+        self.models = {}   # month -> [(targets, RF, mean, scale)]；同一組 targets 一個 multi-output RF
+        self.means = {}    # (month, target) -> 樣本不足時的平均（fallback="mean"）
+        self.refs = {}     # month -> 預測時用的特徵列 (1, n)
+
+    def predict(self, year, month):
+        out = {tgt: self.means.get((month, tgt), np.nan) for tgt in self.targets}
+        models = self.models.get(month)
+        if models:
+            X = self.refs[month] if self.features else pd.DataFrame({"year": [year]})
+            for targets, model, mean, scale in models:
+                values = np.atleast_1d(model.predict(X)[0]) * scale + mean
+                out.update(zip(targets, map(float, values)))
+        return out
+
+
+class RandomForestBackend:
+    name = "rf"
+    batched = False   # fit_many 只是逐格 fit
+
+    def fit(self, df, targets, features=None, months=None, holdout_last=False, reference="last", weight=None,
+            min_samples=3, fallback=None, n_estimators=200, n_jobs=None, bounds=None, label="model"):
+        """
+        features   None → X = year；否則用這些欄位，預測時的 X 是同月份的最後一列（reference="last"）
+                   或平均（reference="mean"）
+        holdout_last  最後一年不拿來訓練（month/*.py 原本的寫法）
+        weight     sample_weight 欄位名
+
+        有值的列完全相同的 targets 共用一個 multi-output RF（特徵矩陣只建一次、一次 predict 全部變數）；
+        y 先各自標準化，不然 SLP（~1000 hPa）這種大數值會主導 split。
+        """
+        from sklearn.ensemble import RandomForestRegressor
+
+        fitted = RandomForestFit(targets, features)
+        cols = features or ["year"]
+        for month in sorted(set(df["month"])) if months is None else months:
+            hist = df[df["month"] == month]
+            if hist.empty:
+                continue
+            if features:
+                fitted.refs[month] = (hist[features].iloc[[-1]] if reference == "last"
+                                      else hist[features].mean().to_frame().T)
+            groups = {}   # 有值的列 -> targets
+            for tgt in targets:
+                rows = tuple(hist.index[hist[tgt].notna()])
+                if len(rows) >= min_samples:
+                    groups.setdefault(rows, []).append(tgt)
+                elif fallback == "mean":
+                    fitted.means[(month, tgt)] = float(hist[tgt].mean()) if rows else np.nan
+
+            for rows, group in groups.items():
+                train = hist.loc[list(rows)]
+                if holdout_last:
+                    train = train.iloc[:-1]
+                Y = train[group].to_numpy(dtype=float)
+                mean, scale = Y.mean(axis=0), Y.std(axis=0)
+                scale[scale == 0] = 1.0
+                Y = (Y - mean) / scale
+                model = RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs)
+                with metrics.stage("model_fit"):
+                    model.fit(train[cols], Y[:, 0] if len(group) == 1 else Y,
+                              sample_weight=train[weight] if weight else None)
+                metrics.inc("model_fits_total", model=label)
+                fitted.models.setdefault(month, []).append((tuple(group), model, mean, scale))
+        return fitted
+
+    def fit_many(self, dfs, targets, **spec):
+        return [self.fit(df, targets, **spec) for df in dfs]
+
+
+# ==============================
+# Harmonic regression（closed form）
+# ==============================
+def _design(t, months, harmonics):
+    """[1, t, cos(2πk m/12), sin(2πk m/12) ...]；t 是相對 t0 的年數"""
+    phase = 2 * np.pi * (np.asarray(months, dtype=float) - 1) / 12.0
+    cols = [np.ones_like(t), t]
+    for k in range(1, harmonics + 1):
+        cols += [np.cos(k * phase), np.sin(k * phase)]
+    return np.column_stack(cols)
+
+
+class HarmonicFit:
+    def __init__(self, targets, coef, t0, harmonics, bounds=None):
+        self.targets = list(targets)
+        self.coef = coef          # (n_params, n_targets)
+        self.t0 = t0
+        self.harmonics = harmonics
+        self.bounds = bounds
+
+    def predict(self, year, month):
+        x = _design(np.array([year + (month - 1) / 12.0 - self.t0]), [month], self.harmonics)
+        values = (x @ self.coef)[0]
+        return _clip({tgt: float(v) for tgt, v in zip(self.targets, values)}, self.bounds)
+
+
+class HarmonicBackend:
+    """
+    y(t) = a + b·t + Σ_k c_k cos(2πk·m/12) + d_k sin(2πk·m/12)
+    每個 target 6 個參數（harmonics=2），3 年月資料就有 36 個點；要每個月份各自一條趨勢
+    得 24 個參數，同月份只有 3–4 個樣本撐不住，所以趨勢是全年共用、季節性交給 harmonic。
+    """
+    name = "harmonic"
+    batched = True
+
+    def __init__(self, harmonics=FORECAST_HARMONICS):
+        self.harmonics = harmonics
+
+    def fit(self, df, targets, **spec):
+        return self.fit_many([df], targets, **spec)[0]
+
+    def fit_many(self, dfs, targets, weight=None, bounds=None, label="model", **_):
+        """
+        時間軸（和權重）相同的 df 疊成 Y (n_months, n_cells × n_targets)，一次 lstsq；
+        有 NaN 的欄位才逐欄 fit。RF 專用的參數（features、months、holdout_last…）忽略。
+        """
+        targets = list(targets)
+        n_params = 2 + 2 * self.harmonics
+        groups = {}
+        for i, df in enumerate(dfs):
+            key = (tuple(df["year"]), tuple(df["month"]), tuple(df[weight]) if weight else None)
+            groups.setdefault(key, []).append(i)
+
+        out = [None] * len(dfs)
+        with metrics.stage("model_fit"):
+            for (years, months, weights), idx in groups.items():
+                t = np.asarray(years, dtype=float) + (np.asarray(months, dtype=float) - 1) / 12.0
+                t0 = float(t.mean()) if len(t) else 0.0
+                X = _design(t - t0, months, self.harmonics)
+                Y = np.column_stack([dfs[i][tgt].to_numpy(dtype=float) for i in idx for tgt in targets]) \
+                    if len(t) else np.empty((0, len(idx) * len(targets)))
+                if weights is not None:
+                    sw = np.sqrt(np.clip(np.asarray(weights, dtype=float), 0, None))
+                    X, Y = X * sw[:, None], Y * sw[:, None]
+                coef = np.full((n_params, Y.shape[1]), np.nan)
+
+                ok = ~np.isnan(Y)
+                full = ok.all(axis=0)
+                if full.any() and len(t) >= n_params + 1:
+                    coef[:, full] = np.linalg.lstsq(X, Y[:, full], rcond=None)[0]
+                    full_done = full
+                else:
+                    full_done = np.zeros_like(full)
+                for j in np.where(~full_done)[0]:
+                    rows = ok[:, j]
+                    if rows.sum() >= n_params + 1:
+                        coef[:, j] = np.linalg.lstsq(X[rows], Y[rows, j], rcond=None)[0]
+                    elif rows.any():
+                        # 樣本太少：退回（加權）平均，趨勢和季節項為 0
+                        coef[:, j] = 0.0
+                        x0 = X[rows, 0]
+                        coef[0, j] = Y[rows, j] @ x0 / (x0 @ x0)
+
+                k = len(targets)
+                for n, i in enumerate(idx):
+                    out[i] = HarmonicFit(targets, coef[:, n * k:(n + 1) * k].copy(), t0, self.harmonics, bounds)
+        metrics.inc("model_fits_total", len(dfs), model=label)
+        return out
+
+
+BACKENDS = {b.name: b for b in (RandomForestBackend, HarmonicBackend)}
+
+
+def get_backend(name=None):
+    """name 沒給用 FORECAST_BACKEND"""
+    name = name or FORECAST_BACKEND
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"unknown forecast backend {name!r} (choose from {', '.join(BACKENDS)})") from None
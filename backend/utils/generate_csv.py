@@ -1,118 +1,198 @@
 import os
-import netCDF4 as nc
+import csv
+import io
+import json
+import threading
 import numpy as np
 import pandas as pd
 
-def generate_monthly_csv(lat: float, lon: float) -> pd.DataFrame:
-    YEAR_FROM, YEAR_TO = 2020, 2025
-
-    rows = {}
-    def ensure_row(y, m):
-        key = (y, m)
-        if key not in rows:
-            rows[key] = {
-                "year/month": f"{y:04d}/{m:02d}",
-                "lat": float(lat), "lon": float(lon),
-                "per": np.nan, "tem": np.nan, "hum": np.nan, "wind": np.nan, "pm25": np.nan
-            }
-        return rows[key]
-
-    # ---------- 1) Precipitation (IMERG, HDF5) ----------
-    precip_dir = "./data/precipitation/"
-    for y in range(YEAR_FROM, YEAR_TO + 1):
-        for m in range(1, 13):
-            if y == 2025 and m > 5:
-                break
-            fname = f"{y}/{m:02d}/3B-MO.MS.MRG.3IMERG.{y}{m:02d}01-S000000-E235959.{m:02d}.V07B.HDF5"
-            fpath = os.path.join(precip_dir, fname)
-            if not os.path.exists(fpath):
-                continue
-            try:
-                ds = nc.Dataset(fpath)
-                grp = ds.groups["Grid"]
-                lat_arr = grp["lat"][:]
-                lon_arr = grp["lon"][:]
-                li = int(np.abs(lat_arr - lat).argmin())
-                xi = int(np.abs(lon_arr - lon).argmin())
-                per = float(grp["precipitation"][0, xi, li])  # mm/h
-            finally:
-                ds.close()
-            ensure_row(y, m)["per"] = per
-    # ---------- 2) Temperature, Humidity, Wind (MERRA-2 SLV) ----------
-    slv_dir = "../data/temperature/"
-    for y in range(YEAR_FROM, YEAR_TO + 1):
-        for m in range(1, 13):
-            if y == 2025 and m > 5:
-                break
-            fname = f"{y}/{m:02d}/MERRA2_400.tavgM_2d_slv_Nx.{y}{m:02d}.nc4"
-            fname2 = f"{y}/{m:02d}/MERRA2_401.tavgM_2d_slv_Nx.{y}{m:02d}.nc4"
-            fpath = os.path.join(slv_dir, fname)
-            if not os.path.exists(fpath):
-                fpath = os.path.join(slv_dir, fname2)
-                if not os.path.exists(fpath):
-                    continue
-        
-            try:
-                ds = nc.Dataset(fpath)
-                lat_arr = ds["lat"][:]
-                lon_arr = ds["lon"][:]
-                li = int(np.abs(lat_arr - lat).argmin())
-                xi = int(np.abs(lon_arr - lon).argmin())
-
-                t2m  = float(ds["T2M"][0, li, xi]) - 273.15         # °C
-                qv2m = float(ds["QV2M"][0, li, xi]) * 1000.0        # g/kg
-                u10  = float(ds["U10M"][0, li, xi])
-                v10  = float(ds["V10M"][0, li, xi])
-                wind = float(np.sqrt(u10**2 + v10**2))              # m/s
-            finally:
-                ds.close()
-            row = ensure_row(y, m)
-            row["tem"]  = t2m
-            row["hum"]  = qv2m
-            row["wind"] = wind
-
-    # ---------- 3) PM2.5 (MERRA-2 AER) ----------
-    aer_dir = "../data/air_quality/"
-    for y in range(YEAR_FROM, YEAR_TO + 1):
+from utils import metrics
+from utils.config import HISTORY_YEAR_FROM, HISTORY_YEAR_TO
+from utils.store import month_file, read_point_series
+from utils.grids import grid_of, read_point
+
+COLUMNS = ["year/month", "lat", "lon", "per", "tem", "hum", "wind", "pm25"]
+STRING_COLUMNS = {"year/month", "site"}
+_nc_lock = threading.Lock()   # 串流在 thread 裡逐月讀檔；HDF5 library 不是 thread-safe，同時開檔會 HDF error
+
+
+def _store_series(lat, lon, method):
+    """三個 product 的 store 點序列；沒有 store 的是 None（逐月讀原始檔）"""
+    return {
+        "precipitation": read_point_series("precipitation", lat, lon, ["precipitation"], method=method),
+        "temperature": read_point_series("temperature", lat, lon, ["T2M", "QV2M", "U10M", "V10M"], method=method),
+        "air_quality": read_point_series("air_quality", lat, lon, method=method),
+    }
+
+
+def _month_values(product, point, y, m, lat, lon, method):
+    """單一 product 單一月份的值 dict；沒有資料回傳 None"""
+    if point is not None:
+        return point.get((y, m))
+    fpath = month_file(product, y, m)
+    if fpath is None:
+        return None
+    names = {"precipitation": ["precipitation"],
+             "temperature": ["T2M", "QV2M", "U10M", "V10M"],
+             "air_quality": ["BCSMASS", "OCSMASS", "SO4SMASS", "DUSMASS25", "SSSMASS25"]}[product]
+    with _nc_lock, metrics.stage("extract"):
+        ds = metrics.open_dataset(fpath, product)
+        try:
+            g = ds.groups["Grid"] if product == "precipitation" else ds
+            grid = grid_of(g)
+            return {n: read_point(g.variables[n], grid, lat, lon, method) for n in names}
+        finally:
+            ds.close()
+
+
+def iter_monthly_rows(lat: float, lon: float, year_from: int = HISTORY_YEAR_FROM,
+                      year_to: int = HISTORY_YEAR_TO, method: str = "nearest"):
+    """
+    逐月產生 history row（dict，欄位同 COLUMNS），讀完一個月就 yield 一個，
+    不會把整張表留在記憶體裡。三個資料集該月都沒有檔案的月份略過。
+    method: "nearest" 或 "bilinear"（周圍 4 格內插，見 utils/grids.py）
+    """
+    points = _store_series(lat, lon, method)
+    for y in range(year_from, year_to + 1):
         for m in range(1, 13):
-            fname1 = f"{y}/{m:02d}/MERRA2_400.tavgM_2d_aer_Nx.{y}{m:02d}.nc4"
-            fname2 = f"{y}/{m:02d}/MERRA2_401.tavgM_2d_aer_Nx.{y}{m:02d}.nc4"
-            fpath = os.path.join(aer_dir, fname1)
-            if not os.path.exists(fpath):
-                fpath = os.path.join(aer_dir, fname2)
-                if not os.path.exists(fpath):
-                    continue
-            try:
-                ds = nc.Dataset(fpath)
-                lat_arr = ds["lat"][:]
-                lon_arr = ds["lon"][:]
-                li = int(np.abs(lat_arr - lat).argmin())
-                xi = int(np.abs(lon_arr - lon).argmin())
-
-                bc   = float(ds["BCSMASS"][0, li, xi])     # kg/m^3
-                oc   = float(ds["OCSMASS"][0, li, xi])
-                so4  = float(ds["SO4SMASS"][0, li, xi])
-                dust = float(ds["DUSMASS25"][0, li, xi])
-                sea  = float(ds["SSSMASS25"][0, li, xi])
-            finally:
-                ds.close()
-            pm25 = (bc + oc + 1.375*so4 + dust + sea) * 1e9  # µg/m³
-            ensure_row(y, m)["pm25"] = pm25
-
-    if not rows:
-        return pd.DataFrame(columns=["year/month","lat","lon","per","tem","hum","wind","pm25"])
-
-    df = pd.DataFrame([rows[k] for k in sorted(rows.keys())])
-
-    def ym_key(s: str):
-        y, m = s.split("/")
-        return (int(y), int(m))
-    df = df.sort_values(by="year/month", key=lambda s: s.map(ym_key)).reset_index(drop=True)
-
-    df = df[["year/month","lat","lon","per","tem","hum","wind","pm25"]]
-    return df
+            row = {"year/month": f"{y:04d}/{m:02d}", "lat": float(lat), "lon": float(lon),
+                   "per": np.nan, "tem": np.nan, "hum": np.nan, "wind": np.nan, "pm25": np.nan}
+            found = False
+
+            # ---------- 1) Precipitation (IMERG, HDF5) ----------
+            v = _month_values("precipitation", points["precipitation"], y, m, lat, lon, method)
+            if v is not None:
+                found = True
+                row["per"] = v["precipitation"]  # mm/h
+
+            # ---------- 2) Temperature, Humidity, Wind (MERRA-2 SLV) ----------
+            v = _month_values("temperature", points["temperature"], y, m, lat, lon, method)
+            if v is not None:
+                found = True
+                row["tem"]  = v["T2M"] - 273.15                              # °C
+                row["hum"]  = v["QV2M"] * 1000.0                             # g/kg
+                row["wind"] = float(np.sqrt(v["U10M"]**2 + v["V10M"]**2))    # m/s
+
+            # ---------- 3) PM2.5 (MERRA-2 AER) ----------
+            v = _month_values("air_quality", points["air_quality"], y, m, lat, lon, method)
+            if v is not None:
+                found = True
+                row["pm25"] = (v["BCSMASS"] + v["OCSMASS"] + 1.375*v["SO4SMASS"]
+                               + v["DUSMASS25"] + v["SSSMASS25"]) * 1e9      # µg/m³
+
+            if found:
+                yield row
+
+
+def generate_monthly_csv(lat: float, lon: float, method: str = "nearest",
+                         year_from: int = HISTORY_YEAR_FROM, year_to: int = HISTORY_YEAR_TO) -> pd.DataFrame:
+    """iter_monthly_rows 收成 DataFrame（CLI / notebook 用；endpoint 走 encode_rows 串流）"""
+    return pd.DataFrame(list(iter_monthly_rows(lat, lon, year_from, year_to, method)), columns=COLUMNS)
+
+
+# ==============================
+# Streaming encoders
+# ==============================
+def _csv_chunks(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(["" if isinstance(row[c], float) and np.isnan(row[c]) else row[c] for c in columns])
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+
+
+def _ndjson_chunks(rows, columns):
+    for row in rows:
+        clean = {c: (None if isinstance(row[c], float) and np.isnan(row[c]) else row[c]) for c in columns}
+        yield (json.dumps(clean, ensure_ascii=False) + "\n").encode()
+
+
+class _Drain:
+    """pyarrow writer 的 sink：寫進來的 bytes 暫存，讓 generator 每批 yield 出去"""
+
+    def __init__(self):
+        self.chunks = []
+        self.pos = 0
+        self.closed = False
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        out, self.chunks = b"".join(self.chunks), []
+        return out
+
+
+def _arrow_chunks(rows, fmt, columns, batch_rows=12):
+    import pyarrow as pa
+    schema = pa.schema([(c, pa.string() if c in STRING_COLUMNS else pa.float64()) for c in columns])
+    sink = _Drain()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+        write = writer.write_table
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+        write = writer.write_table
+
+    batch, n = [], 0
+    for row in rows:
+        batch.append(row)
+        n += 1
+        if len(batch) >= batch_rows:   # 預設一年一個 row group / record batch
+            write(pa.Table.from_pylist(batch, schema=schema))
+            batch = []
+            yield sink.take()
+    if batch:
+        write(pa.Table.from_pylist(batch, schema=schema))
+    writer.close()
+    if n:   # 沒有任何 row 就什麼都不送，endpoint 才能回 404
+        yield sink.take()
+
+
+# format -> media type
+HISTORY_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def encode_rows(rows, fmt="csv", columns=COLUMNS, batch_rows=12):
+    """把 row iterator 編成 bytes chunks（一樣是 generator，邊讀邊送）；沒有 row 時不產生任何 chunk"""
+    if fmt == "csv":
+        return _csv_chunks(rows, columns)
+    if fmt == "ndjson":
+        return _ndjson_chunks(rows, columns)
+    if fmt in ("parquet", "arrow"):
+        return _arrow_chunks(rows, fmt, columns, batch_rows)
+    raise ValueError(f"unknown format: {fmt}")
+
+
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 
 if __name__ == "__main__":
     df = generate_monthly_csv(25.04, 121.56)
     os.makedirs("../result/csv", exist_ok=True)
-    df.to_csv("../result/csv/history_25.04_121.56.csv", index=False)
\ No newline at end of file
+    df.to_csv("../result/csv/history_25.04_121.56.csv", index=False)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Grid registry: nearest / bilinear lookups without reading coordinate vectors.
+
+IMERG 0.1° 和 MERRA-2 0.5°×0.625° 都是規則網格，index 可以直接算：
+    i = (x - x0) / dx
+不必每開一個檔就讀整條 lat/lon 再 argmin。
+
+    grid = grid_of(ds)                 # ds 是 netCDF4 Dataset 或 Group（IMERG 的 "Grid"）
+    li, xi = grid.nearest(lat, lon)    # 和原本 np.abs(lats - lat).argmin() 相同（平手取小的 index）
+    v = read_point(ds.variables["T2M"], grid, lat, lon, method="bilinear")
+
+grid_of 只讀 lat/lon 的頭尾兩個值當 key，同一種網格第一次遇到才讀完整座標；
+裁切過的檔案（utils/ingest.py）也適用。座標不等距時退回 searchsorted。
+"""
+import threading
+
+import numpy as np
+
+METHODS = ("nearest", "bilinear")
+
+
+class Grid:
+    """一維 lat/lon 座標（遞增）組成的網格"""
+
+    def __init__(self, lats, lons):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self._axes = (_Axis(self.lats), _Axis(self.lons))
+
+    @classmethod
+    def regular(cls, lat0, dlat, nlat, lon0, dlon, nlon):
+        return cls(lat0 + dlat * np.arange(nlat), lon0 + dlon * np.arange(nlon))
+
+    @property
+    def shape(self):
+        return len(self.lats), len(self.lons)
+
+    def nearest(self, lat, lon):
+        """最近格點；純量輸入回傳 int，陣列輸入回傳 intp 陣列"""
+        li, xi = self._axes[0].nearest(lat), self._axes[1].nearest(lon)
+        if np.ndim(lat) == 0 and np.ndim(lon) == 0:
+            return int(li), int(xi)
+        return li, xi
+
+    def bilinear(self, lat, lon):
+        """(li0, xi0, w)：左下角 index 和 2×2 權重 w[lat, lon]（純量輸入）"""
+        li, tl = self._axes[0].lower(lat)
+        xi, tx = self._axes[1].lower(lon)
+        w = np.outer([1.0 - tl, tl], [1.0 - tx, tx])
+        return int(li), int(xi), w
+
+
+class _Axis:
+    def __init__(self, coords):
+        self.coords = coords
+        self.n = len(coords)
+        step = np.diff(coords)
+        self.regular = self.n > 1 and np.allclose(step, step[0], rtol=0, atol=abs(step[0]) * 1e-3)
+        self.x0 = float(coords[0])
+        self.dx = float(step.mean()) if self.n > 1 else 1.0
+
+    def nearest(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.n == 1:
+            return np.zeros(x.shape, dtype=np.intp)
+        if self.regular:
+            # ceil(f - 0.5)：正好在中間時取較小的 index，和 argmin 一致
+            idx = np.ceil((x - self.x0) / self.dx - 0.5)
+            return np.clip(idx, 0, self.n - 1).astype(np.intp)
+        idx = np.clip(np.searchsorted(self.coords, x), 1, self.n - 1)
+        idx -= (x - self.coords[idx - 1]) <= (self.coords[idx] - x)
+        return idx.astype(np.intp)
+
+    def lower(self, x):
+        """左邊那一格的 index 和內插比例 t∈[0,1]（超出範圍就貼邊）"""
+        if self.n == 1:
+            return 0, 0.0
+        if self.regular:
+            f = (float(x) - self.x0) / self.dx
+            i = int(np.clip(np.floor(f), 0, self.n - 2))
+            return i, float(np.clip(f - i, 0.0, 1.0))
+        i = int(np.clip(np.searchsorted(self.coords, x) - 1, 0, self.n - 2))
+        t = (float(x) - self.coords[i]) / (self.coords[i + 1] - self.coords[i])
+        return i, float(np.clip(t, 0.0, 1.0))
+
+
+# 已知的全球網格（cell center）
+KNOWN_GRIDS = {
+    "imerg": Grid.regular(-89.95, 0.1, 1800, -179.95, 0.1, 3600),
+    "merra2": Grid.regular(-90.0, 0.5, 361, -180.0, 0.625, 576),
+}
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def _key(lats, lons):
+    return (len(lats), round(float(lats[0]), 4), round(float(lats[-1]), 4),
+            len(lons), round(float(lons[0]), 4), round(float(lons[-1]), 4))
+
+
+for _g in KNOWN_GRIDS.values():
+    _registry[_key(_g.lats, _g.lons)] = _g
+
+
+def grid_of(g):
+    """netCDF4 Dataset / Group 的網格；只讀座標頭尾，同一種網格只建一次"""
+    lat_v, lon_v = g.variables["lat"], g.variables["lon"]
+    key = _key_from_vars(lat_v, lon_v)
+    grid = _registry.get(key)
+    if grid is None:
+        grid = Grid(np.asarray(lat_v[:]), np.asarray(lon_v[:]))
+        with _lock:
+            _registry[key] = grid
+    return grid
+
+
+def _key_from_vars(lat_v, lon_v):
+    nlat, nlon = len(lat_v), len(lon_v)
+    return (nlat, round(float(lat_v[0]), 4), round(float(lat_v[nlat - 1]), 4),
+            nlon, round(float(lon_v[0]), 4), round(float(lon_v[nlon - 1]), 4))
+
+
+def grid_from_coords(lats, lons):
+    """已經在記憶體裡的座標（例如 store 的 lat.npy / lon.npy）"""
+    key = _key(lats, lons)
+    grid = _registry.get(key)
+    if grid is None:
+        grid = Grid(lats, lons)
+        with _lock:
+            _registry[key] = grid
+    return grid
+
+
+def bilinear_weighted(block, w):
+    """block 的前兩維是 (lat, lon) 的 2×2（邊界可能是 1×N）；缺值的角落不算，權重重新正規化"""
+    block = np.asarray(block, dtype=np.float64)
+    w = w[:block.shape[0], :block.shape[1]]
+    w = w.reshape(w.shape + (1,) * (block.ndim - 2))
+    valid = ~np.isnan(block)
+    total = (w * valid).sum(axis=(0, 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, (np.where(valid, block, 0.0) * w).sum(axis=(0, 1)) / total, np.nan)
+
+
+def read_point(var, grid, lat, lon, method="nearest", time_index=0):
+    """
+    從 netCDF4 變數讀一個點的值（float，缺值為 NaN）。
+    維度順序看名字：MERRA-2 (time, lat, lon)、IMERG (time, lon, lat) 都可以。
+    """
+    dims = [d.lower() for d in var.dimensions]
+    lat_ax = next(i for i, d in enumerate(dims) if "lat" in d)
+    lon_ax = next(i for i, d in enumerate(dims) if "lon" in d)
+    index = [time_index] * len(dims)
+    if method == "nearest":
+        index[lat_ax], index[lon_ax] = grid.nearest(lat, lon)
+        return float(np.ma.filled(np.ma.asarray(var[tuple(index)], dtype=np.float64), np.nan))
+    li, xi, w = grid.bilinear(lat, lon)
+    index[lat_ax], index[lon_ax] = slice(li, li + 2), slice(xi, xi + 2)
+    block = np.ma.filled(np.ma.asarray(var[tuple(index)], dtype=np.float64), np.nan)
+    if lat_ax > lon_ax:
+        block = block.T
+    return float(bilinear_weighted(block, w))
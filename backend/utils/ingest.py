@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Ingest stage: clip downloaded granules to the regions we serve.
+
+全球 granule 只留：
+    - INGEST_REGIONS 的外接矩形（再往外留 INGEST_MARGIN_DEG 度，邊界附近的最近格點 / 內插才不會缺）
+    - loader 會讀的變數（store.PRODUCTS[*]["vars"]）+ time/lat/lon
+輸出是 zlib 壓縮、分塊的 NETCDF4，檔名、group、維度順序都不變，所以
+month/*.py、utils/store.py、day/*.py 不用改就能讀。
+
+多個 region 取外接矩形而不是分開存：loader 都假設 lat/lon 是一維規則網格。
+
+    python -m utils.ingest                                    # 現有的 ./data 全部就地裁切
+    python -m utils.ingest --product temperature --year-from 2024
+utils/downloader.py 下載完、驗證過的檔案也會自動走這裡（INGEST_SUBSET=0 可關掉）。
+"""
+import os
+import json
+import argparse
+
+import numpy as np
+import netCDF4 as nc
+
+from utils import catalog
+from utils.config import INGEST_REGIONS, INGEST_MARGIN_DEG
+from utils.store import PRODUCTS, find_monthly_files
+
+SUBSET_ATTR = "ingest_subset"   # global attribute：裁切範圍；有這個的檔案就不再處理
+COORDS = ("time", "lat", "lon")
+
+
+def parse_regions(spec):
+    """'name:lat_min,lon_min,lat_max,lon_max;...' → {name: (lat_min, lon_min, lat_max, lon_max)}"""
+    regions = {}
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        name, _, bbox = part.rpartition(":")
+        regions[name or bbox] = tuple(float(x) for x in bbox.split(","))
+    return regions
+
+
+def region_hull(regions, margin=INGEST_MARGIN_DEG):
+    """所有 region 的外接矩形 (lat_min, lon_min, lat_max, lon_max)"""
+    boxes = list(regions.values())
+    return (max(-90.0, min(b[0] for b in boxes) - margin),
+            max(-180.0, min(b[1] for b in boxes) - margin),
+            min(90.0, max(b[2] for b in boxes) + margin),
+            min(180.0, max(b[3] for b in boxes) + margin))
+
+
+def _index_range(coord, lo, hi):
+    idx = np.where((coord >= lo) & (coord <= hi))[0]
+    if idx.size == 0:
+        # 範圍比格距還小：至少留最近的一格
+        idx = np.array([int(np.abs(coord - (lo + hi) / 2).argmin())])
+    return slice(int(idx[0]), int(idx[-1]) + 1)
+
+
+def _chunks(shape):
+    return tuple(max(1, min(n, 256)) for n in shape)
+
+
+def is_subset(path):
+    with nc.Dataset(path) as ds:
+        return SUBSET_ATTR in ds.ncattrs()
+
+
+def subset_file(product, src, dst=None, bbox=None):
+    """
+    裁切一個 granule；dst 預設就地取代（tmp + os.replace）。
+    回傳 (原始 bytes, 裁切後 bytes)。
+    """
+    spec = PRODUCTS[product]
+    bbox = bbox or region_hull(parse_regions(INGEST_REGIONS))
+    dst = dst or src
+    tmp = f"{dst}.{os.getpid()}.ingest"
+    before = os.path.getsize(src)
+
+    with nc.Dataset(src) as ds_in:
+        g_in = ds_in.groups[spec["group"]] if spec["group"] else ds_in
+        lat_sl = _index_range(g_in.variables["lat"][:], bbox[0], bbox[2])
+        lon_sl = _index_range(g_in.variables["lon"][:], bbox[1], bbox[3])
+        keep = [n for n in COORDS if n in g_in.variables] + \
+               [n for n in spec["vars"] if n in g_in.variables]
+
+        with nc.Dataset(tmp, "w", format="NETCDF4") as ds_out:
+            ds_out.setncatts({k: ds_in.getncattr(k) for k in ds_in.ncattrs()})
+            ds_out.setncattr(SUBSET_ATTR, json.dumps({"bbox": list(bbox), "vars": keep}))
+            g_out = ds_out.createGroup(spec["group"]) if spec["group"] else ds_out
+
+            slices = {"lat": lat_sl, "lon": lon_sl}
+            for name in {d for n in keep for d in g_in.variables[n].dimensions}:
+                dim = g_in.dimensions[name]
+                if name in slices:
+                    size = slices[name].stop - slices[name].start
+                else:
+                    size = None if dim.isunlimited() else len(dim)
+                g_out.createDimension(name, size)
+
+            for name in keep:
+                v_in = g_in.variables[name]
+                index = tuple(slices.get(d, slice(None)) for d in v_in.dimensions)
+                data = v_in[index]
+                attrs = {k: v_in.getncattr(k) for k in v_in.ncattrs() if k != "_FillValue"}
+                fill = v_in.getncattr("_FillValue") if "_FillValue" in v_in.ncattrs() else None
+                v_out = g_out.createVariable(name, v_in.dtype, v_in.dimensions, zlib=True, complevel=4,
+                                             shuffle=True, chunksizes=_chunks(np.shape(data)) or None,
+                                             fill_value=fill)
+                v_out.setncatts(attrs)
+                v_out[...] = data
+    os.replace(tmp, dst)
+    return before, os.path.getsize(dst)
+
+
+def ingest_product(product, year_from=0, year_to=9999, force=False):
+    bbox = region_hull(parse_regions(INGEST_REGIONS))
+    total_before = total_after = 0
+    for _, path in find_monthly_files(product, year_from, year_to):
+        if not force and is_subset(path):
+            continue
+        before, after = subset_file(product, path, bbox=bbox)
+        catalog.register(path)
+        total_before += before
+        total_after += after
+        print(f"  ✂️ {path}: {before / 1e6:.1f} MB → {after / 1e6:.2f} MB")
+    print(f"✅ {product}: {total_before / 1e6:.1f} MB → {total_after / 1e6:.2f} MB (bbox {bbox})")
+    return total_before, total_after
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Clip downloaded granules to INGEST_REGIONS")
+    p.add_argument("--product", choices=list(PRODUCTS), action="append", help="repeatable; default all")
+    p.add_argument("--year-from", type=int, default=0)
+    p.add_argument("--year-to", type=int, default=9999)
+    p.add_argument("--force", action="store_true", help="re-clip files that are already subset")
+    args = p.parse_args()
+    for product in args.product or list(PRODUCTS):
+        ingest_product(product, args.year_from, args.year_to, force=args.force)
+
+
+if __name__ == "__main__":
+    main_cli()
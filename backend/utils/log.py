@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Logging setup for the server and its worker processes.
+
+模組裡一律 log = logging.getLogger(__name__)，結構化欄位放 extra：
+    log.debug("📅 monthly records loaded", extra={"product": "temperature", "months": 36})
+LOG_FORMAT=json 時每行一個 JSON（extra 的欄位直接展開），text 時 extra 接在訊息後面。
+逐檔 / 逐月的進度是 DEBUG；預設 INFO 下 request 路徑不會輸出任何東西。
+"""
+import sys
+import json
+import time
+import logging
+
+from utils.config import LOG_FORMAT, LOG_LEVEL
+
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+_configured = False
+# 第三方套件的 INFO 太吵（例如 matplotlib.category 每張圖都一行），只在 DEBUG 時放出來
+_NOISY = ("matplotlib", "PIL", "urllib3", "asyncio")
+
+
+def _extras(record):
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+               "level": record.levelname, "logger": record.name, "pid": record.process,
+               "msg": record.getMessage(), **_extras(record)}
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extras = _extras(record)
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        return line
+
+
+def setup_logging(level=None, fmt=None):
+    """root logger 設定一次（main.py 啟動時、每個 worker process 啟動時各呼叫一次）"""
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level or LOG_LEVEL)
+    if root.getEffectiveLevel() > logging.DEBUG:
+        for name in _NOISY:
+            logging.getLogger(name).setLevel(logging.WARNING)
+    _configured = True
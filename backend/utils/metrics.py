@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage metrics + Prometheus text exposition (GET /api/metrics).
+
+每個 process 一份 registry（counter / histogram / gauge，label 用 kwargs）：
+    metrics.inc("files_opened_total", product="temperature")
+    with metrics.stage("model_fit"): ...           # stage_seconds{stage="model_fit"}
+    @metrics.stage("extract")                      # 也可以當 decorator
+    ds = metrics.open_dataset(path, "temperature") # files_opened_total + granule_bytes_total + file_open 計時
+
+request 的重活在 process pool 裡跑（utils/workers.py）：worker 用 collect() 包住工作，
+把這次呼叫記到的值跟著結果帶回 parent，parent 再 merge() 進自己的 registry。
+"""
+import os
+import time
+import math
+import threading
+import contextlib
+
+PREFIX = "weatherlens_"
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+# name -> (type, help)；沒列在這裡的照樣可以記，只是沒有 HELP
+METRICS = {
+    "http_request_seconds": ("histogram", "HTTP request latency until response headers, by route and status"),
+    "stage_seconds": ("histogram", "Time spent per pipeline stage (file_open is nested inside extract)"),
+    "files_opened_total": ("counter", "NetCDF/HDF5 granules opened, by product"),
+    "granule_bytes_total": ("counter", "Size on disk of opened granules (upper bound on bytes read)"),
+    "model_fits_total": ("counter", "Models fitted at request time, by model"),
+    "cache_requests_total": ("counter", "Cache lookups, by cache and result"),
+    "coalesced_requests_total": ("counter", "Requests that waited on an identical in-flight computation"),
+    "lane_rejected_total": ("counter", "Requests rejected with 503 because a lane was full"),
+    "worker_pool_restarts_total": ("counter", "Worker pools recreated after a worker process died"),
+    "lane_running": ("gauge", "Jobs currently running per lane"),
+    "lane_waiting": ("gauge", "Jobs currently queued per lane"),
+}
+
+_lock = threading.Lock()
+_counters = {}   # (name, labels) -> float
+_hists = {}      # (name, labels) -> [bucket counts..., sum, count]
+_gauges = {}     # (name, labels) -> float
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+# ==============================
+# Recording
+# ==============================
+def inc(name, value=1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def observe(name, value, **labels):
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, b in enumerate(BUCKETS):
+            if value <= b:
+                h[i] += 1
+                break
+        h[-2] += value
+        h[-1] += 1
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def stage(name):
+    """stage_seconds{stage=name}；with 或 decorator 都可以"""
+    return timer("stage_seconds", stage=name)
+
+
+def open_dataset(path, product, opener=None, **kwargs):
+    """opener(path, **kwargs)（預設 netCDF4.Dataset），順便記檔案數、大小、開檔時間"""
+    if opener is None:
+        import netCDF4
+        opener = netCDF4.Dataset
+    with stage("file_open"):
+        ds = opener(path, **kwargs)
+    inc("files_opened_total", product=product)
+    try:
+        inc("granule_bytes_total", os.path.getsize(path), product=product)
+    except OSError:
+        pass
+    return ds
+
+
+# ==============================
+# Cross-process
+# ==============================
+def snapshot():
+    with _lock:
+        return {"counters": dict(_counters), "hists": {k: list(v) for k, v in _hists.items()}}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _hists.clear()
+        _gauges.clear()
+
+
+def merge(snap):
+    with _lock:
+        for k, v in snap["counters"].items():
+            _counters[k] = _counters.get(k, 0) + v
+        for k, v in snap["hists"].items():
+            h = _hists.get(k)
+            if h is None:
+                _hists[k] = list(v)
+            else:
+                _hists[k] = [a + b for a, b in zip(h, v)]
+
+
+def collect(fn, *args):
+    """
+    在 worker process 裡執行 fn(*args)，回傳 (結果, 這次呼叫記到的 metrics)。
+    只能在一次跑一個工作的 worker 裡用（會先清空這個 process 的 registry）。
+    """
+    reset()
+    result = fn(*args)
+    return result, snapshot()
+
+
+# ==============================
+# Exposition
+# ==============================
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v):
+    if v == math.inf:
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render():
+    """Prometheus text format (version 0.0.4)"""
+    with _lock:
+        counters, gauges = dict(_counters), dict(_gauges)
+        hists = {k: list(v) for k, v in _hists.items()}
+
+    series, kinds = {}, {}
+    for kind, store in (("counter", counters), ("gauge", gauges), ("histogram", hists)):
+        for name, labels in store:
+            series.setdefault(name, set()).add(labels)
+            kinds[name] = kind
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text = METRICS.get(name, (kinds[name], ""))
+        if help_text:
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for labels in sorted(series[name]):
+            k = (name, labels)
+            if k in hists:
+                h, cum = hists[k], 0
+                for b, n in zip(BUCKETS, h):
+                    cum += n
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(labels, [('le', _num(b))])} {cum}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {_num(h[-2])}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {h[-1]}")
+            else:
+                lines.append(f"{PREFIX}{name}{_labels(labels)} {_num(counters.get(k, gauges.get(k, 0)))}")
+    return "\n".join(lines) + "\n"
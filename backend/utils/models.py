@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Pretrained per-grid-cell model artifacts.
+
+離線訓練（python -m utils.train_models）把每個格點 fit 好的模型（utils/forecasting.py）存成
+    ./data/models/<version>/<kind>/<cell>.joblib
+request 時只載入、做 predict，不再當場 fit。
+
+version = v<MODEL_SCHEMA>-<FORECAST_BACKEND>-<用到的 product 的 data version>，每個 kind 各自一個：
+新的降雨月份進來只有 precipitation 和 baseline 換 version（utils/update.py 只重訓這兩個）。
+資料一變或換 backend，舊 artifact 自動失效，endpoint 會退回當場訓練，直到重新跑訓練。
+"""
+import os
+import shutil
+import joblib
+
+from utils import metrics
+from utils.cache import LRUCache
+from utils.config import FORECAST_BACKEND, MODEL_CACHE_SIZE
+from utils.snapshots import data_root
+from utils.store import monthly_data_version
+
+MODEL_ROOT = os.path.join("./data/", "models")
+MODEL_SCHEMA = 4   # 2: artifact 裡存的是 utils/forecasting.py 的 fitted 物件；3: multi-output RF；4: baseline 以 grid_cell 為單位
+
+# kind -> 用哪個 product 的網格當 cell
+KIND_GRID = {
+    "temperature": "temperature",
+    "precipitation": "precipitation",
+    "air_quality": "air_quality",
+    "baseline": None,   # 三個網格的格點組合（BASELINE_GRIDS），見 train_models.kind_cells
+}
+
+# baseline 的 cell = day/daily.grid_cell：這三個網格各自的最近格點。特徵裡有 0.1° 的 IMERG 降雨，
+# 只用 MERRA-2 格點當 key 的話同一格裡的點都會拿到格點中心的降雨，跟當場 fit 的結果不一樣
+BASELINE_GRIDS = ("precipitation", "temperature", "air_quality")
+
+# kind -> load_cell 讀哪些 product（這些 product 的資料變了才要重訓）
+KIND_PRODUCTS = {
+    "temperature": ("temperature",),
+    "precipitation": ("precipitation",),
+    "air_quality": ("air_quality",),
+    "baseline": ("precipitation", "temperature", "air_quality"),
+}
+
+_loaded = LRUCache(maxsize=MODEL_CACHE_SIZE, name="model_artifacts")
+
+
+def model_version(kind):
+    return f"v{MODEL_SCHEMA}-{FORECAST_BACKEND}-{monthly_data_version(KIND_PRODUCTS[kind])}"
+
+
+def model_versions():
+    """{kind: model_version}"""
+    return {kind: model_version(kind) for kind in KIND_GRID}
+
+
+def cell_key(cell):
+    """(lat_idx, lon_idx) → "li_xi"；baseline 的 cell（每個網格一組，沒有該網格是 None）→ "li_xi-li_xi-x" """
+    if cell and (cell[0] is None or isinstance(cell[0], (tuple, list))):
+        return "-".join("x" if c is None else cell_key(c) for c in cell)
+    return f"{cell[0]}_{cell[1]}"
+
+
+def parse_cell_key(key):
+    if "-" in key:
+        return tuple(None if part == "x" else parse_cell_key(part) for part in key.split("-"))
+    li, _, xi = key.partition("_")
+    return int(li), int(xi)
+
+
+def artifact_path(kind, cell, version=None, root=MODEL_ROOT):
+    return os.path.join(root, version or model_version(kind), kind, f"{cell_key(cell)}.joblib")
+
+
+def save_artifact(kind, cell, models, version=None, **meta):
+    path = artifact_path(kind, cell, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    joblib.dump({"kind": kind, "cell": tuple(cell), "version": version or model_version(kind),
+                 "models": models, **meta}, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def load_artifact(kind, cell):
+    """回傳當前 data version 的 artifact dict（request pin 住 snapshot 時讀 snapshot 裡的）；沒有就回 None（呼叫端自己 fit）"""
+    if cell is None:
+        return None
+    root = os.path.join(data_root(), "models")
+    path = artifact_path(kind, cell, root=root)
+    key = os.path.relpath(path, root)   # 各 snapshot 裡同一個 version 的 artifact 是同一個檔，切換後不必重新載入
+    art = _loaded.get(key)
+    if art is not None:
+        return art
+    if not os.path.exists(path):
+        return None
+    with metrics.stage("model_load"):
+        art = joblib.load(path)
+    _loaded.set(key, art)
+    return art
+
+
+def trained_cells(kind, version):
+    """version 底下這個 kind 已經有 artifact 的 cell（跟 save_artifact 收到的 cell 同一個形式）"""
+    kind_dir = os.path.join(MODEL_ROOT, version, kind)
+    if not os.path.isdir(kind_dir):
+        return []
+    return sorted((parse_cell_key(name[:-len(".joblib")]) for name in os.listdir(kind_dir) if name.endswith(".joblib")),
+                  key=cell_key)
+
+
+def prune_versions(keep):
+    """刪掉 keep 以外的 version 目錄；回傳刪了哪些"""
+    if not os.path.isdir(MODEL_ROOT):
+        return []
+    removed = []
+    for name in sorted(os.listdir(MODEL_ROOT)):
+        path = os.path.join(MODEL_ROOT, name)
+        if name not in keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+def model_cache_stats():
+    return _loaded.stats()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Time windows derived from the data being served.
+
+以前 month/*.py 寫死 2022/06–2025/05、load_monthly_records 寫死 2022–2024、日 anomaly 寫死 2024，
+多一個月的資料就得改程式。這裡一律從「目前提供服務的資料」推出來：有 point store 用 store 的月份
+（utils/update.py 換上新 store 的那一刻視窗跟著移動），沒有 store 用 catalog 裡的月檔。
+
+    history_months("temperature")      最新 HISTORY_MONTHS 個月 [(year, month)]，結束在最新的資料月份
+    forecast_months()                  FORECAST_START（預設當月）起 FORECAST_HORIZON 個月
+    years_with_month("temperature", 7, 3)   最近 3 個有 7 月資料的年份
+    daily_reference_year("rain_daily") 沒有 anomaly cube 時用哪一年的日檔
+    span(months)                       "2022/06–2025/05"（圖的標題用）
+"""
+import time
+from datetime import date
+
+from utils import catalog
+from utils.snapshots import data_root
+from utils.config import (DAILY_REFERENCE_YEAR, DATA_VERSION_CHECK_SECONDS, FORECAST_HORIZON, FORECAST_START,
+                          HISTORY_MONTHS)
+
+_daily_years = {}   # (data root, product) -> (checked, year)
+
+
+def shift(year, month, k):
+    """(year, month) 往後 k 個月（k 可為負）"""
+    i = year * 12 + (month - 1) + k
+    return i // 12, i % 12 + 1
+
+
+def served_months(product):
+    """目前提供服務的月份，依時間排序"""
+    from utils.store import find_monthly_files, open_store
+    store = open_store(product)
+    if store is not None:
+        return [(t.year, t.month) for t in store["times"]]
+    return [(d.year, d.month) for d, _ in find_monthly_files(product, 0, 9999)]
+
+
+def latest_month(product):
+    months = served_months(product)
+    return months[-1] if months else None
+
+
+def history_months(product, n=HISTORY_MONTHS):
+    """最新 n 個日曆月（中間缺檔的月份也在裡面，loader 讀不到就跳過）"""
+    last = latest_month(product)
+    if last is None:
+        return []
+    return [shift(*last, k) for k in range(1 - n, 1)]
+
+
+def forecast_months(n=FORECAST_HORIZON, start=FORECAST_START):
+    if start:
+        y, m = (int(v) for v in start.split("-"))
+    else:
+        today = date.today()
+        y, m = today.year, today.month
+    return [shift(y, m, k) for k in range(n)]
+
+
+def years_with_month(product, month, n):
+    """最近 n 個有這個月份資料的年份（由舊到新）"""
+    return sorted({y for y, m in served_months(product) if m == month})[-n:]
+
+
+def daily_reference_year(product):
+    """DAILY_REFERENCE_YEAR，或日檔 12 個月都有的最新年份（都不完整時取最新的一年）"""
+    if DAILY_REFERENCE_YEAR:
+        return DAILY_REFERENCE_YEAR
+    now, key = time.monotonic(), (data_root(), product)
+    cached = _daily_years.get(key)
+    if cached is not None and now - cached[0] < DATA_VERSION_CHECK_SECONDS:
+        return cached[1]
+    months = {}
+    for dt, _ in catalog.daily_files(product):
+        months.setdefault(dt.year, set()).add(dt.month)
+    full = [y for y, ms in months.items() if len(ms) == 12]
+    year = max(full) if full else max(months, default=None)
+    _daily_years[key] = (now, year)
+    return year
+
+
+def span(months):
+    if not months:
+        return ""
+    (y0, m0), (y1, m1) = months[0], months[-1]
+    return f"{y0}/{m0:02d}–{y1}/{m1:02d}"
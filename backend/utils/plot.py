@@ -5,9 +5,24 @@ import pandas as pd
 import numpy as np
 import xarray as xr
 import os
+import logging
 
-def plot_monthly_variable(month, years, values, var_name, unit):
-    os.makedirs(f"./result/{var_name}", exist_ok=True)
+from utils import metrics
+from utils.periods import years_with_month
+from utils.store import month_file, read_point_series, snap_to_grid
+from utils.plot_cache import cached_plot, save_figure, url_path
+
+log = logging.getLogger(__name__)
+
+def es(t_c):
+    """飽和水氣壓 (hPa)"""
+    return 6.112 * np.exp((17.67 * t_c) / (t_c + 243.5))
+
+def plot_monthly_variable(month, years, values, var_name, unit, out_path=None):
+    """out_path 沒給時沿用舊的 ./result/{var}/{month}_{var}.png"""
+    if out_path is None:
+        os.makedirs(f"./result/{var_name}", exist_ok=True)
+        out_path = f"./result/{var_name}/{month}_{var_name}.png"
     df = pd.DataFrame({
         "year": years,
         var_name: values
@@ -22,115 +37,137 @@ def plot_monthly_variable(month, years, values, var_name, unit):
                  color={'temperature':'orange','humidity':'teal','windspeed':'purple'}.get(var_name,'gray'))
         plt.scatter(df["year"], df[var_name], s=60)
     
-    plt.title(f"{month} {var_name.replace('_',' ').title()} ({years[0]}–{years[-1]})")
+    span = f" ({years[0]}–{years[-1]})" if years else ""
+    plt.title(f"{month} {var_name.replace('_',' ').title()}{span}")
     plt.xlabel("Year")
     plt.ylabel(f"{var_name.replace('_',' ').title()} ({unit})")
     plt.xticks(df["year"])
     plt.tight_layout()
-    plt.savefig(f"./result/{var_name}/{month}_{var_name}.png")
-    plt.close()
+    save_figure(plt, out_path)
+    return out_path
 
 def plot_all(month, lat, lon):
-    years = [2022, 2023, 2024]
-    month = month
-    lat = lat
-    lon = lon
-    out_paths = []
+    # 圖檔以 (變數, 月份, 格點, data version) 定址；快取裡都有就完全不讀資料、不畫圖
+    grid_of = {"precipitation": "precipitation", "temperature": "temperature",
+               "humidity": "temperature", "windspeed": "temperature",
+               "air_quality": "air_quality"}
+    # 每個產品各自取最近 3 個有這個月份資料的年份（三個產品的覆蓋範圍不一定一樣）
+    years = {product: years_with_month(product, int(month), 3) for product in set(grid_of.values())}
+    plots = {var: cached_plot("monthly", var, month, tuple(years[product]),
+                              snap_to_grid(product, lat, lon) or (lat, lon))
+             for var, product in grid_of.items()}
+    out_paths = [url_path(path) for path, _ in plots.values()]
+    if all(hit for _, hit in plots.values()):
+        return out_paths
+
+    if not plots["precipitation"][1]:
+        plot_precipitation(month, years["precipitation"], lat, lon, plots["precipitation"][0])
+    if not all(plots[v][1] for v in ("temperature", "humidity", "windspeed")):
+        plot_slv(month, years["temperature"], lat, lon, {v: plots[v][0] for v in ("temperature", "humidity", "windspeed")})
+    if not plots["air_quality"][1]:
+        plot_air_quality(month, years["air_quality"], lat, lon, plots["air_quality"][0])
+    return out_paths
 
+
+def plot_precipitation(month, years, lat, lon, out_path):
     preciplist = []
-    for year in years:
-        path = f"./data/precipitation/{year}/{month}/3B-MO.MS.MRG.3IMERG.{year}{month}01-S000000-E235959.{month}.V07B.HDF5"
-        ds = xr.open_dataset(
-            path,
-            engine="h5netcdf",
-            group="Grid"
-        )
-        ds = xr.open_dataset(path, engine="h5netcdf", group="Grid")
-        da = ds["precipitation"] 
-        if "time" in da.dims:
-            da = da.isel(time=0)          
-
-        value = float(da.sel(lat=lat, lon=lon, method="nearest").values)
-        preciplist.append(value)
-        # print(f"{year}-{month} mean precipitation: {value:.6f} mm/hr")
-    plot_monthly_variable(month, years, preciplist, "precipitation", "mm")
-    out_paths.append(f"/result/precipitation/{month}_precipitation.png")
+    with metrics.stage("extract"):   # 讀值；畫圖的時間記在 render（utils/plot_cache.save_figure）
+        point = read_point_series("precipitation", lat, lon, ["precipitation"])
+        for year in years:
+            if point is not None:
+                v = point.get((year, int(month)))
+                preciplist.append(np.nan if v is None else v["precipitation"])   # 缺的年份畫成空的，長度要跟 years 一樣
+                continue
+            path = month_file("precipitation", year, int(month))
+            if path is None:
+                preciplist.append(np.nan)
+                continue
+            ds = metrics.open_dataset(path, "precipitation", xr.open_dataset, engine="h5netcdf", group="Grid")
+            da = ds["precipitation"] 
+            if "time" in da.dims:
+                da = da.isel(time=0)          
 
-    
+            value = float(da.sel(lat=lat, lon=lon, method="nearest").values)
+            preciplist.append(value)
+            # print(f"{year}-{month} mean precipitation: {value:.6f} mm/hr")
+    plot_monthly_variable(month, years, preciplist, "precipitation", "mm", out_path)
+
+
+def plot_slv(month, years, lat, lon, out_paths):
     temperaturelist = []
     humiditylist = []
     windspeedlist = []
-    for year in years:
-        path_400 = f"./data/temperature/{year}/{month}/MERRA2_400.tavgM_2d_slv_Nx.{year}{month}.nc4"
-        path_401 = f"./data/temperature/{year}/{month}/MERRA2_401.tavgM_2d_slv_Nx.{year}{month}.nc4"
-
-        if os.path.exists(path_400):
-            path = path_400
-        elif os.path.exists(path_401):
-            path = path_401
-        else:
-            continue
-        ds = xr.open_dataset(
-            path,
-            engine="netcdf4"
-        )
-        # temperature
-        t2m = ds["T2M"].isel(time=0) - 273.15 
-        if "time" in t2m.dims:
-            t2m = t2m.isel(time=0)
-        value = float(t2m.sel(lat=lat, lon=lon, method="nearest").values)
-        temperaturelist.append(value)
-        # print(f"{year}-{month} mean temperature: {value:.6f} °C")
-        out_paths.append(f"/result/temperature/{month}_temperature.png")
-
-        # humidity
-        T = ds["T2M"] - 273.15
-        Td = ds["T2MDEW"] - 273.15
-        def es(t_c):
-            return 6.112 * np.exp((17.67 * t_c) / (t_c + 243.5))
-        RH2m = 100.0 * (es(Td) / es(T))
-        rh_val = float(RH2m.sel(lat=lat, lon=lon, method="nearest"))
-        humiditylist.append(rh_val)
-        # print(f"{year}-{month} mean humidity: {rh_val:.6f} %")
-        out_paths.append(f"/result/humidity/{month}_humidity.png")
-
-        # windspeed
-        u2, v2 = ds["U2M"].isel(time=0), ds["V2M"].isel(time=0)
-        ws2 = np.sqrt(u2**2 + v2**2)
-        ws_val = float(ws2.sel(lat=lat, lon=lon, method="nearest").values)
-        windspeedlist.append(ws_val)
-        # print(f"{year}-{month} mean windspeed: {ws_val:.6f} m/s")
-        out_paths.append(f"/result/windspeed/{month}_windspeed.png")
-    plot_monthly_variable(month, years, temperaturelist, "temperature", "°C")
-    plot_monthly_variable(month, years, humiditylist, "humidity", "%")
-    plot_monthly_variable(month, years, windspeedlist, "windspeed", "m/s")
+    with metrics.stage("extract"):
+        point = read_point_series("temperature", lat, lon, ["T2M", "T2MDEW", "U2M", "V2M"])
+        for year in years:
+            if point is not None:
+                v = point.get((year, int(month)))
+                if v is None:
+                    temperaturelist.append(np.nan); humiditylist.append(np.nan); windspeedlist.append(np.nan)
+                    continue
+                t_c, td_c = v["T2M"] - 273.15, v["T2MDEW"] - 273.15
+                temperaturelist.append(t_c)
+                humiditylist.append(100.0 * (es(td_c) / es(t_c)))
+                windspeedlist.append(float(np.sqrt(v["U2M"]**2 + v["V2M"]**2)))
+                continue
+            path = month_file("temperature", year, int(month))  # 400 / 401 都可以，見 utils/catalog.py
+            if path is None:
+                temperaturelist.append(np.nan); humiditylist.append(np.nan); windspeedlist.append(np.nan)
+                continue
+            ds = metrics.open_dataset(path, "temperature", xr.open_dataset, engine="netcdf4")
+            # temperature
+            t2m = ds["T2M"].isel(time=0) - 273.15 
+            if "time" in t2m.dims:
+                t2m = t2m.isel(time=0)
+            value = float(t2m.sel(lat=lat, lon=lon, method="nearest").values)
+            temperaturelist.append(value)
+            # print(f"{year}-{month} mean temperature: {value:.6f} °C")
 
-    
+            # humidity
+            T = ds["T2M"] - 273.15
+            Td = ds["T2MDEW"] - 273.15
+            RH2m = 100.0 * (es(Td) / es(T))
+            if "time" in RH2m.dims:
+                RH2m = RH2m.isel(time=0)
+            rh_val = float(RH2m.sel(lat=lat, lon=lon, method="nearest"))
+            humiditylist.append(rh_val)
+            # print(f"{year}-{month} mean humidity: {rh_val:.6f} %")
+
+            # windspeed
+            u2, v2 = ds["U2M"].isel(time=0), ds["V2M"].isel(time=0)
+            ws2 = np.sqrt(u2**2 + v2**2)
+            ws_val = float(ws2.sel(lat=lat, lon=lon, method="nearest").values)
+            windspeedlist.append(ws_val)
+            # print(f"{year}-{month} mean windspeed: {ws_val:.6f} m/s")
+    plot_monthly_variable(month, years, temperaturelist, "temperature", "°C", out_paths["temperature"])
+    plot_monthly_variable(month, years, humiditylist, "humidity", "%", out_paths["humidity"])
+    plot_monthly_variable(month, years, windspeedlist, "windspeed", "m/s", out_paths["windspeed"])
+
+
+def plot_air_quality(month, years, lat, lon, out_path):
     airqualitylist = []
-    for year in years:
-        path_400 = f"./data/air_quality/{year}/{month}/MERRA2_400.tavgM_2d_aer_Nx.{year}{month}.nc4"
-        path_401 = f"./data/air_quality/{year}/{month}/MERRA2_401.tavgM_2d_aer_Nx.{year}{month}.nc4"
-
-        if os.path.exists(path_400):
-            path = path_400
-        elif os.path.exists(path_401):
-            path = path_401
-        else:
-            continue
-
-        ds = xr.open_dataset(
-            path,
-            engine="netcdf4"
-        )
-        pm25 = (ds["BCSMASS"] + ds["OCSMASS"] + 1.375*ds["SO4SMASS"]
-            + ds["DUSMASS25"] + ds["SSSMASS25"]) * 1e9
-
-        if "time" in pm25.dims:
-            pm25 = pm25.isel(time=0)
-
-        value = float(pm25.sel(lat=lat, lon=lon, method="nearest").values)
-        airqualitylist.append(value)
-        print(f"{year}-{month} mean air quality (PM2.5): {value:.6f} μg/m³")
-    plot_monthly_variable(month, years, airqualitylist, "air_quality", "μg/m³")
-    out_paths.append(f"/result/air_quality/{month}_air_quality.png")
-    return out_paths
\ No newline at end of file
+    with metrics.stage("extract"):
+        point = read_point_series("air_quality", lat, lon)
+        for year in years:
+            if point is not None:
+                v = point.get((year, int(month)))
+                airqualitylist.append(np.nan if v is None else
+                                      (v["BCSMASS"] + v["OCSMASS"] + 1.375*v["SO4SMASS"]
+                                       + v["DUSMASS25"] + v["SSSMASS25"]) * 1e9)
+                continue
+            path = month_file("air_quality", year, int(month))  # 400 / 401 都可以，見 utils/catalog.py
+            if path is None:
+                airqualitylist.append(np.nan)
+                continue
+
+            ds = metrics.open_dataset(path, "air_quality", xr.open_dataset, engine="netcdf4")
+            pm25 = (ds["BCSMASS"] + ds["OCSMASS"] + 1.375*ds["SO4SMASS"]
+                + ds["DUSMASS25"] + ds["SSSMASS25"]) * 1e9
+
+            if "time" in pm25.dims:
+                pm25 = pm25.isel(time=0)
+
+            value = float(pm25.sel(lat=lat, lon=lon, method="nearest").values)
+            airqualitylist.append(value)
+            log.debug("monthly PM2.5 read", extra={"month": f"{year}-{month}", "pm25": value})
+    plot_monthly_variable(month, years, airqualitylist, "air_quality", "μg/m³", out_path)
\ No newline at end of file
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed plot cache.
+
+圖檔路徑 = hash(圖的種類, 變數, 月份, 格點, data version)，所以：
+    - 不同地點的並行 request 不會互相覆蓋同一個 png
+    - 同一格點、同一份資料的圖只畫一次，之後直接回傳路徑
+寫檔是 tmp + os.replace（原子），總大小超過 PLOT_CACHE_MAX_BYTES 時刪最久沒用到的。
+總大小用計數器累加（每次畫圖不必掃整個目錄），超過上限或每 PLOT_CACHE_RESCAN_SECONDS 才掃一次；
+PLOT_CACHE_MIN_AGE 秒內寫過 / 用過的圖不刪，剛回傳的 URL 不會馬上 404。
+"""
+import os
+import time
+import hashlib
+import threading
+
+from utils import metrics
+from utils.config import PLOT_CACHE_DIR, PLOT_CACHE_MAX_BYTES, PLOT_CACHE_MIN_AGE, PLOT_CACHE_RESCAN_SECONDS
+from utils.periods import forecast_months
+from utils.store import monthly_data_version
+
+PLOT_SCHEMA = 1   # 圖的樣式改了就 +1，舊檔自然失效
+
+_usage = {"bytes": None, "next_scan": 0.0, "full": False}   # 估計的目錄總大小、下一次最晚何時重掃、上次掃完仍超過上限
+_usage_lock = threading.Lock()
+
+
+def plot_key(*parts):
+    """預報起始月份也算進去（沒設 FORECAST_START 時每個月換一次）"""
+    raw = repr((PLOT_SCHEMA, monthly_data_version(), forecast_months()[0]) + tuple(parts))
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def cached_plot(*parts):
+    """回傳 (path, hit)；hit 時順便更新 mtime，讓 eviction 以最近使用排序"""
+    path = os.path.join(PLOT_CACHE_DIR, f"{plot_key(*parts)}.png")
+    hit = os.path.exists(path)
+    metrics.inc("cache_requests_total", cache="plot", result="hit" if hit else "miss")
+    if hit:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+    return path, hit
+
+
+def url_path(path):
+    """./result/cache/x.png → /result/cache/x.png（main.py 再加上 /static）"""
+    return "/" + os.path.relpath(path, ".").replace(os.sep, "/")
+
+
+def save_figure(plt, path, **savefig_kwargs):
+    """把目前的 figure 原子地寫到 path，關掉 figure，必要時做 eviction"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with metrics.stage("render"):
+        plt.savefig(tmp, format="png", **savefig_kwargs)
+        plt.close()
+    os.replace(tmp, path)
+    _account(os.path.getsize(path))
+    return path
+
+
+def _account(size):
+    """累加剛寫的大小；估計超過上限（或太久沒重掃）才真的掃目錄"""
+    with _usage_lock:
+        if _usage["bytes"] is not None:
+            _usage["bytes"] += size
+        due = (_usage["bytes"] is None or time.monotonic() >= _usage["next_scan"]
+               or (_usage["bytes"] > PLOT_CACHE_MAX_BYTES and not _usage["full"]))
+    if due:
+        evict_to_limit()
+
+
+def evict_to_limit(max_bytes=PLOT_CACHE_MAX_BYTES, min_age=PLOT_CACHE_MIN_AGE):
+    """總大小超過上限時，從最久沒用到的開始刪（min_age 秒內的不刪）；順便校正計數器"""
+    now = time.time()
+    try:
+        entries = [e for e in os.scandir(PLOT_CACHE_DIR) if e.name.endswith(".png")]
+    except FileNotFoundError:
+        entries = []
+    stats = []
+    for e in entries:
+        try:
+            st = e.stat()
+        except OSError:
+            continue
+        stats.append((st.st_mtime, st.st_size, e.path))
+    total = sum(size for _, size, _ in stats)
+    removed = 0
+    for mtime, size, path in sorted(stats):
+        if total <= max_bytes or now - mtime < min_age:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    with _usage_lock:
+        # 剩下的都太新刪不掉時，等它們過了 min_age 再掃，不要每畫一張就掃一次
+        _usage["bytes"], _usage["full"] = total, total > max_bytes
+        _usage["next_scan"] = time.monotonic() + (min_age if _usage["full"] else PLOT_CACHE_RESCAN_SECONDS)
+    return removed
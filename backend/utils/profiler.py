@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+On-demand sampling profiler for a single request.
+
+admin 在 request 上加 `X-Profile: 1`（或 `?profile=1`）並帶 `X-Admin-Token`，
+main.py 就把這個 request 標起來；utils/workers.py 看到標記時，worker 裡的工作改用
+sample() 執行：另一條 thread 每 PROFILE_INTERVAL_MS 抓一次工作 thread 的 call stack。
+結果存成 PROFILE_DIR/<id>.json，response header 帶 X-Profile-Id，之後用
+    GET /api/admin/profiles/<id>?format=tree|collapsed|json
+看 call tree，或拿 collapsed stacks 給 flamegraph.pl / speedscope 畫 flame graph。
+
+ADMIN_TOKEN 沒設時整個功能關閉。
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import secrets
+import threading
+import contextvars
+from collections import Counter
+
+from utils.config import ADMIN_TOKEN, PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_KEEP
+
+# 目前 request 的 Profile（None = 不 profile）；middleware 設定，workers.py 讀
+current = contextvars.ContextVar("profile", default=None)
+
+_ID_CHARS = set("0123456789abcdef-")
+_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_admin(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode())
+
+
+def new_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(4)
+
+
+# ==============================
+# Sampling (runs in the worker process)
+# ==============================
+def _frame_name(code):
+    path = code.co_filename
+    for prefix in (_BACKEND + os.sep, sys.prefix + os.sep):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+            break
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def sample(fn, *args):
+    """
+    執行 fn(*args) 並取樣它所在 thread 的 call stack；回傳 (結果, profile dict)。
+    取樣是 wall clock：卡在 I/O 或 C extension 裡的時間也會算到當下的 Python frame。
+    """
+    target = threading.get_ident()
+    interval = max(PROFILE_INTERVAL_MS, 1) / 1000.0
+    stacks = Counter()
+    stop = threading.Event()
+
+    def loop():
+        names = {}
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            # 走到 sample() 自己的 frame 就停：外面的 worker loop / thread bootstrap 不記
+            while frame is not None and frame.f_code is not _SAMPLE_CODE:
+                code = frame.f_code
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = _frame_name(code)
+                stack.append(name)
+                frame = frame.f_back
+            if stack:
+                stacks[";".join(reversed(stack))] += 1
+
+    sampler = threading.Thread(target=loop, name="profiler", daemon=True)
+    t0 = time.perf_counter()
+    sampler.start()
+    try:
+        result = fn(*args)
+    finally:
+        stop.set()
+        sampler.join()
+    return result, {"pid": os.getpid(), "fn": getattr(fn, "__qualname__", repr(fn)),
+                    "wall_seconds": time.perf_counter() - t0,
+                    "interval_ms": PROFILE_INTERVAL_MS, "stacks": dict(stacks)}
+
+
+_SAMPLE_CODE = sample.__code__
+
+
+# ==============================
+# Per-request collection (server process)
+# ==============================
+class Profile:
+    """一個被標記的 request；worker 回來的 profile 依序 add 進來"""
+
+    def __init__(self, request_line):
+        self.id = new_id()
+        self.request = request_line
+        self.jobs = []
+
+    def add(self, job):
+        self.jobs.append(job)
+
+    def save(self, status, seconds):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        doc = {"id": self.id, "request": self.request, "status": status,
+               "seconds": seconds, "created": time.time(), "jobs": self.jobs}
+        path = os.path.join(PROFILE_DIR, f"{self.id}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(doc, f)
+        os.replace(path + ".tmp", path)
+        _prune()
+        return path
+
+
+def _prune():
+    """只留最新的 PROFILE_KEEP 份"""
+    files = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".json"))
+    for f in files[:max(len(files) - PROFILE_KEEP, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, f))
+        except OSError:
+            pass
+
+
+def load(profile_id):
+    """讀存下來的 profile；id 不合法或不存在回傳 None"""
+    if not profile_id or not set(profile_id) <= _ID_CHARS:
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for f in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if f.endswith(".json"):
+            doc = load(f[:-5])
+            if doc is not None:
+                out.append({k: doc[k] for k in ("id", "request", "status", "seconds", "created")})
+    return out
+
+
+# ==============================
+# Reports
+# ==============================
+def merged_stacks(doc):
+    """所有 job 的 stacks 合在一起（同一個 request 平行跑的 job 各自是一棵樹的根）"""
+    total = Counter()
+    for job in doc["jobs"]:
+        total.update(job["stacks"])
+    return total
+
+
+def collapsed(doc):
+    """Brendan Gregg 的 collapsed stack 格式（flamegraph.pl / speedscope 直接吃）"""
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(merged_stacks(doc).items()))
+
+
+def call_tree(doc, min_percent=1.0, top=25):
+    """文字版摘要：self time 最多的函式 + 縮排的 call tree（比 min_percent 少的分支省略）"""
+    stacks = merged_stacks(doc)
+    n = sum(stacks.values())
+    lines = [f"profile {doc['id']}  {doc['request']}  status={doc['status']}  "
+             f"{doc['seconds']:.3f}s  samples={n}"]
+    for job in doc["jobs"]:
+        lines.append(f"  job {job['fn']} pid={job['pid']} wall={job['wall_seconds']:.3f}s "
+                     f"interval={job['interval_ms']}ms samples={sum(job['stacks'].values())}")
+    if not n:
+        return "\n".join(lines + ["(no samples — the request finished faster than one interval)"]) + "\n"
+
+    own = Counter()
+    tree = {}
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        node = tree
+        for name in frames:
+            entry = node.setdefault(name, [0, {}])
+            entry[0] += count
+            node = entry[1]
+
+    lines += ["", f"top {top} by self samples:"]
+    for name, count in own.most_common(top):
+        lines.append(f"  {100.0 * count / n:6.1f}%  {count:6d}  {name}")
+
+    lines += ["", f"call tree (total %, branches < {min_percent}% hidden):"]
+
+    def walk(node, depth):
+        for name, (count, children) in sorted(node.items(), key=lambda kv: -kv[1][0]):
+            pct = 100.0 * count / n
+            if pct < min_percent:
+                continue
+            lines.append(f"  {pct:6.1f}%  {'  ' * depth}{name}")
+            walk(children, depth + 1)
+    walk(tree, 0)
+    return "\n".join(lines) + "\n"
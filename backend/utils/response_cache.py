@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache for the forecast / plot endpoints.
+
+/api/weather、/api/weather/month、/api/plot 的結果只取決於：
+    各資料網格上最近的格點（cell）、日期或月份、data version（資料檔 + point store + anomaly cube + 模型）
+所以 key 用這些組成，地圖上同一格裡的點擊都是 cache hit。快取的是「與座標無關」的計算結果，
+response 本身（回傳使用者給的 lat/lon）每次重新組，ETag = hash(key, lat, lon)，
+If-None-Match 對上時 handler 連 cache 都不用查就回 304。
+
+兩層：
+    local   這個 process 的 LRUCache（RESPONSE_CACHE_SIZE / RESPONSE_CACHE_TTL）
+    shared  選用，多個 uvicorn worker / 多台機器共用（RESPONSE_CACHE_SHARED）：
+                dir:/path/to/dir     共用目錄（NFS、k8s volume）
+                redis://host:6379/0  需要 redis 套件
+            或用 set_shared_tier(obj) 換成任何有 get(key) / set(key, bytes, ttl) 的物件
+
+    key = await asyncio.to_thread(response_cache.request_key, "weather", lat, lon, WEATHER_PRODUCTS, day)
+    value, status = await response_cache.get_or_compute(key, compute)   # compute 是 async、回傳 JSON-able
+
+快取沒命中時是 single-flight：同一個 key 正在算的時候，後到的 request 等同一個 task，
+不會再各自佔一個 lane 名額重算（熱門地點被分享、同一秒湧進幾十個相同 request 時只算一次）。
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+
+from utils import catalog, metrics, snapshots
+from utils.cache import LRUCache
+from utils.periods import forecast_months
+from utils.config import (DATA_VERSION_CHECK_SECONDS, RESPONSE_CACHE_SHARED, RESPONSE_CACHE_SIZE,
+                          RESPONSE_CACHE_TTL, RESPONSE_MAX_AGE)
+
+log = logging.getLogger(__name__)
+
+RESPONSE_SCHEMA = 1   # 回傳格式或計算方式改了就 +1，舊的 key / ETag 自然失效
+
+MONTHLY_PRODUCTS = ("precipitation", "temperature", "air_quality")
+DAILY_PRODUCTS = ("rain_daily", "temp_daily", "aer_daily")
+
+_local = LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, name="response")
+_state = {"checked": 0.0, "version": None, "grids": {}}   # grids: (data root, product) -> 網格字串
+_state_lock = threading.Lock()
+_parsed = {}
+_inflight = {}   # key -> asyncio.Task（這個 process 裡正在算的 key）
+
+
+# ==============================
+# Keys
+# ==============================
+def _store_fingerprint():
+    """./data/store 底下所有上線中的 meta.json（point store、anomaly cube）和各 kind 模型目錄的 mtime"""
+    from utils.models import MODEL_ROOT, model_versions
+    from utils.store import STORE_ROOT
+    parts = []
+    for dirpath, dirnames, files in os.walk(STORE_ROOT):
+        dirnames[:] = [d for d in dirnames if not d.endswith((".tmp", ".old"))]   # staged / 換下來的不算
+        if "meta.json" in files:
+            st = os.stat(os.path.join(dirpath, "meta.json"))
+            parts.append(f"{dirpath}|{st.st_mtime_ns}")
+    for kind, version in model_versions().items():   # 含 FORECAST_BACKEND：換 backend 就是不同的結果
+        parts.append(f"{kind}={version}")
+        model_dir = os.path.join(MODEL_ROOT, version, kind)
+        if os.path.isdir(model_dir):
+            parts.append(f"{model_dir}|{os.stat(model_dir).st_mtime_ns}")
+    return "\n".join(sorted(parts))
+
+
+def data_version():
+    """
+    所有會影響結果的資料指紋；最多快取 DATA_VERSION_CHECK_SECONDS 秒（同 monthly_data_version）。
+    request pin 住 snapshot 時就是 snapshot id（snapshot 不會變，不用 stat 任何東西）。
+    """
+    snapshot_id = snapshots.pinned.get()
+    if snapshot_id:
+        return hashlib.sha1(repr((RESPONSE_SCHEMA, snapshot_id)).encode()).hexdigest()[:12]
+    now = time.monotonic()
+    if _state["version"] is not None and now - _state["checked"] < DATA_VERSION_CHECK_SECONDS:
+        return _state["version"]
+    from utils.store import monthly_data_version   # 順便 refresh 月資料的 catalog
+    with _state_lock:
+        catalog.refresh(products=list(DAILY_PRODUCTS))
+        raw = repr((RESPONSE_SCHEMA, monthly_data_version(), catalog.fingerprint(DAILY_PRODUCTS),
+                    _store_fingerprint()))
+        version = hashlib.sha1(raw.encode()).hexdigest()[:12]
+        if version != _state["version"]:
+            _state["grids"] = {}
+        _state.update(checked=now, version=version)
+    return version
+
+
+def _grid(spec):
+    """catalog 的網格字串 "nlatxnlon@lat0,lon0/dlat,dlon" → utils.grids.Grid"""
+    grid = _parsed.get(spec)
+    if grid is None:
+        from utils.grids import Grid
+        shape, rest = spec.split("@")
+        origin, step = rest.split("/")
+        nlat, nlon = (int(v) for v in shape.split("x"))
+        lat0, lon0 = (float(v) for v in origin.split(","))
+        dlat, dlon = (float(v) for v in step.split(","))
+        grid = _parsed[spec] = Grid.regular(lat0, dlat, nlat, lon0, dlon, nlon)
+    return grid
+
+
+def cells(lat, lon, products):
+    """每個 product、每種網格上最近格點的 index；和 loader 用 grid_of(ds).nearest 選到的是同一格"""
+    out = []
+    root = snapshots.data_root()
+    for product in products:
+        specs = _state["grids"].get((root, product))
+        if specs is None:
+            specs = _state["grids"][(root, product)] = catalog.grids(product)
+        out.append((product, tuple(_grid(spec).nearest(lat, lon) for spec in specs)))
+    return tuple(out)
+
+
+def request_key(kind, lat, lon, products, *params):
+    """
+    (kind, data version, 預報起始月份, cells, params) 的 hash；會讀 catalog，async handler 裡用 asyncio.to_thread 呼叫。
+    沒設 FORECAST_START 時預報視窗跟著日曆月移動，資料沒變、換月之後也不能回舊的結果
+    """
+    raw = repr((kind, data_version(), forecast_months()[0], cells(lat, lon, products)) + params)
+    return f"{kind}:{hashlib.sha1(raw.encode()).hexdigest()[:24]}"
+
+
+def etag(key, *echo):
+    """response 還會帶上 echo（使用者給的 lat/lon 等），所以一起 hash"""
+    return '"' + hashlib.sha1(repr((key,) + echo).encode()).hexdigest()[:24] + '"'
+
+
+def not_modified(if_none_match, tag):
+    """If-None-Match（可能是逗號分隔的多個、或 W/ 弱比對）是否命中"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(t.strip().removeprefix("W/") == tag for t in if_none_match.split(","))
+
+
+def cache_headers(tag):
+    return {"ETag": tag, "Cache-Control": f"public, max-age={RESPONSE_MAX_AGE}"}
+
+
+# ==============================
+# Tiers
+# ==============================
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, "item") else str(o)).encode()
+
+
+class DirTier:
+    """共用目錄：一個 key 一個檔，tmp + os.replace 寫入；過期看 mtime"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key.replace(":", "_") + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if RESPONSE_CACHE_TTL > 0 and time.time() - os.path.getmtime(path) > RESPONSE_CACHE_TTL:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, data, ttl):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class RedisTier:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as ex:
+            raise RuntimeError("RESPONSE_CACHE_SHARED=redis://... requires the redis package") from ex
+        self._r = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._r.get(f"weatherlens:{key}")
+
+    def set(self, key, data, ttl):
+        self._r.set(f"weatherlens:{key}", data, ex=int(ttl) if ttl and ttl > 0 else None)
+
+
+def _make_shared(spec):
+    if not spec:
+        return None
+    if spec.startswith("dir:"):
+        return DirTier(spec[4:])
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisTier(spec)
+    raise ValueError(f"Unknown RESPONSE_CACHE_SHARED: {spec!r} (use dir:/path or redis://...)")
+
+
+_shared = _make_shared(RESPONSE_CACHE_SHARED)
+
+
+def set_shared_tier(tier):
+    """換掉 shared tier（None = 只用 local）"""
+    global _shared
+    _shared = tier
+
+
+def _shared_get(key):
+    try:
+        data = _shared.get(key)
+    except Exception:
+        log.warning("⚠️ shared response cache get failed", exc_info=True)
+        data = None
+    metrics.inc("cache_requests_total", cache="response_shared", result="miss" if data is None else "hit")
+    return None if data is None else json.loads(data)
+
+
+def _shared_set(key, value):
+    try:
+        _shared.set(key, _dumps(value), RESPONSE_CACHE_TTL)
+    except Exception:
+        log.warning("⚠️ shared response cache set failed", exc_info=True)
+
+
+async def _fill(key, compute):
+    value = json.loads(_dumps(await compute()))   # local 和 shared 存的是同一份 JSON 形狀
+    _local.set(key, value)
+    if _shared is not None:
+        await asyncio.to_thread(_shared_set, key, value)
+    return value
+
+
+def _landed(key, task):
+    _inflight.pop(key, None)
+    if not task.cancelled():
+        task.exception()   # 等的人都斷線了也不要留下 "exception was never retrieved"
+
+
+async def get_or_compute(key, compute, valid=None):
+    """
+    回傳 (value, status)，status 是 "hit" / "miss" / "coalesced"（等了別人正在算的同一個 key）。
+    local → shared → compute()；valid(value) 為 False 的快取值當作 miss
+    （例如結果裡的圖檔已經被 plot cache 的 eviction 刪掉）。
+    例外不快取，但會傳給所有在等的 request。第一個 request 斷線時 task 照樣算完（shield）。
+    """
+    value = _local.get(key)
+    if value is not None and (valid is None or valid(value)):
+        return value, "hit"
+    task = _inflight.get(key)
+    if task is not None:
+        metrics.inc("coalesced_requests_total", endpoint=key.partition(":")[0])
+        return await asyncio.shield(task), "coalesced"
+    if _shared is not None:
+        value = await asyncio.to_thread(_shared_get, key)
+        if value is not None and (valid is None or valid(value)):
+            _local.set(key, value)
+            return value, "hit"
+        task = _inflight.get(key)   # 查 shared 的時候可能已經有人開始算
+        if task is not None:
+            metrics.inc("coalesced_requests_total", endpoint=key.partition(":")[0])
+            return await asyncio.shield(task), "coalesced"
+    task = _inflight[key] = asyncio.ensure_future(_fill(key, compute))
+    task.add_done_callback(lambda t: _landed(key, t))
+    return await asyncio.shield(task), "miss"
+
+
+def stats():
+    return {"local": _local.stats(), "shared": type(_shared).__name__ if _shared is not None else None,
+            "inflight": len(_inflight)}
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned, immutable data snapshots for serving.
+
+沒有 snapshot 時，request 讀的是 ./data 當下的樣子：下載、store 換版、重訓進行到一半時，
+同一個 request 可能一半讀舊的、一半讀新的。snapshot 是某一刻 ./data 的凍結版本：
+
+    ./data/snapshots/<id>/                granule、point store、anomaly cube、當時 version 的模型（hardlink）
+    ./data/snapshots/<id>/catalog.sqlite  當時 catalog 的複本（裡面是相對路徑，直接可用）
+    ./data/snapshots/<id>/manifest.json
+    ./data/snapshots/CURRENT              上線中的 <id>（tmp + os.replace 寫入，切換是原子的）
+
+writer（downloader、ingest、store / cube build、train_models）都是寫新檔再 os.replace，
+不會原地改寫，所以 hardlink 進 snapshot 的檔案之後不會再變，也不多佔空間。
+create 不要和 utils/update.py 同時跑（update 在 snapshot 模式下跑完會自己 create + activate）。
+
+服務端：main.py 在每個 request 開始時 pin 住當下的 CURRENT（contextvar），這個 request 在
+worker / thread 裡的讀取（catalog、store、cube、模型）都經過 data_root() 指到那個 snapshot。
+切換後新的 request 讀新的 snapshot，進行中的照樣讀完舊的。舊 snapshot 等到沒有 request 在用、
+而且換下來超過 SNAPSHOT_DRAIN_SECONDS 才由 gc() 刪掉。從沒 activate 過時一切照舊讀 ./data。
+
+    python -m utils.snapshots create --activate     # 凍結目前的 ./data 並上線
+    python -m utils.snapshots list
+    python -m utils.snapshots activate <id>         # 切換 / rollback
+    python -m utils.snapshots gc
+
+服務中切換：POST /api/admin/snapshots/activate（X-Admin-Token）；用 CLI activate 的話，對 server
+process 送 SIGUSR1 就立刻生效，不然最多等 DATA_VERSION_CHECK_SECONDS。
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+
+from utils.config import DATA_VERSION_CHECK_SECONDS, SNAPSHOT_DRAIN_SECONDS, SNAPSHOT_KEEP
+
+DATA_ROOT = "./data/"
+SNAPSHOT_ROOT = os.path.join(DATA_ROOT, "snapshots")
+CURRENT_FILE = os.path.join(SNAPSHOT_ROOT, "CURRENT")
+
+# 目前 request pin 住的 snapshot id（None = 直接讀 ./data）；main.py 的 middleware 設定，workers.py 帶進 worker
+pinned = contextvars.ContextVar("snapshot", default=None)
+
+_current = {"checked": 0.0, "id": None}
+_inflight = Counter()   # snapshot id -> 這個 process 裡還沒做完、pin 著它的 request 數
+_lock = threading.Lock()
+
+
+def snapshot_dir(snapshot_id):
+    return os.path.join(SNAPSHOT_ROOT, snapshot_id)
+
+
+def data_root():
+    """讀資料的根目錄：pin 住的 snapshot，否則 ./data"""
+    snapshot_id = pinned.get()
+    return os.path.join(snapshot_dir(snapshot_id), "") if snapshot_id else DATA_ROOT
+
+
+# ==============================
+# Serving side
+# ==============================
+def current(force=False):
+    """CURRENT 裡的 snapshot id（沒有 snapshot = None）；最多快取 DATA_VERSION_CHECK_SECONDS 秒"""
+    now = time.monotonic()
+    if not force and now - _current["checked"] < DATA_VERSION_CHECK_SECONDS:
+        return _current["id"]
+    try:
+        with open(CURRENT_FILE, encoding="utf-8") as f:
+            snapshot_id = f.read().strip() or None
+    except OSError:
+        snapshot_id = None
+    if snapshot_id and not os.path.isdir(snapshot_dir(snapshot_id)):
+        snapshot_id = None
+    _current.update(checked=now, id=snapshot_id)
+    return snapshot_id
+
+
+@contextlib.contextmanager
+def pin(snapshot_id):
+    """這段期間 data_root() 指向 snapshot_id（worker 裡包住一個 job）"""
+    token = pinned.set(snapshot_id)
+    try:
+        yield snapshot_id
+    finally:
+        pinned.reset(token)
+
+
+@contextlib.contextmanager
+def hold(snapshot_id):
+    """計入 in-flight（gc 不刪還有人在用的）"""
+    with _lock:
+        _inflight[snapshot_id] += 1
+    try:
+        yield snapshot_id
+    finally:
+        with _lock:
+            _inflight[snapshot_id] -= 1
+            if _inflight[snapshot_id] <= 0:
+                del _inflight[snapshot_id]
+
+
+@contextlib.contextmanager
+def request_pin():
+    """
+    main.py 的 middleware：整個 request 用開始時的 CURRENT，並計入 in-flight。
+    串流的 response 在 middleware 返回時 body 還沒送，由 workers.Lane.stream 再 hold 到送完。
+    """
+    snapshot_id = current()
+    with hold(snapshot_id), pin(snapshot_id):
+        yield snapshot_id
+
+
+def inflight():
+    with _lock:
+        return {k: v for k, v in _inflight.items() if k}
+
+
+# ==============================
+# Create / activate / gc
+# ==============================
+def _link(src, dst):
+    """hardlink（同一個檔案系統），不行就複製"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _link_tree(src_root, dst_root):
+    """整個目錄 hardlink 過去；staged / 換下來的目錄（.tmp、.old）和寫到一半的 .tmp 檔跳過"""
+    n = 0
+    for dirpath, dirnames, files in os.walk(src_root):
+        dirnames[:] = [d for d in dirnames if not d.endswith((".tmp", ".old"))]
+        for fname in files:
+            if fname.endswith(".tmp"):
+                continue
+            src = os.path.join(dirpath, fname)
+            _link(src, os.path.join(dst_root, os.path.relpath(src, src_root)))
+            n += 1
+    return n
+
+
+def _content_digest(versions):
+    """./data 目前內容的指紋（granule、store / cube 的 meta、模型）；和 CURRENT 一樣時 create 不必再做一份"""
+    from utils import catalog
+    from utils.models import MODEL_ROOT
+    from utils.store import STORE_ROOT
+    h = hashlib.sha1(repr((catalog.fingerprint(data_root=DATA_ROOT), sorted(versions.items()))).encode())
+    for dirpath, dirnames, files in os.walk(STORE_ROOT):
+        dirnames[:] = sorted(d for d in dirnames if not d.endswith((".tmp", ".old")))
+        if "meta.json" in files:
+            with open(os.path.join(dirpath, "meta.json"), "rb") as f:
+                h.update(f.read())
+    for kind, version in sorted(versions.items()):
+        kind_dir = os.path.join(MODEL_ROOT, version, kind)
+        if os.path.isdir(kind_dir):
+            h.update(f"{kind_dir}|{os.stat(kind_dir).st_mtime_ns}".encode())
+    return h.hexdigest()[:12]
+
+
+def manifest(snapshot_id):
+    try:
+        with open(os.path.join(snapshot_dir(snapshot_id), "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_snapshots():
+    """[manifest + current / inflight]，新的在前"""
+    if not os.path.isdir(SNAPSHOT_ROOT):
+        return []
+    cur, busy = current(force=True), inflight()
+    out = []
+    for name in sorted(os.listdir(SNAPSHOT_ROOT), reverse=True):
+        meta = manifest(name) if not name.endswith(".tmp") else None
+        if meta is not None:
+            out.append(dict(meta, current=name == cur, inflight=busy.get(name, 0)))
+    return out
+
+
+def create(activate_it=False):
+    """
+    凍結目前的 ./data → snapshot id。內容和 CURRENT 完全一樣時不另建，直接回傳 CURRENT。
+    模型只帶當下 version 的（舊 version 的 artifact 用不到）。
+    """
+    from utils import catalog
+    from utils.models import MODEL_ROOT, model_versions
+    from utils.store import STORE_ROOT, reset_data_version
+
+    t0 = time.perf_counter()
+    catalog.refresh(DATA_ROOT)
+    reset_data_version()
+    versions = model_versions()
+    digest = _content_digest(versions)
+    cur = current(force=True)
+    if cur and (manifest(cur) or {}).get("content") == digest:
+        print(f"✅ ./data unchanged since snapshot {cur}")
+        return cur
+
+    snapshot_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{digest[:8]}"
+    tmp_dir = snapshot_dir(snapshot_id) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # catalog：sqlite backup 拿到一致的複本，再 hardlink 裡面列的每個 granule
+    src = sqlite3.connect(catalog.catalog_path(DATA_ROOT), timeout=30)
+    dst = sqlite3.connect(catalog.catalog_path(tmp_dir))
+    try:
+        src.backup(dst)
+        gone = []
+        for (rel,) in dst.execute("SELECT path FROM granules").fetchall():
+            try:
+                _link(os.path.join(DATA_ROOT, rel), os.path.join(tmp_dir, rel))
+            except FileNotFoundError:
+                gone.append((rel,))   # refresh 之後才刪掉的檔案
+        with dst:
+            dst.executemany("DELETE FROM granules WHERE path = ?", gone)
+        granules = dst.execute("SELECT COUNT(*) FROM granules").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+    store_files = _link_tree(STORE_ROOT, os.path.join(tmp_dir, "store")) if os.path.isdir(STORE_ROOT) else 0
+    model_files = sum(_link_tree(os.path.join(MODEL_ROOT, version, kind), os.path.join(tmp_dir, "models", version, kind))
+                      for kind, version in versions.items())
+
+    meta = {
+        "id": snapshot_id,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "content": digest,
+        "granules": granules,
+        "store_files": store_files,
+        "model_files": model_files,
+        "model_versions": versions,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_dir, snapshot_dir(snapshot_id))
+    print(f"📸 snapshot {snapshot_id}: {granules} granules, {store_files} store files, {model_files} models "
+          f"({time.perf_counter() - t0:.1f}s)")
+    if activate_it:
+        activate(snapshot_id)
+    return snapshot_id
+
+
+def activate(snapshot_id):
+    """CURRENT 改成 snapshot_id（原子的）；之後新的 request 都讀它"""
+    if manifest(snapshot_id) is None:
+        raise ValueError(f"unknown snapshot: {snapshot_id!r}")
+    tmp = f"{CURRENT_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(snapshot_id + "\n")
+    os.replace(tmp, CURRENT_FILE)
+    current(force=True)
+    print(f"✅ serving snapshot {snapshot_id}")
+    return snapshot_id
+
+
+def gc(drain=SNAPSHOT_DRAIN_SECONDS, keep=SNAPSHOT_KEEP):
+    """
+    刪掉舊 snapshot：不是 CURRENT、這個 process 裡沒有 request pin 著，而且 CURRENT 換掉已超過 drain 秒
+    （其他 process 的 request 也做完了）。CURRENT 以外最新的 keep 個留著給 rollback。回傳刪了哪些。
+    """
+    if not os.path.isdir(SNAPSHOT_ROOT):
+        return []
+    cur = current(force=True)
+    try:
+        switched = os.path.getmtime(CURRENT_FILE)
+    except OSError:
+        switched = 0.0
+    if time.time() - switched < drain:
+        return []
+    busy = inflight()
+    names = sorted(os.listdir(SNAPSHOT_ROOT), reverse=True)
+    old = [n for n in names if n != cur and os.path.isdir(snapshot_dir(n)) and not n.endswith(".tmp")]
+    removed = []
+    for name in old[keep:] + [n for n in names if n.endswith(".tmp")]:
+        if busy.get(name):
+            continue
+        shutil.rmtree(snapshot_dir(name), ignore_errors=True)
+        removed.append(name)
+    return removed
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Immutable data snapshots for serving")
+    sub = p.add_subparsers(dest="cmd")
+    c = sub.add_parser("create", help="freeze the current ./data")
+    c.add_argument("--activate", action="store_true", help="serve it right away")
+    a = sub.add_parser("activate", help="switch serving to a snapshot (also used for rollback)")
+    a.add_argument("id")
+    sub.add_parser("list")
+    g = sub.add_parser("gc", help="remove drained old snapshots")
+    g.add_argument("--drain", type=float, default=SNAPSHOT_DRAIN_SECONDS, help="seconds since the last switch")
+    g.add_argument("--keep", type=int, default=SNAPSHOT_KEEP, help="old snapshots kept for rollback")
+    args = p.parse_args()
+
+    if args.cmd == "create":
+        create(activate_it=args.activate)
+    elif args.cmd == "activate":
+        activate(args.id)
+    elif args.cmd == "list":
+        for s in list_snapshots():
+            flag = "*" if s["current"] else " "
+            print(f"{flag} {s['id']}  {s['created']}  {s['granules']} granules  {s['model_files']} models")
+    elif args.cmd == "gc":
+        for name in gc(args.drain, args.keep):
+            print(f"🧹 removed snapshot {name}")
+    else:
+        p.print_help()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+"""
+Monthly point store.
+
+把 ./data/{precipitation,temperature,air_quality}/<year>/<month> 的月檔一次性重新打包成
+memory-mapped 的 .npy 陣列。之後查單點時每個變數只要一次連續讀取，不必再開幾十個
+NetCDF/HDF5、重新解析 HDF5 metadata。
+
+Layout（每個 product 一個資料夾）：
+    ./data/store/<product>/meta.json     times (YYYY-MM)、units、來源檔
+    ./data/store/<product>/lat.npy       緯度 (nlat,)
+    ./data/store/<product>/lon.npy       經度 (nlon,)
+    ./data/store/<product>/<VAR>.npy     float32, shape (nlat, nlon, ntime)
+
+時間放在最內層：arr[li, xi, :] 就是一段連續的 bytes。
+
+Build（在 backend/ 底下執行）：
+    python -m utils.store build                         # 已有 store 時只讀新的 / 換過的月檔
+    python -m utils.store build --product temperature --year-from 2020 --year-to 2025
+    python -m utils.store build --full                  # 全部重讀
+新月份進來時通常不直接跑這個，而是 python -m utils.update（store、模型、anomaly cube 一起更新）。
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from datetime import datetime
+
+import netCDF4 as nc
+import numpy as np
+
+from utils import catalog, metrics
+from utils.config import DATA_VERSION_CHECK_SECONDS
+from utils.grids import bilinear_weighted, grid_from_coords
+from utils.snapshots import data_root
+
+BASE_DIR = "./data/"
+STORE_ROOT = os.path.join(BASE_DIR, "store")
+BAND_ROWS = 256  # 一次處理幾條緯度列（控制 build 時的記憶體）
+
+PRODUCTS = {
+    # IMERG monthly (HDF5, Grid group, 維度順序 time/lon/lat)
+    "precipitation": {
+        "root": os.path.join(BASE_DIR, "precipitation"),
+        "exts": (".hdf5", ".h5", ".nc4", ".nc"),
+        "group": "Grid",
+        "vars": ["precipitation", "precipitationQualityIndex",
+                 "gaugeRelativeWeighting", "randomError"],
+    },
+    # MERRA-2 tavgM_2d_slv_Nx
+    "temperature": {
+        "root": os.path.join(BASE_DIR, "temperature"),
+        "exts": (".nc4", ".nc"),
+        "group": None,
+        "vars": ["T2M", "T2MDEW", "QV2M", "SLP", "PS", "U2M", "V2M", "U10M", "V10M"],
+    },
+    # MERRA-2 tavgM_2d_aer_Nx
+    "air_quality": {
+        "root": os.path.join(BASE_DIR, "air_quality"),
+        "exts": (".nc4", ".nc"),
+        "group": None,
+        "vars": ["BCSMASS", "OCSMASS", "SO4SMASS", "DUSMASS25", "SSSMASS25"],
+    },
+}
+
+
+# ==============================
+# Build
+# ==============================
+def find_monthly_files(product, year_from=0, year_to=9999):
+    """[(datetime, path)]，每個月一個檔（查 utils/catalog.py；同月有 MERRA2_400/401 時取 400）"""
+    return catalog.monthly_files(product, year_from, year_to)
+
+
+def month_file(product, year, month):
+    """該月的檔案；沒有就回傳 None"""
+    return catalog.month_file(product, year, month)
+
+
+def _group(ds, group):
+    return ds.groups[group] if group else ds
+
+
+def _read_rows(ds, group, name, rows):
+    """讀一段緯度列，統一回傳 (rows, nlon) 的 float32，缺值為 NaN"""
+    var = _group(ds, group).variables.get(name)
+    if var is None:
+        return None
+    if var.ndim == 3:
+        if "lat" in var.dimensions[1].lower():
+            data = var[0, rows, :]
+        else:
+            data = var[0, :, rows].T   # IMERG: (time, lon, lat)
+    elif var.ndim == 2:
+        data = var[rows, :]
+    else:
+        return None
+    return np.ma.filled(np.ma.asarray(data).astype(np.float32), np.nan)
+
+
+def _stamp(path):
+    """[檔名, size, mtime_ns]：月檔換掉或重新下載時會變"""
+    st = os.stat(path)
+    return [os.path.basename(path), st.st_size, st.st_mtime_ns]
+
+
+def _read_meta(store_dir):
+    try:
+        with open(os.path.join(store_dir, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def pending_months(product, year_from=0, year_to=9999):
+    """store 和月檔對不上的月份 ["YYYY-MM"]（新的、換過的、不見的）；沒有 store 時回傳 None"""
+    meta = _read_meta(os.path.join(STORE_ROOT, product))
+    if meta is None:
+        return None
+    have = dict(zip(meta["times"], map(tuple, meta.get("stamps") or [()] * len(meta["times"]))))
+    now = {d.strftime("%Y-%m"): tuple(_stamp(p)) for d, p in find_monthly_files(product, year_from, year_to)}
+    return sorted(t for t in set(have) | set(now) if have.get(t) != now.get(t))
+
+
+def build_product(product, year_from=0, year_to=9999, out_root=STORE_ROOT, swap=True, full=False):
+    """
+    增量 build：meta.json 記著每個月檔的 stamp，檔案沒變的月份從現有 store 整段複製（memmap 讀），
+    只有新的 / 換過的月檔才開原始檔。全部一樣時什麼都不做，回傳 None。
+    swap=False 時新 store 留在 <product>.tmp（staged），等 swap_product() 再換上：
+    utils/update.py 先用 staged store 訓練模型，模型好了才讓服務看到新資料。
+    """
+    spec = PRODUCTS[product]
+    files = find_monthly_files(product, year_from, year_to)
+    if not files:
+        print(f"⚠️ {product}: no monthly files under {spec['root']}")
+        return None
+
+    out_dir = os.path.join(out_root, product)
+    tmp_dir = out_dir + ".tmp"
+    times = [d.strftime("%Y-%m") for d, _ in files]
+    stamps = [_stamp(p) for _, p in files]
+
+    old = None if full else _read_meta(out_dir)
+    reuse = {}   # 新 store 的 t -> 舊 store 的 t
+    if old and old.get("stamps"):
+        old_col = {(tm, tuple(st)): i for i, (tm, st) in enumerate(zip(old["times"], old["stamps"]))}
+        reuse = {t: old_col[key] for t, key in enumerate(zip(times, map(tuple, stamps))) if key in old_col}
+        if len(reuse) == len(files) == len(old["times"]):
+            print(f"✅ {product}: up to date ({len(files)} months)")
+            return None
+    fresh = [t for t in range(len(files)) if t not in reuse]
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    handles = {}
+    arrays = {}
+    old_arrays = {}
+    try:
+        for t in fresh:
+            handles[t] = nc.Dataset(files[t][1])
+        if reuse:
+            lat = np.load(os.path.join(out_dir, "lat.npy"))
+            lon = np.load(os.path.join(out_dir, "lon.npy"))
+            units = dict(old.get("units", {}))
+            old_arrays = {name: np.load(os.path.join(out_dir, f"{name}.npy"), mmap_mode="r") for name in units}
+        else:
+            g0 = _group(handles[fresh[0]], spec["group"])
+            lat = np.asarray(g0.variables["lat"][:], dtype=np.float64)
+            lon = np.asarray(g0.variables["lon"][:], dtype=np.float64)
+            units = {name: getattr(g0.variables[name], "units", "") or ""
+                     for name in spec["vars"] if name in g0.variables}
+        np.save(os.path.join(tmp_dir, "lat.npy"), lat)
+        np.save(os.path.join(tmp_dir, "lon.npy"), lon)
+
+        for name in units:
+            arrays[name] = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, f"{name}.npy"), mode="w+",
+                dtype=np.float32, shape=(len(lat), len(lon), len(files)))
+
+        print(f"📦 {product}: {len(files)} months ({len(fresh)} read from granules, {len(reuse)} reused), "
+              f"{len(lat)}x{len(lon)} grid, {len(arrays)} vars")
+        new_cols, old_cols = list(reuse), list(reuse.values())
+        for r0 in range(0, len(lat), BAND_ROWS):
+            rows = slice(r0, min(r0 + BAND_ROWS, len(lat)))
+            for name, arr in arrays.items():
+                band = np.full((rows.stop - rows.start, len(lon), len(files)), np.nan, dtype=np.float32)
+                if reuse:
+                    band[:, :, new_cols] = np.asarray(old_arrays[name][rows])[:, :, old_cols]
+                for t, ds in handles.items():
+                    field = _read_rows(ds, spec["group"], name, rows)
+                    if field is not None and field.shape == band.shape[:2]:
+                        band[:, :, t] = field
+                arr[rows] = band
+        for arr in arrays.values():
+            arr.flush()
+
+        meta = {
+            "product": product,
+            "times": times,
+            "sources": [os.path.basename(p) for _, p in files],
+            "stamps": stamps,
+            "units": units,
+            "layout": "lat,lon,time",
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+    finally:
+        arrays.clear()
+        old_arrays.clear()
+        for ds in handles.values():
+            try: ds.close()
+            except: pass
+
+    if not swap:
+        print(f"🗂️ {product} staged → {tmp_dir}")
+        return tmp_dir
+    return swap_product(product, out_root)
+
+
+def swap_product(product, out_root=STORE_ROOT):
+    """
+    <product>.tmp 換上線：舊的先改名成 .old 再刪，沒有「舊的已刪、新的還沒到」的空窗。
+    正在服務的 process 手上的 memmap 指向舊檔的 inode，刪掉也能讀完；
+    meta.json 換了，下一次 open_store 就開新的。
+    """
+    out_dir = os.path.join(out_root, product)
+    tmp_dir, old_dir = out_dir + ".tmp", out_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_root == STORE_ROOT:
+        _staged.pop(product, None)
+    print(f"✅ {product} → {out_dir}")
+    return out_dir
+
+
+# ==============================
+# Query
+# ==============================
+_open_stores = {}
+_staged = {}   # product -> staged store 目錄（只有 utils/update.py 的訓練會設）
+
+
+def use_staged(dirs):
+    """
+    之後這個 process 的 open_store / product_version 讀 dirs 裡的 staged store（{product: dir}），
+    空 dict 還原。ProcessPoolExecutor 的 initializer 也用這個，讓 worker 看到一樣的資料。
+    """
+    _staged.clear()
+    _staged.update(dirs)
+    reset_data_version()
+
+
+def staged():
+    return dict(_staged)
+
+
+def store_root():
+    """讀取用的 store 目錄：request pin 住的 snapshot 裡的（utils/snapshots.py），否則 ./data/store"""
+    return os.path.join(data_root(), "store")
+
+
+def _store_dir(product, root=None):
+    root = root or store_root()
+    if root == STORE_ROOT and product in _staged:
+        return _staged[product]
+    return os.path.join(root, product)
+
+
+def open_store(product, root=None):
+    """回傳已 mmap 的 store（meta.json 換掉時自動重開）；沒建過則回傳 None"""
+    store_dir = _store_dir(product, root)
+    meta_path = os.path.join(store_dir, "meta.json")
+    try:
+        st = os.stat(meta_path)
+    except OSError:
+        return None
+    mtime = (st.st_ino, st.st_mtime_ns)   # swap 後是另一個檔，mtime 剛好一樣也分得出來
+
+    key = store_dir
+    cached = _open_stores.get(key)
+    if cached is not None and cached["mtime"] == mtime:
+        return cached
+
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    for gone in [k for k in _open_stores if not os.path.isdir(k)]:   # gc 掉的 snapshot、換下來的 store
+        del _open_stores[gone]
+    store = {
+        "mtime": mtime,
+        "times": [datetime.strptime(t, "%Y-%m") for t in meta["times"]],
+        "units": meta.get("units", {}),
+        "lat": np.load(os.path.join(store_dir, "lat.npy")),
+        "lon": np.load(os.path.join(store_dir, "lon.npy")),
+        "vars": {name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r")
+                 for name in meta.get("units", {})},
+    }
+    _open_stores[key] = store
+    return store
+
+
+def store_units(product):
+    store = open_store(product)
+    return dict(store["units"]) if store is not None else {}
+
+
+def product_units(product):
+    """變數單位：store 優先，否則讀第一個月檔的 attribute"""
+    store = open_store(product)
+    if store is not None:
+        return dict(store["units"])
+    files = find_monthly_files(product, 0, 9999)
+    if not files:
+        return {}
+    ds = nc.Dataset(files[0][1])
+    try:
+        g = _group(ds, PRODUCTS[product]["group"])
+        return {n: getattr(g.variables[n], "units", "") or "" for n in PRODUCTS[product]["vars"] if n in g.variables}
+    finally:
+        ds.close()
+
+
+def read_point_series(product, lat, lon, variables=None, method="nearest"):
+    """
+    回傳 {(year, month): {var: value}}，每個變數一次連續讀取。
+    method="bilinear" 時用周圍 4 個格點內插（utils/grids.py）。
+    沒有 store 時回傳 None，呼叫端應退回直接讀原始檔。
+    """
+    store = open_store(product)
+    if store is None:
+        return None
+    grid = grid_from_coords(store["lat"], store["lon"])
+    names = [n for n in (variables or store["vars"]) if n in store["vars"]]
+    if method == "bilinear":
+        li, xi, w = grid.bilinear(lat, lon)
+        cols = {n: bilinear_weighted(store["vars"][n][li:li + 2, xi:xi + 2, :], w) for n in names}
+    else:
+        li, xi = grid.nearest(lat, lon)
+        cols = {n: np.asarray(store["vars"][n][li, xi, :], dtype=np.float64) for n in names}
+    out = {}
+    for t, when in enumerate(store["times"]):
+        out[(when.year, when.month)] = {n: float(v[t]) for n, v in cols.items()}
+    return out
+
+
+_grid_coords = {}
+
+
+def grid_coords(product):
+    """(lats, lons) of a monthly product；座標不會變，只讀一次（store 優先，否則第一個月檔）"""
+    if product in _grid_coords:
+        return _grid_coords[product]
+    store = open_store(product)
+    if store is not None:
+        coords = (store["lat"], store["lon"])
+    else:
+        files = find_monthly_files(product, 0, 9999)
+        if not files:
+            return None
+        ds = nc.Dataset(files[0][1])
+        try:
+            g = _group(ds, PRODUCTS[product]["group"])
+            coords = (np.asarray(g.variables["lat"][:]), np.asarray(g.variables["lon"][:]))
+        finally:
+            ds.close()
+    _grid_coords[product] = coords
+    return coords
+
+
+def snap_to_grid(product, lat, lon):
+    """最近格點的 (lat_idx, lon_idx)；找不到該 product 的資料時回傳 None"""
+    coords = grid_coords(product)
+    if coords is None:
+        return None
+    return grid_from_coords(*coords).nearest(lat, lon)
+
+
+def read_var_points(var, li, xi):
+    """
+    一次讀出 N 個點：先切出包住所有點的最小矩形（一次 I/O），再在記憶體裡逐點取值。
+    點很分散（矩形比實際用到的 row × col 大很多）時改用 orthogonal indexing，
+    只讀用到的那些 row / col。netCDF4 的整數陣列索引是 orthogonal 的，不能直接 var[0, li, xi]。
+    """
+    r0, r1 = int(li.min()), int(li.max()) + 1
+    c0, c1 = int(xi.min()), int(xi.max()) + 1
+    rows, cols = slice(r0, r1), slice(c0, c1)
+    pick_r, pick_c = li - r0, xi - c0
+    uli, inv_l = np.unique(li, return_inverse=True)
+    uxi, inv_x = np.unique(xi, return_inverse=True)
+    if (r1 - r0) * (c1 - c0) > 4 * len(uli) * len(uxi):
+        rows, cols, pick_r, pick_c = uli, uxi, inv_l, inv_x
+    if var.ndim == 3:
+        if "lat" in var.dimensions[1].lower():
+            block = var[0, rows, cols]
+        else:
+            block = var[0, cols, rows].T   # IMERG: (time, lon, lat)
+    elif var.ndim == 2:
+        block = var[rows, cols]
+    else:
+        return np.full(len(li), np.nan)
+    block = np.ma.filled(np.ma.asarray(block).astype(np.float64), np.nan)
+    return block[pick_r, pick_c]
+
+
+@metrics.stage("extract")
+def read_points_series(product, lats, lons, variables=None, year_from=0, year_to=9999):
+    """
+    read_point_series 的 N 點版：回傳 (times, {var: ndarray (N, T)})。
+    有 store 時是一次 fancy-index；沒有時每個月檔只開一次。成本跟檔案數成正比，和點數幾乎無關。
+    """
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    names = variables or PRODUCTS[product]["vars"]
+
+    store = open_store(product)
+    if store is not None:
+        li, xi = grid_from_coords(store["lat"], store["lon"]).nearest(lats, lons)
+        keep = [t for t, when in enumerate(store["times"]) if year_from <= when.year <= year_to]
+        cols = {n: np.asarray(store["vars"][n][li, xi, :], dtype=np.float64)[:, keep]
+                for n in names if n in store["vars"]}
+        return [store["times"][t] for t in keep], cols
+
+    coords = grid_coords(product)
+    files = find_monthly_files(product, year_from, year_to)
+    if coords is None or not files:
+        return [], {}
+    li, xi = grid_from_coords(*coords).nearest(lats, lons)
+    cols = {n: np.full((len(lats), len(files)), np.nan) for n in names}
+    for t, (_, fpath) in enumerate(files):
+        ds = metrics.open_dataset(fpath, product)
+        try:
+            g = _group(ds, PRODUCTS[product]["group"])
+            for n in names:
+                if n in g.variables:
+                    cols[n][:, t] = read_var_points(g.variables[n], li, xi)
+        finally:
+            ds.close()
+    return [when for when, _ in files], cols
+
+
+_version_state = {}   # data root -> (checked, {product: version})
+
+
+def product_version(product):
+    """
+    一個 product 目前提供服務的資料的指紋：有 store 時是 meta.json 的內容（月份 + 每個月檔的 stamp），
+    所以新月檔放進來、store 還沒更新前 version 不變；沒有 store 時是 catalog 裡每個月檔的 (path, size, mtime)。
+    """
+    h = hashlib.sha1()
+    try:
+        with open(os.path.join(_store_dir(product), "meta.json"), "rb") as f:
+            h.update(f.read())
+    except OSError:
+        root = data_root()
+        for _, fpath in find_monthly_files(product, 0, 9999):
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            # 相對路徑：snapshot 裡 hardlink 的同一批檔案算出來一樣，模型 version 對得上
+            h.update(f"{os.path.relpath(fpath, root)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:12]
+
+
+def product_versions():
+    """
+    {product: product_version}；./data 的最多快取 DATA_VERSION_CHECK_SECONDS 秒，避免每個 request 都去 stat。
+    snapshot 不會變，算一次就好。
+    """
+    root, now = data_root(), time.monotonic()
+    cached = _version_state.get(root)
+    if cached is not None and (root != BASE_DIR or now - cached[0] < DATA_VERSION_CHECK_SECONDS):
+        return cached[1]
+
+    if root == BASE_DIR:
+        # 順便讓 catalog 跟上手動放進 / 刪掉的月檔（沒變的檔案只有 stat）
+        catalog.refresh(BASE_DIR, products=list(PRODUCTS))
+    for gone in [k for k in _version_state if not os.path.isdir(k)]:
+        del _version_state[gone]
+    versions = {product: product_version(product) for product in PRODUCTS}
+    _version_state[root] = (now, versions)
+    return versions
+
+
+def monthly_data_version(products=None):
+    """products（預設全部）的合併指紋"""
+    versions = product_versions()
+    raw = "|".join(f"{p}={versions[p]}" for p in (products or PRODUCTS))
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def reset_data_version():
+    """下一次 monthly_data_version 重新計算（store 換掉之後）"""
+    _version_state.clear()
+
+
+# ==============================
+# CLI
+# ==============================
+def main_cli():
+    p = argparse.ArgumentParser(description="Repack monthly NetCDF/HDF5 archives into a point store")
+    sub = p.add_subparsers(dest="cmd")
+    build = sub.add_parser("build", help="build the store, or append new / changed months to it")
+    build.add_argument("--product", choices=list(PRODUCTS), help="only this product (default: all)")
+    build.add_argument("--year-from", type=int, default=0)
+    build.add_argument("--year-to", type=int, default=9999)
+    build.add_argument("--full", action="store_true", help="re-read every granule instead of reusing the store")
+    args = p.parse_args()
+
+    if args.cmd == "build":
+        products = [args.product] if args.product else list(PRODUCTS)
+        for product in products:
+            build_product(product, args.year_from, args.year_to, full=args.full)
+        return
+    p.print_help()
+
+
+if __name__ == "__main__":
+    main_cli()
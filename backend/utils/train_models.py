@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Offline training job for per-grid-cell model artifacts (see utils/models.py).
+
+Usage（在 backend/ 底下執行）：
+    python -m utils.train_models                         # config.MODEL_REGIONS
+    python -m utils.train_models --bbox 24.5,121,25.5,122 --kind temperature --jobs 4
+    python -m utils.train_models --force                 # 已存在的 artifact 也重訓
+    FORECAST_BACKEND=harmonic python -m utils.train_models   # 先讀完所有格點，再一次 lstsq fit
+
+每個 kind 有自己的 model version（utils/models.py）；新月份進來時 utils/update.py 只重訓 version 變了的 kind。
+"""
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.config import MODEL_REGIONS
+from utils.forecasting import get_backend
+from utils.ingest import parse_regions
+from utils.models import BASELINE_GRIDS, KIND_GRID, artifact_path, model_version, save_artifact
+from utils.store import grid_coords, staged, use_staged
+
+KINDS = list(KIND_GRID)
+
+
+def region_cells(product, bbox):
+    """bbox 內該 product 網格的所有格點 → [(lat_idx, lon_idx, lat, lon)]"""
+    coords = grid_coords(product)
+    if coords is None:
+        return []
+    lats, lons = coords
+    lat_min, lon_min, lat_max, lon_max = bbox
+    li = np.where((lats >= lat_min) & (lats <= lat_max))[0]
+    xi = np.where((lons >= lon_min) & (lons <= lon_max))[0]
+    return [(int(i), int(j), float(lats[i]), float(lons[j])) for i in li for j in xi]
+
+
+def _span(values, i):
+    """最近格點是 values[i] 的座標範圍"""
+    step = float(values[1] - values[0]) if len(values) > 1 else 0.0
+    lo = (values[i - 1] + values[i]) / 2 if i > 0 else values[i] - step / 2
+    hi = (values[i] + values[i + 1]) / 2 if i + 1 < len(values) else values[i] + step / 2
+    return float(lo), float(hi)
+
+
+def kind_cells(kind, bbox):
+    """
+    bbox 內這個 kind 的所有 cell → [(cell, lat, lon)]；(lat, lon) 是 cell 裡的一點，load_cell 用它讀資料。
+    baseline 的 cell 是 daily.grid_cell：把各網格的分界線疊起來切 bbox，每一小格的中心點各查一次
+    """
+    if kind != "baseline":
+        return [((li, xi), lat, lon) for li, xi, lat, lon in region_cells(KIND_GRID[kind], bbox)]
+    from day.daily import grid_cell
+    lat_min, lon_min, lat_max, lon_max = bbox
+    lat_cuts, lon_cuts = {lat_min, lat_max}, {lon_min, lon_max}
+    for product in BASELINE_GRIDS:
+        coords = grid_coords(product)
+        if coords is None:
+            continue
+        lats, lons = (np.sort(c) for c in coords)
+        lat_cuts.update(float(v) for v in (lats[1:] + lats[:-1]) / 2 if lat_min < v < lat_max)
+        lon_cuts.update(float(v) for v in (lons[1:] + lons[:-1]) / 2 if lon_min < v < lon_max)
+    lat_cuts, lon_cuts = sorted(lat_cuts), sorted(lon_cuts)
+    cells = {}
+    for lat in ((a + b) / 2 for a, b in zip(lat_cuts, lat_cuts[1:])):
+        for lon in ((a + b) / 2 for a, b in zip(lon_cuts, lon_cuts[1:])):
+            cells.setdefault(grid_cell(lat, lon), (lat, lon))
+    return [(cell, lat, lon) for cell, (lat, lon) in cells.items()]
+
+
+def cell_center(kind, cell):
+    """cell 裡的一點：格點中心；baseline 是三個網格格點範圍交集的中心"""
+    if kind != "baseline":
+        lats, lons = grid_coords(KIND_GRID[kind])
+        return float(lats[cell[0]]), float(lons[cell[1]])
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    for product, sub in zip(BASELINE_GRIDS, cell):
+        coords = grid_coords(product) if sub is not None else None
+        if coords is None:
+            continue
+        lats, lons = coords
+        lo, hi = _span(lats, sub[0])
+        lat_lo, lat_hi = max(lat_lo, min(lo, hi)), min(lat_hi, max(lo, hi))
+        lo, hi = _span(lons, sub[1])
+        lon_lo, lon_hi = max(lon_lo, min(lo, hi)), min(lon_hi, max(lo, hi))
+    return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2
+
+
+def load_cell(kind, lat, lon):
+    """跟 endpoint 當場訓練用的是同一組 load_history"""
+    if kind == "temperature":
+        from month import temperature
+        return temperature.load_history(lat, lon)
+    if kind == "precipitation":
+        from month import precipitation
+        return precipitation.load_history(lat, lon)
+    if kind == "air_quality":
+        from month import air
+        return air.load_history(lat, lon)
+    if kind == "baseline":
+        from day import daily
+        return daily.load_monthly_records(lat, lon)
+    raise ValueError(f"unknown kind: {kind}")
+
+
+def model_spec(kind):
+    """month/*.py 的 MODEL_SPEC（baseline 另外處理）"""
+    if kind == "temperature":
+        from month import temperature
+        return temperature.MODEL_SPEC
+    if kind == "precipitation":
+        from month import precipitation
+        return precipitation.MODEL_SPEC
+    if kind == "air_quality":
+        from month import air
+        return air.MODEL_SPEC
+    raise ValueError(f"unknown kind: {kind}")
+
+
+def fit_many(kind, histories, backend=None, **overrides):
+    """
+    每個格點的 load_cell 結果 → 每個格點的 models；harmonic 會把時間軸相同的格點一次解完。
+    overrides 蓋過 MODEL_SPEC（utils/evaluate_models.py 用）
+    """
+    backend = get_backend(backend)
+    if kind != "baseline":
+        return backend.fit_many(histories, **dict(model_spec(kind), **overrides))
+    from day import daily
+    out = [{} for _ in histories]
+    for m in range(1, 13):
+        frames = [(i, daily.baseline_frame(df, m)) for i, df in enumerate(histories)]
+        frames = [(i, f) for i, f in frames if f is not None]
+        fits = backend.fit_many([f for _, f in frames], **dict(daily.BASELINE_SPEC, months=[m], **overrides))
+        for (i, _), fitted in zip(frames, fits):
+            out[i][m] = fitted
+    return [{m: models.get(m) for m in range(1, 13)} for models in out]
+
+
+def fit_cell(kind, lat, lon, backend=None):
+    return fit_many(kind, [load_cell(kind, lat, lon)], backend)[0]
+
+
+def _train_one(task):
+    kind, cell, lat, lon, version = task
+    models = fit_cell(kind, lat, lon)
+    return save_artifact(kind, cell, models, version=version, center=(lat, lon))
+
+
+def _load_one(task):
+    kind, _, lat, lon, _ = task
+    return load_cell(kind, lat, lon)
+
+
+def _pool(jobs):
+    """worker 和這個 process 讀同一份資料（utils/update.py 訓練時是 staged store）"""
+    return ProcessPoolExecutor(max_workers=jobs, initializer=use_staged, initargs=(staged(),))
+
+
+def _train_batched(tasks, jobs):
+    """先讀完每個 kind 的所有格點，再一次 fit_many（讀檔可以平行，fit 本身是一個矩陣運算）"""
+    done = 0
+    for kind in dict.fromkeys(t[0] for t in tasks):
+        batch = [t for t in tasks if t[0] == kind]
+        if jobs > 1:
+            with _pool(jobs) as pool:
+                histories = list(pool.map(_load_one, batch, chunksize=16))
+        else:
+            histories = [_load_one(t) for t in batch]
+        for (_, cell, lat, lon, version), models in zip(batch, fit_many(kind, histories)):
+            done += 1
+            print(f"  [{done}/{len(tasks)}] {save_artifact(kind, cell, models, version=version, center=(lat, lon))}")
+
+
+def train(bboxes, kinds=KINDS, jobs=1, force=False, extra_cells=None):
+    """
+    bboxes 內的所有 cell，加上 extra_cells {kind: [cell]}（utils/update.py 用來把
+    舊 version 已有 artifact 的 cell 也重訓）。回傳 {kind: version}
+    """
+    versions = {kind: model_version(kind) for kind in kinds}
+    tasks = []
+    for kind in kinds:
+        cells = {cell: (lat, lon) for bbox in bboxes for cell, lat, lon in kind_cells(kind, bbox)}
+        for cell in (extra_cells or {}).get(kind, []):
+            if cell not in cells:
+                cells[cell] = cell_center(kind, cell)
+        for cell, (lat, lon) in cells.items():
+            if not force and os.path.exists(artifact_path(kind, cell, versions[kind])):
+                continue
+            tasks.append((kind, cell, lat, lon, versions[kind]))
+
+    print(f"🧠 {len(tasks)} artifacts to train → " + ", ".join(f"{k} {v}" for k, v in versions.items()))
+    if get_backend().batched:
+        _train_batched(tasks, jobs)
+    elif jobs > 1:
+        with _pool(jobs) as pool:
+            for i, path in enumerate(pool.map(_train_one, tasks), 1):
+                print(f"  [{i}/{len(tasks)}] {path}")
+    else:
+        for i, task in enumerate(tasks, 1):
+            print(f"  [{i}/{len(tasks)}] {_train_one(task)}")
+    print("✅ training finished")
+    return versions
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Train per-grid-cell forecast models offline")
+    p.add_argument("--bbox", help="lat_min,lon_min,lat_max,lon_max (default: MODEL_REGIONS)")
+    p.add_argument("--kind", choices=KINDS, action="append", help="repeatable; default all")
+    p.add_argument("--jobs", type=int, default=1)
+    p.add_argument("--force", action="store_true", help="retrain existing artifacts")
+    args = p.parse_args()
+
+    if args.bbox:
+        bboxes = [tuple(float(x) for x in args.bbox.split(","))]
+    else:
+        bboxes = list(parse_regions(MODEL_REGIONS).values())
+    train(bboxes, kinds=args.kind or KINDS, jobs=args.jobs, force=args.force)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental update after new granules land.
+
+新月份（或日檔）下載進 ./data 之後跑一次，只更新受影響的東西，服務不用重開、也不必全部重建：
+
+  1. catalog.refresh：找到新的 / 換過的 granule
+  2. point store：有變動的 product 增量 build 到 <product>.tmp（舊月份從現有 store 複製，只讀新月檔）
+  3. 模型：用 staged store 算新的 model version（每個 kind 各自一個），version 變了的 kind
+     才重訓，格點是舊 version 已經有 artifact 的那些
+  4. 換上新 store（目錄改名）。服務端 DATA_VERSION_CHECK_SECONDS 內看到新的 data version：
+     history / forecast 視窗（utils/periods.py）、artifact、response / plot cache key 一起移過去，
+     而新 version 的 artifact 已經訓練好了
+  5. anomaly cube：只重算有新日檔的年份
+  6. 刪掉更舊的 model version（剛換下來的那一個留著，給還在處理中的 request）
+  7. 有用 data snapshot（utils/snapshots.py）時：上面都只改 ./data，服務讀的是 snapshot，
+     最後凍結成新的 snapshot 並 activate，服務在一個時間點整批換過去；drain 完的舊 snapshot 刪掉
+
+沒有 point store 的部署，新月檔一進 catalog 服務就直接讀到（version 同時改變），
+這時第 3 步是事後補訓練，補完之前 endpoint 會當場 fit。
+
+Usage（在 backend/ 底下執行）：
+    python -m utils.update                 # 跑一次
+    python -m utils.update --dry-run       # 只列出會更新什麼
+    python -m utils.update --watch         # 每 UPDATE_INTERVAL 秒檢查一次（--watch 600 自訂）
+    python -m utils.update --jobs 4
+"""
+import os
+import time
+import argparse
+import traceback
+
+from utils import catalog, snapshots
+from utils.config import UPDATE_INTERVAL
+from utils.models import KIND_PRODUCTS, MODEL_ROOT, MODEL_SCHEMA, model_versions, prune_versions, trained_cells
+from utils.store import BASE_DIR, PRODUCTS, build_product, pending_months, reset_data_version, swap_product, use_staged
+
+
+def previous_version(kind, current):
+    """current 以外、最近訓練過這個 kind 的 version（同一個 MODEL_SCHEMA；沒有就 None）"""
+    if not os.path.isdir(MODEL_ROOT):
+        return None
+    schema = f"v{MODEL_SCHEMA}-"
+    found = [(os.path.getmtime(os.path.join(MODEL_ROOT, v, kind)), v) for v in os.listdir(MODEL_ROOT)
+             if v != current and v.startswith(schema) and os.path.isdir(os.path.join(MODEL_ROOT, v, kind))]
+    return max(found)[1] if found else None
+
+
+def pending_cubes():
+    """{kind: 有變動的年份}；只看已經建過的 cube"""
+    from day.anomaly_cube import KIND_VARS, cube_meta, year_stamps
+    from day.daily import CATALOG_DAILY
+    out = {}
+    for kind in KIND_VARS:
+        meta = cube_meta(kind)
+        if meta is None:
+            continue
+        old = meta.get("stamps") or {}
+        new = year_stamps(catalog.daily_files(CATALOG_DAILY[kind], data_root=BASE_DIR))
+        years = sorted(y for y in set(old) | set(new) if old.get(y) != new.get(y))
+        if years:
+            out[kind] = years
+    return out
+
+
+def update(jobs=1, dry_run=False):
+    t0 = time.perf_counter()
+    catalog.refresh(BASE_DIR)
+
+    # ---- 1. point store（只看已經建過的）----
+    pending = {p: pending_months(p) for p in PRODUCTS}
+    for product, months in pending.items():
+        if months:
+            print(f"🆕 {product}: {len(months)} new/changed months ({months[0]} … {months[-1]})")
+    cubes = pending_cubes()
+    for kind, years in cubes.items():
+        print(f"🆕 anomaly/{kind}: daily files changed in {', '.join(years)}")
+    if dry_run:
+        changed = {p for p, months in pending.items() if months}
+        kinds = [k for k, products in KIND_PRODUCTS.items() if changed & set(products)]
+        print(f"🔎 dry run: would retrain {', '.join(kinds) or 'nothing'}")
+        return None
+
+    staged = {}
+    for product, months in pending.items():
+        if months:
+            tmp_dir = build_product(product, swap=False)
+            if tmp_dir:
+                staged[product] = tmp_dir
+
+    # ---- 2. 用 staged store 重訓 version 變了的 kind ----
+    from utils.train_models import train
+    use_staged(staged)
+    try:
+        versions = model_versions()
+        previous, extra = {}, {}
+        for kind, version in versions.items():
+            if os.path.isdir(os.path.join(MODEL_ROOT, version, kind)):
+                continue
+            prev = previous_version(kind, version)
+            if prev is None:
+                continue   # 從來沒訓練過這個 kind：不自動開始
+            previous[kind] = prev
+            extra[kind] = trained_cells(kind, prev)
+        if extra:
+            train([], kinds=list(extra), jobs=jobs, extra_cells=extra)
+    finally:
+        # ---- 3. 換上新 store ----
+        for product in staged:
+            swap_product(product)
+        use_staged({})
+    reset_data_version()
+
+    # ---- 4. anomaly cube ----
+    if cubes:
+        from day.anomaly_cube import build_kind, cube_meta
+        for kind in cubes:
+            build_kind(kind, bbox=cube_meta(kind)["bbox"])
+
+    # ---- 5. 舊 model version（有重訓才清）----
+    if extra:
+        for name in prune_versions(set(versions.values()) | set(previous.values())):
+            print(f"🧹 removed model version {name}")
+
+    # ---- 6. snapshot 模式：整批上線 ----
+    if snapshots.current(force=True):
+        snapshots.create(activate_it=True)
+        for name in snapshots.gc():
+            print(f"🧹 removed snapshot {name}")
+
+    print(f"✅ update finished in {time.perf_counter() - t0:.1f}s: "
+          f"{len(staged)} stores, {len(extra)} model kinds, {len(cubes)} anomaly cubes")
+    return {"stores": list(staged), "models": {k: versions[k] for k in extra}, "cubes": list(cubes)}
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Append newly downloaded granules to the store, models and anomaly cube")
+    p.add_argument("--jobs", type=int, default=1, help="processes for retraining")
+    p.add_argument("--dry-run", action="store_true", help="only report what would be updated")
+    p.add_argument("--watch", type=float, nargs="?", const=UPDATE_INTERVAL, metavar="SECONDS",
+                   help=f"keep running, checking every SECONDS (default {UPDATE_INTERVAL:g})")
+    args = p.parse_args()
+
+    if not args.watch:
+        update(args.jobs, args.dry_run)
+        return
+    while True:
+        try:
+            update(args.jobs, args.dry_run)
+        except Exception:
+            traceback.print_exc()   # 下一輪再試；store / cube 都是 .tmp 換上，失敗不會留下半套
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main_cli()
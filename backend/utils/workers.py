@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Process pool + per-endpoint admission control for the CPU-bound request work.
+
+handler 是 async 的，真正的 forecast / sklearn / matplotlib 丟到 process pool 跑，
+event loop 不會被卡住，/api/health 這類便宜的 endpoint 一直有回應。
+工作用 "module:function" 字串指定，只在 worker 裡 import，server process 不必載入
+sklearn / matplotlib / xarray；warm_up() 在開機時先把 worker 起好、模組 import 好。
+
+每個 endpoint 一條 Lane：最多 N 個同時執行、M 個排隊，再多就直接丟 Saturated，
+main.py 轉成 503 + Retry-After（backpressure，而不是把 request 無限堆在記憶體裡）。
+"""
+import os
+import time
+import asyncio
+import logging
+import importlib
+import contextlib
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils import metrics, profiler, snapshots
+from utils.config import LANE_LIMITS, RETRY_AFTER_SECONDS, WORKER_PROCESSES, WORKER_START_METHOD
+from utils.log import setup_logging
+
+log = logging.getLogger(__name__)
+
+_pool = None
+_preload = ()
+_END = object()
+
+
+def _init_worker(preload):
+    setup_logging()
+    for name in preload:
+        importlib.import_module(name)
+
+
+def get_pool(preload=()):
+    """preload 只有第一次建立 pool 時有用（每個 worker 啟動時先 import 這些模組；pool 重建時沿用）"""
+    global _pool, _preload
+    if _pool is None:
+        _preload = tuple(preload) or _preload
+        _pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES,
+                                    mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+                                    initializer=_init_worker, initargs=(_preload,))
+    return _pool
+
+
+def _reset_pool(broken):
+    """有 worker 死掉（OOM、被 kill）整個 pool 就不能再用：丟掉，下一次 get_pool 重建"""
+    global _pool
+    if _pool is broken:
+        _pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+        metrics.inc("worker_pool_restarts_total")
+        log.warning("⚠️ worker process died, restarting the pool")
+
+
+async def _submit(*args):
+    """丟進 pool；pool 壞掉時重建並重試一次（同一個 job 再壞一次就照常丟出去）"""
+    loop = asyncio.get_running_loop()
+    for attempt in (1, 2):
+        pool = get_pool()
+        try:
+            return await loop.run_in_executor(pool, _execute, *args)
+        except BrokenProcessPool:
+            _reset_pool(pool)
+            if attempt == 2:
+                raise
+
+
+def _ready():
+    return os.getpid()
+
+
+async def warm_up(preload):
+    """建立 pool 並等所有 worker 啟動完（含 import preload）；回傳花了幾秒"""
+    t0 = time.perf_counter()
+    pool, loop = get_pool(preload), asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(pool, _ready) for _ in range(WORKER_PROCESSES)))
+    return time.perf_counter() - t0
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+_resolved = {}
+
+
+def resolve(fn):
+    """"module:function" → 函式（第一次用到才 import）；本來就是 callable 的原樣回傳"""
+    if not isinstance(fn, str):
+        return fn
+    f = _resolved.get(fn)
+    if f is None:
+        module, _, name = fn.partition(":")
+        f = _resolved[fn] = getattr(importlib.import_module(module), name)
+    return f
+
+
+def _execute(sampled, snapshot_id, fn, *args):
+    """worker 裡的入口：在 request pin 住的 data snapshot 裡執行，回傳 (結果, metrics snapshot, profile 或 None)"""
+    fn = resolve(fn)
+    with snapshots.pin(snapshot_id):
+        if sampled:
+            (result, prof), snap = metrics.collect(profiler.sample, fn, *args)
+            return result, snap, prof
+        result, snap = metrics.collect(fn, *args)
+    return result, snap, None
+
+
+def _finish(done, profile):
+    result, snap, prof = done
+    metrics.merge(snap)
+    if profile is not None and prof is not None:
+        profile.add(prof)
+    return result
+
+
+def _close_iterator(iterator):
+    close = getattr(iterator, "close", None)   # 不是每個 iterator 都有 close()
+    if close is None:
+        return
+    try:
+        close()
+    except ValueError:
+        pass   # 還在 thread 裡跑 next（client 中途斷線）：那一步做完 generator 就不會再被叫到
+
+
+class StreamBody:
+    """
+    Lane.stream 的結果：async iterator + close()。close 是同步的、可以重複呼叫，釋放 lane 名額、
+    snapshot 的 in-flight 計數和 iterator；body 沒開始送（client 先斷線）時 generator 的 finally
+    不會跑，所以由 response 結束時呼叫（main.LaneStreamingResponse）
+    """
+
+    def __init__(self, chunks, close):
+        self._chunks = chunks
+        self.close = close
+
+    def __aiter__(self):
+        return self._chunks
+
+
+class Saturated(Exception):
+    """Lane 已滿（執行中 + 排隊中都到上限）"""
+
+    def __init__(self, lane, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(f"{lane} is saturated")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name, max_concurrent, max_queue):
+        self.name = name
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self._sem = asyncio.Semaphore(self.max_concurrent)
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def _acquire(self):
+        """佔一個執行名額；執行中 + 排隊中都滿了就丟 Saturated"""
+        if self.running + self.waiting >= self.max_concurrent + self.max_queue:
+            self.rejected += 1
+            metrics.inc("lane_rejected_total", lane=self.name)
+            raise Saturated(self.name)
+        self.waiting += 1
+        t0 = time.perf_counter()
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        metrics.observe("stage_seconds", time.perf_counter() - t0, stage="queue_wait")
+        self.running += 1
+
+    def _release(self):
+        self.running -= 1
+        self._sem.release()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def run(self, fn, *args):
+        """在 process pool 執行 fn(*args)（fn 可以是 "module:function"）；worker 記到的 metrics（和 profile）併回這個 process"""
+        profile = profiler.current.get()
+        async with self.slot():
+            done = await _submit(profile is not None, snapshots.pinned.get(), fn, *args)
+        return _finish(done, profile)
+
+    async def gather(self, *calls):
+        """同一個 request 的多個獨立工作 [(fn, *args), ...]：佔一個名額，平行丟進 pool"""
+        profile, snapshot_id = profiler.current.get(), snapshots.pinned.get()
+        async with self.slot():
+            done = await asyncio.gather(*(_submit(profile is not None, snapshot_id, fn, *args) for fn, *args in calls))
+        return [_finish(d, profile) for d in done]
+
+    async def stream(self, iterator):
+        """
+        同步 iterator（逐月讀檔的 generator）在 thread 裡一個一個取。整段串流期間佔一個名額。
+        先取出第一個元素才回傳，所以 Saturated / 例外都在 response 開始前丟出；
+        iterator 是空的回傳 None，否則回傳 StreamBody（交給 main.LaneStreamingResponse）。
+        每次 next 都在呼叫當下的 context 裡跑：response 送完之前一直讀同一個 data snapshot，
+        而且一直算 in-flight（middleware 在 body 送出前就返回了，gc 不能只看它）。
+        """
+        await self._acquire()
+        resources = contextlib.ExitStack()
+        resources.callback(self._release)
+        resources.enter_context(snapshots.hold(snapshots.pinned.get()))
+        resources.callback(_close_iterator, iterator)
+        loop, ctx = asyncio.get_running_loop(), contextvars.copy_context()
+        try:
+            first = await loop.run_in_executor(None, ctx.run, next, iterator, _END)
+        except BaseException:
+            resources.close()
+            raise
+        if first is _END:
+            resources.close()
+            return None
+
+        async def chunks():
+            try:
+                yield first
+                while True:
+                    item = await loop.run_in_executor(None, ctx.run, next, iterator, _END)
+                    if item is _END:
+                        return
+                    yield item
+            finally:
+                resources.close()
+        return StreamBody(chunks(), resources.close)
+
+    def stats(self):
+        return {"running": self.running, "waiting": self.waiting, "rejected": self.rejected,
+                "max_concurrent": self.max_concurrent, "max_queue": self.max_queue}
+
+
+LANES = {name: Lane(name, *limits) for name, limits in LANE_LIMITS.items()}